@@ -17,15 +17,28 @@ while keeping the same hash.
 
 For some discussion on the specific design decisions here, see:
 https://github.com/rwth-i6/i6_experiments/issues/78
+
+There are two cache formats:
+
+- "py" (default): generated Python code, human-readable, via :class:`PythonCodeDumper`.
+  On every load, the hash of the object is recomputed and all paths are checked.
+- "pickle": binary, via pickle, where all jobs are replaced by fake jobs (:func:`make_fake_job`).
+  The hash and the list of paths (with their mtime) are stored next to the object,
+  so loading only needs to stat the paths.
+  Only if some path changed, we fall back to the full check (recompute hash, check all paths).
 """
 
-from typing import Any, Optional, TypeVar, Callable
+from typing import Any, Optional, TypeVar, Callable, Dict, List, Tuple
+from sisyphus import Job
 from sisyphus.hash import short_hash
 from sisyphus.tools import extract_paths
 from i6_experiments.common.utils.dump_py_code import PythonCodeDumper
 from i6_experiments.common.utils.diff import collect_diffs
+from i6_experiments.common.utils.memo_hash import memoized_sis_hash
+from i6_experiments.common.utils.fake_job import make_fake_job
 import os
 import sys
+import pickle
 import textwrap
 import importlib.util
 
@@ -34,7 +47,7 @@ T = TypeVar("T")
 
 
 # noinspection PyShadowingBuiltins
-def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
+def dependency_boundary(func: Callable[[], T], *, hash: Optional[str], cache_format: str = "py") -> T:
     """
     It basically returns func(), or some object which has the same hash.
 
@@ -44,6 +57,7 @@ def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
     :param hash: sisyphus.hash.short_hash(func()), or None if you do not know this value yet.
         This value is used to verify the hash of the object.
         For new code when the hash is not known yet, you would pass None here, and it will print the hash on stdout.
+    :param cache_format: "py" or "pickle", see module docstring
     :return: func(), or object with same hash
     """
     hash_via_user = hash
@@ -51,12 +65,17 @@ def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
     hash_via_cache = None
     cached_paths_available = False
 
-    cache_fn = get_cache_filename_for_func(func)
+    cache_fn = get_cache_filename_for_func(func, cache_format=cache_format)
     if os.path.exists(cache_fn):
         try:
-            obj_via_cache = load_obj_from_cache_file(cache_fn)
-            hash_via_cache = short_hash(obj_via_cache)
-            cached_paths_available = _paths_available(func, obj_via_cache)
+            if cache_format == "pickle":
+                obj_via_cache, hash_via_cache, cached_paths_available = _load_and_verify_pickle_cache_file(
+                    func, cache_fn
+                )
+            else:
+                obj_via_cache = load_obj_from_cache_file(cache_fn)
+                hash_via_cache = short_hash(obj_via_cache)
+                cached_paths_available = _paths_available(func, obj_via_cache)
         except Exception as exc:
             print(
                 f"Dependency boundary for {func.__qualname__}:"
@@ -75,66 +94,85 @@ def dependency_boundary(func: Callable[[], T], *, hash: Optional[str]) -> T:
     # In any case, need to check actual function.
     obj_via_func = func()
     assert obj_via_func is not None  # unexpected
-    hash_via_func = short_hash(obj_via_func)
-    print(f"Dependency boundary for {func.__qualname__}: hash of original object = {hash_via_func}")
+    # The objects are not modified anymore from here on, so we can memoize the hashes of all sub objects.
+    # This is relevant for collect_diffs below.
+    with memoized_sis_hash():
+        hash_via_func = short_hash(obj_via_func)
+        print(f"Dependency boundary for {func.__qualname__}: hash of original object = {hash_via_func}")
 
-    if not hash_via_user:
-        print(f"Dependency boundary for {func.__qualname__}: you should add the hash to the dependency_boundary call")
+        if not hash_via_user:
+            print(
+                f"Dependency boundary for {func.__qualname__}: you should add the hash to the dependency_boundary call"
+            )
 
-    if hash_via_user and hash_via_user != hash_via_func:
-        print(
-            f"Dependency boundary for {func.__qualname__}: error, given hash ({hash_via_user}) is invalid,"
-            " please fix the hash given to the dependency_boundary call"
-        )
+        if hash_via_user and hash_via_user != hash_via_func:
+            print(
+                f"Dependency boundary for {func.__qualname__}: error, given hash ({hash_via_user}) is invalid,"
+                " please fix the hash given to the dependency_boundary call"
+            )
 
-    if hash_via_cache and hash_via_cache != hash_via_func:
-        print(
-            f"Dependency boundary for {func.__qualname__}: error, cached hash {hash_via_cache} is invalid,"
-            " will recreate the cache"
-        )
-        hash_via_cache = None
-
-    if not hash_via_cache:
-        print(f"Dependency boundary for {func.__qualname__}: create or update cache {cache_fn!r}")
-        save_obj_to_cache_file(obj_via_func, cache_filename=cache_fn)
-        # Do some check that the dumped object has the same hash.
-        obj_via_cache = load_obj_from_cache_file(cache_fn)
-        hash_via_cache = short_hash(obj_via_cache)
-        if hash_via_func != hash_via_cache:
+        if hash_via_cache and hash_via_cache != hash_via_func:
             print(
-                f"Dependency boundary for {func.__qualname__}: error, dumping logic stores inconsistent object,"
-                f" dumped object hash {hash_via_cache}"
+                f"Dependency boundary for {func.__qualname__}: error, cached hash {hash_via_cache} is invalid,"
+                " will recreate the cache"
             )
-            print("Differences:")
-            diffs = collect_diffs("obj", obj_via_func, obj_via_cache)
-            if diffs:
-                for diff in diffs:
-                    print(diff)
-            else:
-                print("(No differences detected?)")
-            if hash_via_cache == hash_via_user:
+            hash_via_cache = None
+
+        if not hash_via_cache:
+            print(f"Dependency boundary for {func.__qualname__}: create or update cache {cache_fn!r}")
+            save_obj_to_cache_file(obj_via_func, cache_filename=cache_fn, sis_hash=hash_via_func)
+            # Do some check that the dumped object has the same hash.
+            obj_via_cache = load_obj_from_cache_file(cache_fn)
+            hash_via_cache = short_hash(obj_via_cache)
+            if hash_via_func != hash_via_cache:
                 print(
-                    f"Dependency boundary for {func.__qualname__}:"
-                    f" error, user provided hash is matching to wrong cache!"
+                    f"Dependency boundary for {func.__qualname__}: error, dumping logic stores inconsistent object,"
+                    f" dumped object hash {hash_via_cache}"
                 )
-                os.remove(cache_fn)  # make sure it is not used
+                print("Differences:")
+                diffs = collect_diffs("obj", obj_via_func, obj_via_cache, skip_equal_hash=True)
+                if diffs:
+                    for diff in diffs:
+                        print(diff)
+                else:
+                    print("(No differences detected?)")
+                if hash_via_cache == hash_via_user:
+                    print(
+                        f"Dependency boundary for {func.__qualname__}:"
+                        f" error, user provided hash is matching to wrong cache!"
+                    )
+                    os.remove(cache_fn)  # make sure it is not used
 
     return obj_via_func
 
 
-def get_cache_filename_for_func(func: Callable[[], T]) -> str:
+def get_cache_filename_for_func(func: Callable[[], T], *, cache_format: str = "py") -> str:
     """
-    :return: filename of autogenerated Python file
+    :return: filename of autogenerated Python file, or of the pickle file
     """
+    assert cache_format in _cache_format_ext, f"invalid cache_format {cache_format!r}"
     mod = sys.modules[getattr(func, "__module__")]
     mod_dir = os.path.dirname(os.path.abspath(mod.__file__))
-    return f"{mod_dir}/_dependency_boundary_autogenerated_cache.{mod.__name__.split('.')[-1]}.{func.__qualname__}.py"
+    return (
+        f"{mod_dir}/_dependency_boundary_autogenerated_cache.{mod.__name__.split('.')[-1]}.{func.__qualname__}"
+        f".{_cache_format_ext[cache_format]}"
+    )
+
 
+_cache_format_ext = {"py": "py", "pickle": "pkl"}
 
-def save_obj_to_cache_file(obj: Any, *, cache_filename: str) -> None:
+
+def save_obj_to_cache_file(obj: Any, *, cache_filename: str, sis_hash: Optional[str] = None) -> None:
     """
-    Save object.
+    Save object. The format is determined by the filename extension.
+
+    :param obj:
+    :param cache_filename:
+    :param sis_hash: short_hash(obj), stored in the pickle format. computed if not given
     """
+    if cache_filename.endswith(".pkl"):
+        _save_obj_to_pickle_cache_file(obj, cache_filename=cache_filename, sis_hash=sis_hash or short_hash(obj))
+        return
     with open(cache_filename, "w") as cache_f:
         cache_f.write(
             textwrap.dedent(
@@ -154,6 +192,8 @@ def load_obj_from_cache_file(cache_filename: str) -> Any:
     """
     :return: previously saved object
     """
+    if cache_filename.endswith(".pkl"):
+        return _read_pickle_cache_file(cache_filename)["obj"]
     cache_fn_mod_name = cache_filename.lstrip("/").replace("/", ".")
     spec = importlib.util.spec_from_file_location(cache_fn_mod_name, cache_filename)
     cache_fn_mod = importlib.util.module_from_spec(spec)
@@ -175,3 +215,99 @@ def _paths_available(func, obj: Any) -> bool:
             # No need to print this for all paths, just the first one is enough.
             return False
     return True
+
+
+_PickleCacheVersion = 1
+
+
+def _save_obj_to_pickle_cache_file(
+    obj: Any, *, cache_filename: str, sis_hash: str, paths_stat: Optional[List[Tuple[str, Optional[int]]]] = None
+) -> None:
+    """
+    Save object together with its hash and the stat info of all its paths.
+    Writes to a temp file first, so that a concurrent reader never sees a partial file.
+    """
+    if paths_stat is None:
+        paths_stat = _get_paths_stat(obj)
+    tmp_filename = f"{cache_filename}.tmp{os.getpid()}"
+    with open(tmp_filename, "wb") as cache_f:
+        _FakeJobPickler(cache_f, protocol=pickle.HIGHEST_PROTOCOL).dump(
+            {"version": _PickleCacheVersion, "hash": sis_hash, "paths_stat": paths_stat, "obj": obj}
+        )
+    os.replace(tmp_filename, cache_filename)
+
+
+def _read_pickle_cache_file(cache_filename: str) -> Dict[str, Any]:
+    with open(cache_filename, "rb") as cache_f:
+        d = _FakeJobUnpickler(cache_f).load()
+    assert isinstance(d, dict) and d.get("version") == _PickleCacheVersion, f"invalid cache file {cache_filename!r}"
+    assert d["obj"] is not None
+    return d
+
+
+def _load_and_verify_pickle_cache_file(func, cache_filename: str) -> Tuple[Any, str, bool]:
+    """
+    :return: obj, hash, whether all paths are available.
+        If the stat info of all paths matches to the stored info, we just take the stored hash.
+        Otherwise, we do the full check, and update the stored stat info if that succeeds.
+    """
+    d = _read_pickle_cache_file(cache_filename)
+    obj = d["obj"]
+    if _paths_stat_unchanged(d["paths_stat"]):
+        return obj, d["hash"], True
+    print(f"Dependency boundary for {func.__qualname__}: paths changed, doing full check of cached object")
+    sis_hash = short_hash(obj)
+    paths_available = _paths_available(func, obj)
+    if paths_available and sis_hash == d["hash"]:
+        _save_obj_to_pickle_cache_file(obj, cache_filename=cache_filename, sis_hash=sis_hash)
+    return obj, sis_hash, paths_available
+
+
+def _get_paths_stat(obj: Any) -> List[Tuple[str, Optional[int]]]:
+    """
+    :return: list of (filename, mtime_ns) for all paths in obj. mtime_ns is None if the path is not available.
+    """
+    res = []
+    for path in sorted(extract_paths(obj), key=lambda p: p.get_path()):
+        filename = path.get_path()
+        res.append((filename, os.stat(filename).st_mtime_ns if path.available() else None))
+    return res
+
+
+def _paths_stat_unchanged(paths_stat: List[Tuple[str, Optional[int]]]) -> bool:
+    for filename, mtime_ns in paths_stat:
+        if mtime_ns is None:
+            return False
+        try:
+            if os.stat(filename).st_mtime_ns != mtime_ns:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+class _FakeJobPickler(pickle.Pickler):
+    """
+    Stores all jobs by (module, name, hash) only, to be restored as fake jobs via :func:`make_fake_job`.
+    This avoids indirect dependencies, same as ``PythonCodeDumper(use_fake_jobs=True)``.
+    """
+
+    def persistent_id(self, obj: Any) -> Optional[Tuple[str, str, str, str]]:
+        """persistent id"""
+        if isinstance(obj, Job):
+            # noinspection PyProtectedMember
+            _, sis_hash = os.path.basename(obj._sis_id()).split(".", 1)
+            return "job", type(obj).__module__, type(obj).__name__, sis_hash
+        return None
+
+
+class _FakeJobUnpickler(pickle.Unpickler):
+    """
+    Counterpart to :class:`_FakeJobPickler`
+    """
+
+    def persistent_load(self, pid: Tuple[str, str, str, str]) -> Job:
+        """persistent load"""
+        kind, module, name, sis_hash = pid
+        assert kind == "job", f"unexpected persistent id {pid!r}"
+        return make_fake_job(module=module, name=name, sis_hash=sis_hash)
@@ -0,0 +1,88 @@
+"""
+Benchmarks loading a :func:`dependency_boundary` cache on a synthetic large object,
+for the "py" and the "pickle" cache format, including the verification (hash, paths),
+as it is done on every Sisyphus manager start.
+
+Run as:
+
+    python -m i6_experiments.common.helpers.dependency_boundary_benchmark
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from sisyphus import tk
+from sisyphus.hash import short_hash
+
+from i6_experiments.common.utils.fake_job import make_fake_job
+from .dependency_boundary import (
+    save_obj_to_cache_file,
+    load_obj_from_cache_file,
+    _load_and_verify_pickle_cache_file,
+    _paths_available,
+)
+
+
+def synthetic_obj(*, num_paths: int, num_jobs: int, files_dir: str):
+    """
+    Nested dict with plain (existing) files, fake jobs and some config values,
+    similar to what a typical system init args object contains.
+    """
+    jobs = [
+        make_fake_job(module="i6_core.synthetic", name=f"SyntheticJob{i % 20}", sis_hash=f"{i:012d}")
+        for i in range(num_jobs)
+    ]
+    corpora = {}
+    for i in range(num_paths):
+        filename = f"{files_dir}/file{i}.txt"
+        with open(filename, "w"):
+            pass
+        corpora[f"corpus{i}"] = {
+            "path": tk.Path(filename),
+            "job": jobs[i % num_jobs],
+            "config": {"scale": i * 0.1, "name": f"corpus{i}", "segments": list(range(i % 10))},
+        }
+    return {"corpora": corpora, "jobs": jobs}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-paths", type=int, default=5_000)
+    parser.add_argument("--num-jobs", type=int, default=1_000)
+    parser.add_argument("--repetitions", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        obj = synthetic_obj(num_paths=args.num_paths, num_jobs=args.num_jobs, files_dir=tmp_dir)
+        sis_hash = short_hash(obj)
+
+        def _load_py(cache_fn: str):
+            obj_ = load_obj_from_cache_file(cache_fn)
+            return short_hash(obj_), _paths_available(synthetic_obj, obj_)
+
+        def _load_pickle(cache_fn: str):
+            _, hash_, paths_available = _load_and_verify_pickle_cache_file(synthetic_obj, cache_fn)
+            return hash_, paths_available
+
+        for name, ext, load in [("py", "py", _load_py), ("pickle", "pkl", _load_pickle)]:
+            cache_fn = f"{tmp_dir}/cache_{name}.{ext}"
+            save_obj_to_cache_file(obj, cache_filename=cache_fn, sis_hash=sis_hash)
+
+            start = time.perf_counter()
+            for _ in range(args.repetitions):
+                res = load(cache_fn)
+            elapsed = (time.perf_counter() - start) / args.repetitions
+
+            assert res == (sis_hash, True), f"{name}: unexpected result {res}, expected hash {sis_hash}"
+            print(
+                f"{name:>8}: {elapsed * 1000:10.2f}ms per load of {args.num_paths} paths,"
+                f" file size {os.path.getsize(cache_fn) / 1024:.1f}KB"
+            )
+
+    print("hashes are identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""
+Helpers to read, write and rearrange HDF files in the RETURNN SimpleHDF format, as used by ``HDFDataset``:
+
+- ``inputs``: all sequences concatenated along the time axis, shape [sum(T), ...]
+- ``targets/data/<key>``: same for additional data keys, ``targets/size`` and ``targets/labels`` with meta data
+- ``seqTags``: [N]
+- ``seqLengths``: [N, 1 + num_target_keys], columns: inputs, then the target keys in sorted order
+
+:class:`SimpleHDFReader` builds the index tag -> (offset, length) once and returns NumPy views of the sequences,
+with memory-mapping of contiguous uncompressed datasets.
+:class:`BufferedSimpleHDFWriter` collects many sequences into one ``insert_batch`` of a RETURNN ``SimpleHDFWriter``.
+:func:`select_seqs`, :func:`filter_seqs` and :func:`concat_hdfs` write new files by copying contiguous blocks.
+
+This module does not depend on Sisyphus or RETURNN, so it can be used within the jobs as well as within RETURNN.
+"""
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import h5py
+import numpy as np
+
+
+def _decode_tag(tag: Union[str, bytes]) -> str:
+    return tag.decode("utf8") if isinstance(tag, bytes) else tag
+
+
+def _memmap_dataset(filename: str, dataset: h5py.Dataset) -> Optional[np.ndarray]:
+    """
+    :return: read-only memory-map of the dataset, or None if it is not stored contiguously and uncompressed
+    """
+    if dataset.chunks is not None or dataset.dtype.kind not in "biuf":
+        return None
+    offset = dataset.id.get_offset()
+    if offset is None:  # not allocated, e.g. empty
+        return None
+    return np.memmap(filename, mode="r", dtype=dataset.dtype, offset=offset, shape=dataset.shape)
+
+
+class SimpleHDFReader:
+    """
+    Random and sequential access to the sequences of a SimpleHDF file.
+
+    With ``mmap=True``, contiguous uncompressed datasets (e.g. written by :func:`select_seqs` or with h5py
+    ``create_dataset(data=...)``) are memory-mapped, and all returned sequences are zero-copy views.
+    Otherwise (e.g. the resizable chunked datasets of the RETURNN ``SimpleHDFWriter``) each :func:`get` reads
+    from the file, and :func:`iter_seqs` reads blocks of consecutive sequences at once.
+    """
+
+    def __init__(self, filename: str, *, mmap: bool = True):
+        """
+        :param filename:
+        :param mmap: memory-map the datasets if possible
+        """
+        self.filename = filename
+        self.mmap = mmap
+        self._file = h5py.File(filename, "r")
+
+        self._raw_tags = self._file["seqTags"][...]
+        self.tags: List[str] = [_decode_tag(tag) for tag in self._raw_tags]
+        self.tag_to_index: Dict[str, int] = {tag: idx for idx, tag in enumerate(self.tags)}
+
+        self.data_keys: List[str] = []
+        if "inputs" in self._file:
+            self.data_keys.append("inputs")
+        if "targets/data" in self._file:
+            self.data_keys.extend(sorted(self._file["targets/data"].keys()))
+
+        self._raw_seq_lengths = self._file["seqLengths"][...]
+        seq_lengths = self._raw_seq_lengths
+        if seq_lengths.ndim == 1:
+            seq_lengths = seq_lengths[:, None]
+        self._lengths: Dict[str, np.ndarray] = {}
+        self._offsets: Dict[str, np.ndarray] = {}
+        for column, key in enumerate(self.data_keys):
+            lengths = seq_lengths[:, min(column, seq_lengths.shape[1] - 1)].astype(np.int64)
+            self._lengths[key] = lengths
+            self._offsets[key] = np.concatenate([[0], np.cumsum(lengths)])
+        self._data: Dict[str, Union[np.ndarray, h5py.Dataset]] = {}
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self.tag_to_index
+
+    def __enter__(self) -> "SimpleHDFReader":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._data.clear()
+        self._file.close()
+
+    @staticmethod
+    def _dataset_name(key: str) -> str:
+        return key if key == "inputs" else f"targets/data/{key}"
+
+    def get_dataset(self, key: str = "inputs") -> h5py.Dataset:
+        """
+        :return: the underlying h5py dataset, e.g. for the dtype, the shape or the attrs
+        """
+        return self._file[self._dataset_name(key)]
+
+    def get_data(self, key: str = "inputs") -> Union[np.ndarray, h5py.Dataset]:
+        """
+        :return: the whole flat data, memory-mapped if possible, otherwise the h5py dataset
+        """
+        if key not in self._data:
+            dataset = self.get_dataset(key)
+            data = _memmap_dataset(self.filename, dataset) if self.mmap else None
+            self._data[key] = data if data is not None else dataset
+        return self._data[key]
+
+    def get_lengths(self, key: str = "inputs") -> np.ndarray:
+        """
+        :return: lengths of all sequences, [N]
+        """
+        return self._lengths[key]
+
+    def get_index(self, tag: str) -> int:
+        return self.tag_to_index[tag]
+
+    def get_offset_and_length(self, tag_or_index: Union[str, int], key: str = "inputs") -> Tuple[int, int]:
+        idx = self.tag_to_index[tag_or_index] if isinstance(tag_or_index, str) else tag_or_index
+        return int(self._offsets[key][idx]), int(self._lengths[key][idx])
+
+    def get(self, tag_or_index: Union[str, int], key: str = "inputs") -> np.ndarray:
+        """
+        :return: data of one sequence, [T, ...]
+        """
+        offset, length = self.get_offset_and_length(tag_or_index, key)
+        return self.get_data(key)[offset : offset + length]
+
+    def iter_blocks(
+        self, key: str = "inputs", indices: Optional[Sequence[int]] = None, *, chunk_size: int = 1_000_000
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Reads the given sequences in blocks. Each block is one contiguous read of consecutive sequences
+        with at most chunk_size frames (but at least one sequence).
+
+        :param key:
+        :param indices: sequence indices in the order to read them. By default all sequences
+        :param chunk_size: max number of frames per block
+        :return: iterator of (indices of the block [B], flat data [sum(T), ...])
+        """
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices, dtype=np.int64)
+        offsets, data = self._offsets[key], self.get_data(key)
+        # runs of consecutive indices, each run is contiguous in the data
+        run_starts = np.concatenate([[0], np.flatnonzero(np.diff(indices) != 1) + 1, [len(indices)]])
+        for run_start, run_end in zip(run_starts[:-1], run_starts[1:]):
+            while run_start < run_end:
+                first = indices[run_start]
+                last = indices[run_start:run_end][-1]
+                # number of sequences which fit into chunk_size
+                block_end = np.searchsorted(offsets[first + 1 : last + 2], offsets[first] + chunk_size, side="right")
+                block_end = run_start + max(int(block_end), 1)
+                block_indices = indices[run_start:block_end]
+                yield block_indices, data[offsets[block_indices[0]] : offsets[block_indices[-1] + 1]]
+                run_start = block_end
+
+    def iter_seqs(
+        self, key: str = "inputs", indices: Optional[Sequence[int]] = None, *, chunk_size: int = 1_000_000
+    ) -> Iterator[Tuple[str, np.ndarray]]:
+        """
+        :param key:
+        :param indices: sequence indices in the order to read them. By default all sequences
+        :param chunk_size: max number of frames which are read at once, see :func:`iter_blocks`
+        :return: iterator of (tag, data [T, ...]), the data are views into the block
+        """
+        offsets = self._offsets[key]
+        for block_indices, block in self.iter_blocks(key, indices, chunk_size=chunk_size):
+            block_offsets = offsets[block_indices] - offsets[block_indices[0]]
+            for idx, offset in zip(block_indices, block_offsets):
+                yield self.tags[idx], block[offset : offset + self._lengths[key][idx]]
+
+
+class BufferedSimpleHDFWriter:
+    """
+    Wraps a RETURNN ``SimpleHDFWriter`` (e.g. from ``i6_core.lib.hdf.get_returnn_simple_hdf_writer``)
+    and writes many sequences with one ``insert_batch`` call, instead of one call (and HDF write) per sequence.
+    The written file is the same.
+
+    Usage::
+
+        with BufferedSimpleHDFWriter(SimpleHDFWriter(filename, dim=dim, ndim=1)) as writer:
+            for tag, seq in ...:
+                writer.insert(seq, tag)
+    """
+
+    def __init__(self, writer: Any, *, max_buffer_frames: int = 100_000, max_buffer_seqs: int = 1000):
+        """
+        :param writer: RETURNN SimpleHDFWriter instance
+        :param max_buffer_frames: flush when this many frames are buffered
+        :param max_buffer_seqs: flush when this many sequences are buffered (limits the padding overhead)
+        """
+        self.writer = writer
+        self.max_buffer_frames = max_buffer_frames
+        self.max_buffer_seqs = max_buffer_seqs
+        self._seqs: List[np.ndarray] = []
+        self._tags: List[str] = []
+        self._num_frames = 0
+
+    def __enter__(self) -> "BufferedSimpleHDFWriter":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def insert(self, data: Union[np.ndarray, Sequence], tag: str):
+        """
+        :param data: one sequence, [T, ...], e.g. [T] for sparse data
+        :param tag:
+        """
+        data = np.asarray(data)
+        self._seqs.append(data)
+        self._tags.append(tag)
+        self._num_frames += len(data)
+        if self._num_frames >= self.max_buffer_frames or len(self._seqs) >= self.max_buffer_seqs:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all buffered sequences, padded into one batch.
+        """
+        if not self._seqs:
+            return
+        seq_lens = [len(seq) for seq in self._seqs]
+        first = self._seqs[0]
+        padded = np.zeros((len(self._seqs), max(seq_lens)) + first.shape[1:], dtype=first.dtype)
+        for i, seq in enumerate(self._seqs):
+            padded[i, : len(seq)] = seq
+        self.writer.insert_batch(padded, seq_lens, self._tags)
+        self._seqs, self._tags, self._num_frames = [], [], 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def _write_seqs(out_filename: str, parts: Sequence[Tuple[SimpleHDFReader, np.ndarray]], *, chunk_size: int):
+    """
+    Writes the given sequences of one or more files into a new SimpleHDF file, with contiguous datasets.
+    Root attrs, dataset attrs and the meta data in ``targets`` are taken from the first file,
+    only ``numSeqs`` and ``numTimesteps`` are updated.
+
+    :param out_filename:
+    :param parts: list of (reader, sequence indices)
+    :param chunk_size: max number of frames which are copied at once
+    """
+    first = parts[0][0]
+    for reader, _ in parts[1:]:
+        assert reader.data_keys == first.data_keys, f"data keys differ: {reader.data_keys} vs {first.data_keys}"
+        for key in first.data_keys:
+            dataset, first_dataset = reader.get_dataset(key), first.get_dataset(key)
+            assert dataset.shape[1:] == first_dataset.shape[1:] and dataset.dtype == first_dataset.dtype, (
+                f"{key} of {reader.filename} has shape {dataset.shape} and dtype {dataset.dtype},"
+                f" {key} of {first.filename} has shape {first_dataset.shape} and dtype {first_dataset.dtype}"
+            )
+
+    with h5py.File(out_filename, "w") as out:
+        for attr_key, attr_val in first._file.attrs.items():
+            out.attrs[attr_key] = attr_val
+        if "targets" in first._file:
+            targets = out.create_group("targets")
+            for attr_key, attr_val in first._file["targets"].attrs.items():
+                targets.attrs[attr_key] = attr_val
+            for name in first._file["targets"]:
+                if name != "data":
+                    first._file.copy(first._file["targets"][name], targets, name)
+            if "data" in first._file["targets"]:
+                targets.create_group("data")
+
+        for key in first.data_keys:
+            first_dataset = first.get_dataset(key)
+            total_len = sum(int(reader.get_lengths(key)[indices].sum()) for reader, indices in parts)
+            out_dataset = out.create_dataset(
+                SimpleHDFReader._dataset_name(key),
+                shape=(total_len,) + first_dataset.shape[1:],
+                dtype=first_dataset.dtype,
+            )
+            for attr_key, attr_val in first_dataset.attrs.items():
+                out_dataset.attrs[attr_key] = attr_val
+            pos = 0
+            for reader, indices in parts:
+                for _, block in reader.iter_blocks(key, indices, chunk_size=chunk_size):
+                    out_dataset[pos : pos + len(block)] = block
+                    pos += len(block)
+            assert pos == total_len
+
+        for name, values in [
+            ("seqTags", [reader._raw_tags[indices] for reader, indices in parts]),
+            ("seqLengths", [reader._raw_seq_lengths[indices] for reader, indices in parts]),
+        ]:
+            out.create_dataset(name, data=np.concatenate(values), dtype=first._file[name].dtype)
+            for attr_key, attr_val in first._file[name].attrs.items():
+                out[name].attrs[attr_key] = attr_val
+
+        num_seqs = sum(len(indices) for _, indices in parts)
+        if "numSeqs" in out.attrs:
+            out.attrs["numSeqs"] = num_seqs
+        if "numTimesteps" in out.attrs and "inputs" in first.data_keys:
+            out.attrs["numTimesteps"] = sum(int(reader.get_lengths()[indices].sum()) for reader, indices in parts)
+
+
+def select_seqs(
+    hdf_file: str, out_file: str, seq_tags: Iterable[str], *, ignore_missing: bool = False, chunk_size: int = 1_000_000
+):
+    """
+    Writes the given sequences, in the given order, into a new file.
+
+    :param hdf_file:
+    :param out_file:
+    :param seq_tags:
+    :param ignore_missing: skip tags which are not in hdf_file, otherwise raise a KeyError
+    :param chunk_size: max number of frames which are copied at once
+    """
+    with SimpleHDFReader(hdf_file) as reader:
+        if ignore_missing:
+            indices = [reader.tag_to_index[tag] for tag in seq_tags if tag in reader]
+        else:
+            indices = [reader.tag_to_index[tag] for tag in seq_tags]
+        _write_seqs(out_file, [(reader, np.array(indices, dtype=np.int64))], chunk_size=chunk_size)
+
+
+def filter_seqs(
+    hdf_file: str,
+    out_file: str,
+    predicate: Callable[[str, Dict[str, int]], bool],
+    *,
+    chunk_size: int = 1_000_000,
+):
+    """
+    Writes the sequences for which predicate is True into a new file, in the original order.
+    E.g. to remove empty sequences: ``filter_seqs(..., lambda tag, lengths: lengths["inputs"] > 0)``
+
+    :param hdf_file:
+    :param out_file:
+    :param predicate: (tag, lengths per data key) -> keep
+    :param chunk_size: max number of frames which are copied at once
+    """
+    with SimpleHDFReader(hdf_file) as reader:
+        lengths = {key: reader.get_lengths(key) for key in reader.data_keys}
+        indices = [
+            idx
+            for idx, tag in enumerate(reader.tags)
+            if predicate(tag, {key: int(key_lengths[idx]) for key, key_lengths in lengths.items()})
+        ]
+        _write_seqs(out_file, [(reader, np.array(indices, dtype=np.int64))], chunk_size=chunk_size)
+
+
+def concat_hdfs(hdf_files: Sequence[str], out_file: str, *, chunk_size: int = 1_000_000):
+    """
+    Writes all sequences of all files into one file, in the given order.
+    The files need the same data keys, feature shapes and dtypes.
+
+    :param hdf_files:
+    :param out_file:
+    :param chunk_size: max number of frames which are copied at once
+    """
+    readers = [SimpleHDFReader(hdf_file) for hdf_file in hdf_files]
+    try:
+        _write_seqs(out_file, [(reader, np.arange(len(reader))) for reader in readers], chunk_size=chunk_size)
+    finally:
+        for reader in readers:
+            reader.close()
@@ -0,0 +1,75 @@
+"""
+Test for the SimpleHDF helpers
+"""
+
+import h5py
+import numpy as np
+
+from .hdf import SimpleHDFReader, concat_hdfs, filter_seqs, select_seqs
+
+
+def _write_simple_hdf(filename, seqs, tags, *, chunked, targets=None):
+    """
+    Writes the SimpleHDF layout like the RETURNN SimpleHDFWriter (chunked=True) or contiguous (chunked=False).
+    """
+    lengths = [[len(seq)] + ([len(targets[i])] if targets is not None else []) for i, seq in enumerate(seqs)]
+    with h5py.File(filename, "w") as f:
+        f.attrs["numSeqs"] = len(seqs)
+        f.attrs["numTimesteps"] = sum(len(seq) for seq in seqs)
+        data = np.concatenate(seqs)
+        f.create_dataset("inputs", data=data, maxshape=(None,) + data.shape[1:] if chunked else None)
+        f["inputs"].attrs["foo"] = "bar"
+        f.create_dataset("seqTags", data=tags, dtype=h5py.special_dtype(vlen=str))
+        f.create_dataset("seqLengths", data=np.array(lengths, dtype="int32"))
+        f.create_group("targets/size").attrs["classes"] = [5, 1]
+        f.create_group("targets/labels")
+        if targets is not None:
+            f.create_dataset("targets/data/classes", data=np.concatenate(targets))
+
+
+def _make_seqs(num_seqs, dim=3):
+    rng = np.random.default_rng(42)
+    seqs = [rng.standard_normal((rng.integers(0, 10), dim)).astype("float32") for _ in range(num_seqs)]
+    targets = [rng.integers(0, 5, (rng.integers(1, 5),)).astype("int32") for _ in range(num_seqs)]
+    tags = ["corpus/seq-%i" % i for i in range(num_seqs)]
+    return seqs, targets, tags
+
+
+def test_reader(tmp_path):
+    seqs, targets, tags = _make_seqs(20)
+    for chunked in [False, True]:
+        filename = str(tmp_path / f"data_{chunked}.hdf")
+        _write_simple_hdf(filename, seqs, tags, chunked=chunked, targets=targets)
+        with SimpleHDFReader(filename) as reader:
+            assert isinstance(reader.get_data(), np.memmap) != chunked
+            assert reader.tags == tags and reader.data_keys == ["inputs", "classes"]
+            for i, tag in enumerate(tags):
+                np.testing.assert_array_equal(reader.get(tag), seqs[i])
+                np.testing.assert_array_equal(reader.get(i, "classes"), targets[i])
+            for chunk_size in [1, 7, 1000]:
+                read = list(reader.iter_seqs(indices=[5, 6, 7, 2, 3, 19], chunk_size=chunk_size))
+                assert [tag for tag, _ in read] == [tags[i] for i in [5, 6, 7, 2, 3, 19]]
+                for (_, seq), i in zip(read, [5, 6, 7, 2, 3, 19]):
+                    np.testing.assert_array_equal(seq, seqs[i])
+
+
+def test_select_filter_concat(tmp_path):
+    seqs, targets, tags = _make_seqs(20)
+    filename = str(tmp_path / "data.hdf")
+    _write_simple_hdf(filename, seqs, tags, chunked=True, targets=targets)
+
+    select_seqs(filename, str(tmp_path / "selected.hdf"), [tags[3], tags[1], tags[2]], chunk_size=4)
+    filter_seqs(filename, str(tmp_path / "filtered.hdf"), lambda tag, lengths: lengths["inputs"] > 0)
+    concat_hdfs([str(tmp_path / "selected.hdf"), str(tmp_path / "filtered.hdf")], str(tmp_path / "concat.hdf"))
+
+    expected = [3, 1, 2] + [i for i, seq in enumerate(seqs) if len(seq) > 0]
+    with SimpleHDFReader(str(tmp_path / "concat.hdf")) as reader:
+        assert reader.tags == [tags[i] for i in expected]
+        for tag, i in zip(reader.tags, expected):
+            np.testing.assert_array_equal(reader.get(tag), seqs[i])
+            np.testing.assert_array_equal(reader.get(tag, "classes"), targets[i])
+    with h5py.File(str(tmp_path / "concat.hdf"), "r") as f:
+        assert f.attrs["numSeqs"] == len(expected)
+        assert f.attrs["numTimesteps"] == sum(len(seqs[i]) for i in expected)
+        assert f["inputs"].attrs["foo"] == "bar"
+        assert list(f["targets/size"].attrs["classes"]) == [5, 1]
@@ -0,0 +1,386 @@
+"""
+Compact N-best lists with separate (unscaled) score components per hypothesis, and vectorized rescoring,
+e.g. to tune scales on the N-best lists of one wide beam recognition instead of recognizing with every scale.
+
+For the AM and LM scales of RASR lattices, i6_core's OptimizeAMandLMScaleJob already does this on the lattices
+(``opt_lm_am`` of the decoders). These helpers are meant for N-best lists with further score components,
+e.g. the prior and TDP costs of each hypothesis from forced alignments, see with_rank_scores.
+
+An N-best file is a numpy ``.npz`` archive with::
+
+    segments: [S] segment names
+    seg_offsets: [S + 1] index of the first hypothesis of each segment
+    hyp_offsets: [H + 1] index of the first word of each hypothesis
+    words: [W] index into vocab
+    vocab: [V] words
+    score_names: [C] names of the score components, e.g. "am", "lm"
+    scores: [H, C] costs, i.e. negative log probabilities, without scales
+
+The cost of a hypothesis with the scales s is ``scores @ s``. The edit distances of all hypotheses to the reference
+do not depend on the scales, so they are computed once, and rescoring with K scale vectors is a [K, C] x [C, H]
+matrix product followed by a segment wise argmin.
+
+N-best lists written by RASR as HTK SLF lattices can be read with read_htk_nbest_archive,
+the alignment scores of RASR alignment logs with read_rasr_alignment_scores.
+"""
+
+from typing import Dict, Iterator, List, Optional, Sequence, TextIO, Tuple
+from dataclasses import dataclass
+import gzip
+import math
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+
+@dataclass
+class NBestLists:
+    segments: List[str]
+    seg_offsets: np.ndarray
+    hyp_offsets: np.ndarray
+    words: np.ndarray
+    vocab: List[str]
+    score_names: List[str]
+    scores: np.ndarray
+
+    @classmethod
+    def from_hyps(
+        cls,
+        nbest: Dict[str, Sequence[Tuple[Sequence[str], Sequence[float]]]],
+        score_names: Sequence[str],
+    ) -> "NBestLists":
+        """
+        :param nbest: segment name -> list of (words, costs per score component)
+        :param score_names: names of the score components
+        """
+        vocab = {}
+        seg_offsets = [0]
+        hyp_offsets = [0]
+        words = []
+        scores = []
+        for hyps in nbest.values():
+            for hyp_words, hyp_scores in hyps:
+                assert len(hyp_scores) == len(score_names)
+                words.extend(vocab.setdefault(w, len(vocab)) for w in hyp_words)
+                hyp_offsets.append(len(words))
+                scores.append(hyp_scores)
+            seg_offsets.append(len(hyp_offsets) - 1)
+        return cls(
+            segments=list(nbest.keys()),
+            seg_offsets=np.array(seg_offsets, dtype="int64"),
+            hyp_offsets=np.array(hyp_offsets, dtype="int64"),
+            words=np.array(words, dtype="int32"),
+            vocab=list(vocab.keys()),
+            score_names=list(score_names),
+            scores=np.array(scores, dtype="float32").reshape(-1, len(score_names)),
+        )
+
+    @classmethod
+    def load(cls, filename: str) -> "NBestLists":
+        with np.load(filename) as f:
+            return cls(
+                segments=f["segments"].tolist(),
+                seg_offsets=f["seg_offsets"],
+                hyp_offsets=f["hyp_offsets"],
+                words=f["words"],
+                vocab=f["vocab"].tolist(),
+                score_names=f["score_names"].tolist(),
+                scores=f["scores"],
+            )
+
+    def save(self, filename: str):
+        # str arrays, so that no pickle is needed for loading
+        with open(filename, "wb") as f:
+            np.savez(
+                f,
+                segments=np.array(self.segments, dtype="str"),
+                seg_offsets=self.seg_offsets,
+                hyp_offsets=self.hyp_offsets,
+                words=self.words,
+                vocab=np.array(self.vocab, dtype="str"),
+                score_names=np.array(self.score_names, dtype="str"),
+                scores=self.scores,
+            )
+
+    @property
+    def num_hyps(self) -> int:
+        return len(self.scores)
+
+    def get_hyp(self, hyp_index: int) -> List[str]:
+        words = self.words[self.hyp_offsets[hyp_index] : self.hyp_offsets[hyp_index + 1]]
+        return [self.vocab[w] for w in words]
+
+    def iter_segments(self) -> Iterator[Tuple[str, range]]:
+        """
+        :return: segment name, indices of its hypotheses
+        """
+        for i, segment in enumerate(self.segments):
+            yield segment, range(self.seg_offsets[i], self.seg_offsets[i + 1])
+
+
+def with_rank_scores(
+    nbest: NBestLists,
+    rank_scores: Dict[str, Sequence[Dict[str, float]]],
+    *,
+    keep: Sequence[str] = (),
+) -> NBestLists:
+    """
+    Replaces the score components of the N-best lists by costs which are given per rank of the hypotheses,
+    e.g. from the forced alignments of one corpus per rank.
+
+    :param nbest:
+    :param rank_scores: score name -> per rank: segment name -> cost of the hypothesis of this rank.
+        Hypotheses without a cost for any of these components are dropped, e.g. if their alignment failed.
+    :param keep: score components of nbest which are kept, e.g. the LM scores
+    :return: N-best lists with the score components keep + rank_scores
+    """
+    keep_indices = [nbest.score_names.index(name) for name in keep]
+    hyps = {}
+    for segment, hyp_indices in nbest.iter_segments():
+        seg_hyps = []
+        for rank, hyp_index in enumerate(hyp_indices):
+            costs = [scores[rank].get(segment) if rank < len(scores) else None for scores in rank_scores.values()]
+            if any(cost is None for cost in costs):
+                continue
+            kept = [float(nbest.scores[hyp_index, i]) for i in keep_indices]
+            seg_hyps.append((nbest.get_hyp(hyp_index), kept + costs))
+        hyps[segment] = seg_hyps
+    return NBestLists.from_hyps(hyps, [*keep, *rank_scores])
+
+
+def _edit_distances(ref: np.ndarray, hyps: np.ndarray, hyp_lengths: np.ndarray) -> np.ndarray:
+    """
+    Levenshtein distances of one reference to a batch of hypotheses, one numpy step per reference word.
+
+    :param ref: [R] word ids
+    :param hyps: [N, L] word ids, padded with -1
+    :param hyp_lengths: [N]
+    :return: [N]
+    """
+    positions = np.arange(hyps.shape[1] + 1)
+    dist = np.broadcast_to(positions, (len(hyps), len(positions))).copy()
+    for i, word in enumerate(ref, start=1):
+        # deletion and substitution first, then the insertions along the hypothesis via a cumulative minimum,
+        # using dist[j] = min_k<=j (tmp[k] + j - k)
+        tmp = np.empty_like(dist)
+        tmp[:, 0] = i
+        tmp[:, 1:] = np.minimum(dist[:, 1:] + 1, dist[:, :-1] + (hyps != word))
+        dist = np.minimum.accumulate(tmp - positions, axis=1) + positions
+    return dist[np.arange(len(hyps)), hyp_lengths]
+
+
+def count_word_errors(
+    nbest: NBestLists,
+    references: Dict[str, Sequence[str]],
+    *,
+    ignore_words: Sequence[str] = (),
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param nbest:
+    :param references: segment name -> reference words, for all segments of the N-best lists
+    :param ignore_words: removed from the references and hypotheses before the alignment, e.g. noise and silence
+    :return: number of word errors [H] of all hypotheses, number of reference words [S] of all segments
+    """
+    ignore_words = set(ignore_words)
+    word_ids = {w: i for i, w in enumerate(nbest.vocab) if w not in ignore_words}
+    ignore_ids = np.array([i for i, w in enumerate(nbest.vocab) if w not in word_ids], dtype=nbest.words.dtype)
+
+    errors = np.zeros(nbest.num_hyps, dtype="int64")
+    ref_lengths = np.zeros(len(nbest.segments), dtype="int64")
+    for seg_index, (segment, hyp_indices) in enumerate(nbest.iter_segments()):
+        # words which are not in any hypothesis get an id which never matches
+        ref = np.array([word_ids.get(w, -2) for w in references[segment] if w not in ignore_words], dtype="int64")
+        ref_lengths[seg_index] = len(ref)
+        if len(hyp_indices) == 0:
+            continue
+
+        hyps = [nbest.words[nbest.hyp_offsets[h] : nbest.hyp_offsets[h + 1]] for h in hyp_indices]
+        hyps = [hyp[~np.isin(hyp, ignore_ids)] for hyp in hyps]
+        hyp_lengths = np.array([len(hyp) for hyp in hyps], dtype="int64")
+        padded = np.full((len(hyps), hyp_lengths.max(initial=0)), -1, dtype="int64")
+        for i, hyp in enumerate(hyps):
+            padded[i, : len(hyp)] = hyp
+        errors[hyp_indices.start : hyp_indices.stop] = _edit_distances(ref, padded, hyp_lengths)
+    return errors, ref_lengths
+
+
+def best_hyp_indices(nbest: NBestLists, scales: np.ndarray) -> np.ndarray:
+    """
+    :param nbest:
+    :param scales: [K, C] scale vectors, in the order of nbest.score_names
+    :return: [K, S] index of the hypothesis with the lowest scaled cost per scale vector and segment,
+        the first one on ties, -1 for segments without hypotheses
+    """
+    scales = np.asarray(scales, dtype="float64").reshape(-1, len(nbest.score_names))
+    best = np.full((len(scales), len(nbest.segments)), -1, dtype="int64")
+    num_hyps_per_seg = np.diff(nbest.seg_offsets)
+    non_empty = np.flatnonzero(num_hyps_per_seg > 0)
+    if len(non_empty) == 0:
+        return best
+
+    costs = scales @ nbest.scores.astype("float64").T  # [K, H]
+    starts = nbest.seg_offsets[non_empty]
+    min_costs = np.minimum.reduceat(costs, starts, axis=1)  # [K, S']
+    is_min = costs == np.repeat(min_costs, num_hyps_per_seg[non_empty], axis=1)
+    hyp_indices = np.where(is_min, np.arange(nbest.num_hyps), nbest.num_hyps)
+    best[:, non_empty] = np.minimum.reduceat(hyp_indices, starts, axis=1)
+    return best
+
+
+def rescore(
+    nbest: NBestLists,
+    scales: np.ndarray,
+    errors: np.ndarray,
+    ref_lengths: np.ndarray,
+) -> np.ndarray:
+    """
+    :param nbest:
+    :param scales: [K, C] scale vectors, in the order of nbest.score_names
+    :param errors: [H] from count_word_errors
+    :param ref_lengths: [S] from count_word_errors, segments without hypotheses count as deleted
+    :return: [K] total number of word errors of the best hypotheses for each scale vector
+    """
+    if nbest.num_hyps == 0:
+        return np.full(len(np.asarray(scales).reshape(-1, len(nbest.score_names))), ref_lengths.sum(), dtype="int64")
+    best = best_hyp_indices(nbest, scales)
+    seg_errors = np.where(best >= 0, errors[np.maximum(best, 0)], ref_lengths)
+    return seg_errors.sum(axis=1)
+
+
+def find_best_scales(
+    nbest: NBestLists,
+    scales: np.ndarray,
+    references: Dict[str, Sequence[str]],
+    *,
+    ignore_words: Sequence[str] = (),
+    batch_size: Optional[int] = 1000,
+) -> Tuple[int, np.ndarray, int]:
+    """
+    :param nbest:
+    :param scales: [K, C] scale vectors, in the order of nbest.score_names
+    :param references: segment name -> reference words
+    :param ignore_words: see count_word_errors
+    :param batch_size: number of scale vectors which are rescored at once, to bound the memory of the [K, H] costs
+    :return: index of the best scale vector (the first one on ties), number of word errors [K] for all scale vectors,
+        number of reference words
+    """
+    scales = np.asarray(scales, dtype="float64").reshape(-1, len(nbest.score_names))
+    assert len(scales) > 0
+    errors, ref_lengths = count_word_errors(nbest, references, ignore_words=ignore_words)
+    batch_size = batch_size or len(scales)
+    num_errors = np.concatenate(
+        [rescore(nbest, scales[i : i + batch_size], errors, ref_lengths) for i in range(0, len(scales), batch_size)]
+    )
+    return int(np.argmin(num_errors)), num_errors, int(ref_lengths.sum())
+
+
+# HTK SLF link field -> score component, the RASR lattices have one dimension for the AM and one for the LM
+HTK_SCORE_FIELDS = {"a": "am", "l": "lm"}
+HTK_NON_WORDS = {"", "!NULL", "!SENT_START", "!SENT_END", "<s>", "</s>"}
+
+
+def _open_maybe_gzip(filename: str) -> TextIO:
+    with open(filename, "rb") as f:
+        is_gzip = f.read(2) == b"\x1f\x8b"
+    return gzip.open(filename, "rt") if is_gzip else open(filename, "rt")
+
+
+def _parse_htk_fields(line: str) -> Dict[str, str]:
+    fields = {}
+    for token in line.split():
+        key, sep, value = token.partition("=")
+        if sep:
+            fields[key] = value.strip('"')
+    return fields
+
+
+def read_htk_nbest_lattice(filename: str) -> Tuple[Optional[str], List[Tuple[List[str], List[float]]]]:
+    """
+    Reads all paths of an HTK SLF lattice, which is expected to be small, e.g. the union of the N best paths.
+
+    :return: utterance name from the header if given,
+        list of (words, costs per component of HTK_SCORE_FIELDS), i.e. negated HTK log likelihoods
+    """
+    header = {}
+    node_words = {}
+    links = []  # (start, end, word, scores)
+    with _open_maybe_gzip(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = _parse_htk_fields(line)
+            if "I" in fields:
+                node_words[int(fields["I"])] = fields.get("W")
+            elif "J" in fields:
+                scores = [-float(fields.get(key, 0.0)) for key in HTK_SCORE_FIELDS]
+                links.append((int(fields["S"]), int(fields["E"]), fields.get("W"), scores))
+            else:
+                header.update(fields)
+
+    log_base = float(header.get("base", math.e))
+    to_natural_log = math.log(log_base) if log_base > 0.0 and log_base != 1.0 else 1.0
+
+    outgoing = {}
+    has_incoming = set()
+    for start, end, word, scores in links:
+        outgoing.setdefault(start, []).append((end, word, scores))
+        has_incoming.add(end)
+    if "start" in header:
+        start_nodes = [int(header["start"])]
+    else:
+        start_nodes = [n for n in sorted(set(node_words) | set(outgoing)) if n not in has_incoming]
+
+    paths = []
+    stack = [(n, [], [0.0] * len(HTK_SCORE_FIELDS)) for n in reversed(start_nodes)]
+    while stack:
+        node, words, scores = stack.pop()
+        if node not in outgoing:
+            paths.append((words, [s * to_natural_log for s in scores]))
+            continue
+        for end, word, link_scores in reversed(outgoing[node]):
+            # the word is either on the link or on its end node
+            word = word if word is not None else node_words.get(end)
+            next_words = words + [word] if word is not None and word not in HTK_NON_WORDS else words
+            stack.append((end, next_words, [s + ls for s, ls in zip(scores, link_scores)]))
+    return header.get("UTTERANCE"), paths
+
+
+def read_htk_nbest_archive(archive: str) -> Dict[str, List[Tuple[List[str], List[float]]]]:
+    """
+    Reads all HTK SLF lattices of a directory, e.g. written by the RASR archive writer.
+
+    :return: utterance -> paths, see read_htk_nbest_lattice. The utterance is the UTTERANCE of the header,
+        or the path of the file relative to the archive without extensions, which for the RASR archive writer is
+        the full name of the segment.
+    """
+    nbest = {}
+    for root, _, files in sorted(os.walk(archive)):
+        for filename in sorted(files):
+            utterance, paths = read_htk_nbest_lattice(os.path.join(root, filename))
+            if utterance is None:
+                utterance = os.path.relpath(os.path.join(root, filename), archive)
+                for ext in [".gz", ".lat", ".slf", ".htk"]:
+                    utterance = utterance[: -len(ext)] if utterance.endswith(ext) else utterance
+            nbest[utterance] = paths
+    return nbest
+
+
+def read_rasr_alignment_scores(filename: str) -> Dict[str, float]:
+    """
+    :param filename: (gzipped) RASR alignment log
+    :return: segment full name -> total score of the alignment, i.e. the cost of the best path including the TDPs.
+        Segments which could not be aligned are missing.
+    """
+    scores = {}
+    with _open_maybe_gzip(filename) as f:
+        for _, elem in ET.iterparse(f):
+            if elem.tag != "segment":
+                continue
+            stats = next(elem.iter("alignment-statistics"), None)
+            total = stats.findtext("score/total") if stats is not None else None
+            if total is not None and math.isfinite(float(total)):
+                scores[elem.attrib["full-name"]] = float(total)
+            elem.clear()
+    return scores
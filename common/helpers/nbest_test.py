@@ -0,0 +1,155 @@
+"""
+Test for the N-best rescoring helpers
+"""
+
+import numpy as np
+
+from .nbest import (
+    HTK_SCORE_FIELDS,
+    NBestLists,
+    count_word_errors,
+    find_best_scales,
+    read_htk_nbest_archive,
+    read_rasr_alignment_scores,
+    with_rank_scores,
+)
+
+
+def _levenshtein(ref, hyp):
+    dist = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, start=1):
+        prev, dist[0] = dist[0], i
+        for j, h in enumerate(hyp, start=1):
+            prev, dist[j] = dist[j], min(dist[j] + 1, dist[j - 1] + 1, prev + (r != h))
+    return dist[-1]
+
+
+def _make_nbest(num_segments, num_hyps):
+    rng = np.random.default_rng(42)
+    words = ["a", "b", "c", "d", "[noise]"]
+    references = {f"corpus/seq-{i}": list(rng.choice(words[:4], rng.integers(0, 8))) for i in range(num_segments)}
+    nbest = {
+        segment: [
+            (list(rng.choice(words, rng.integers(0, 10))), rng.uniform(0, 10, 2).tolist())
+            for _ in range(rng.integers(0, num_hyps))
+        ]
+        for segment in references
+    }
+    return NBestLists.from_hyps(nbest, ["am", "lm"]), nbest, references
+
+
+def test_count_word_errors(tmp_path):
+    nbest, hyps, references = _make_nbest(50, 10)
+    nbest.save(str(tmp_path / "nbest.npz"))
+    nbest = NBestLists.load(str(tmp_path / "nbest.npz"))
+
+    errors, ref_lengths = count_word_errors(nbest, references, ignore_words=["[noise]"])
+    expected = [
+        _levenshtein(references[segment], [w for w in words if w != "[noise]"])
+        for segment in nbest.segments
+        for words, _ in hyps[segment]
+    ]
+    assert errors.tolist() == expected
+    assert ref_lengths.tolist() == [len(references[segment]) for segment in nbest.segments]
+
+
+def test_find_best_scales():
+    nbest, hyps, references = _make_nbest(50, 10)
+    scales = [[1.0, lm_scale] for lm_scale in np.linspace(0.0, 3.0, 13)]
+    best, num_errors, num_ref_words = find_best_scales(
+        nbest, scales, references, ignore_words=["[noise]"], batch_size=5
+    )
+
+    expected = []
+    for am_scale, lm_scale in scales:
+        total = 0
+        for segment, segment_hyps in hyps.items():
+            if not segment_hyps:
+                total += len(references[segment])
+                continue
+            words, _ = min(segment_hyps, key=lambda hyp: am_scale * hyp[1][0] + lm_scale * hyp[1][1])
+            total += _levenshtein(references[segment], [w for w in words if w != "[noise]"])
+        expected.append(total)
+    assert num_errors.tolist() == expected
+    assert best == int(np.argmin(expected))
+    assert num_ref_words == sum(len(ref) for ref in references.values())
+
+
+def test_read_htk_nbest_archive(tmp_path):
+    import gzip
+
+    # words on the links, log10 scores, the utterance name from the header
+    with gzip.open(str(tmp_path / "seg-a.lat.gz"), "wt") as f:
+        f.write(
+            "VERSION=1.0\nUTTERANCE=corpus/rec-a/seg-a\nbase=10\nN=6 L=5\n"
+            + "".join(f"I={i} t=0.{i}0\n" for i in range(6))
+            + "J=0 S=0 E=1 W=!NULL a=0 l=0\n"
+            + "J=1 S=1 E=2 W=HELLO a=-10.5 l=-2\n"
+            + "J=2 S=2 E=3 W=WORLD a=-3 l=-1\n"
+            + "J=3 S=1 E=4 W=[SILENCE] a=-11 l=0\n"
+            + "J=4 S=4 E=5 W=WORD a=-3 l=-4\n"
+        )
+    # words on the nodes, natural log scores, the utterance name from the file path
+    (tmp_path / "corpus" / "rec-b").mkdir(parents=True)
+    with open(str(tmp_path / "corpus" / "rec-b" / "seg-b.lat"), "wt") as f:
+        f.write('N=3 L=2\nI=0 W=!NULL\nI=1 W="FOO"\nI=2 W=BAR\nJ=0 S=0 E=1 a=-1.5 l=-0.5\nJ=1 S=1 E=2 a=-2 l=-1\n')
+
+    nbest = read_htk_nbest_archive(str(tmp_path))
+    assert sorted(nbest) == ["corpus/rec-a/seg-a", "corpus/rec-b/seg-b"]
+
+    paths = nbest["corpus/rec-a/seg-a"]
+    assert [words for words, _ in paths] == [["HELLO", "WORLD"], ["[SILENCE]", "WORD"]]
+    np.testing.assert_allclose([costs for _, costs in paths], np.array([[13.5, 3.0], [14.0, 4.0]]) * np.log(10))
+    assert nbest["corpus/rec-b/seg-b"] == [(["FOO", "BAR"], [3.5, 1.5])]
+
+    # the keys of the N-best lists are the segment names of the corpus
+    nbest_lists = NBestLists.from_hyps(nbest, list(HTK_SCORE_FIELDS.values()))
+    references = {"corpus/rec-a/seg-a": ["HELLO", "WORLD"], "corpus/rec-b/seg-b": ["FOO"]}
+    best, num_errors, _ = find_best_scales(nbest_lists, [[1.0, 0.0], [0.0, 1.0]], references)
+    assert num_errors.tolist() == [1, 1]
+
+
+def test_rescore_without_hyps():
+    nbest = NBestLists.from_hyps({"corpus/seq-0": [], "corpus/seq-1": []}, ["am", "lm"])
+    references = {"corpus/seq-0": ["a", "b"], "corpus/seq-1": ["c"]}
+    best, num_errors, num_ref_words = find_best_scales(nbest, [[1.0, 0.5], [1.0, 1.0]], references)
+    assert num_errors.tolist() == [3, 3] and num_ref_words == 3
+
+
+def test_alignment_scores(tmp_path):
+    import gzip
+
+    # one log per rank, the second hypothesis of seq-0 could not be aligned
+    logs = []
+    for rank, totals in enumerate([{"seq-0": 10.5, "seq-1": 7.0}, {"seq-0": None, "seq-1": 6.0}]):
+        segments = "".join(
+            f'<segment name="{name}" full-name="corpus/rec/{name}"><information>aligned</information>'
+            + (
+                f"<alignment-statistics><frames>10</frames><score><avg>{total / 10}</avg><total>{total}</total>"
+                + "</score></alignment-statistics>"
+                if total is not None
+                else "<warning>Alignment did not reach any final state.</warning>"
+            )
+            + "</segment>"
+            for name, total in totals.items()
+        )
+        logs.append(str(tmp_path / f"alignment.log.{rank}.gz"))
+        with gzip.open(logs[-1], "wt") as f:
+            f.write(
+                f'<?xml version="1.0" encoding="UTF-8"?><sprint><recording name="rec">{segments}</recording></sprint>'
+            )
+
+    rank_scores = [read_rasr_alignment_scores(log) for log in logs]
+    assert rank_scores == [{"corpus/rec/seq-0": 10.5, "corpus/rec/seq-1": 7.0}, {"corpus/rec/seq-1": 6.0}]
+
+    hyps = {
+        "corpus/rec/seq-0": [(["a"], [1.0, 2.0]), (["b"], [1.5, 1.0])],
+        "corpus/rec/seq-1": [(["c"], [3.0, 4.0]), (["c", "d"], [2.0, 5.0])],
+    }
+    nbest = with_rank_scores(NBestLists.from_hyps(hyps, ["am", "lm"]), {"am": rank_scores}, keep=["lm"])
+    assert nbest.score_names == ["lm", "am"]
+    assert [[nbest.get_hyp(h) for h in hyp_indices] for _, hyp_indices in nbest.iter_segments()] == [
+        [["a"]],
+        [["c"], ["c", "d"]],
+    ]
+    assert nbest.scores.tolist() == [[2.0, 10.5], [4.0, 7.0], [5.0, 6.0]]
@@ -0,0 +1,188 @@
+"""
+Streaming extraction of timings and search space statistics from (gzipped) RASR search logs,
+as used by the ``ExtractSearchStatisticsJob`` variants.
+
+Each log is parsed in one ``iterparse`` pass. Every element outside of a segment is dropped as soon as it is closed,
+and every segment as soon as its statistics are extracted, so the memory usage does not depend on the log size.
+Multiple logs (e.g. of a split recognition) are parsed in parallel processes.
+
+The extracted values are the same as with ``ET.fromstring`` and the XPath queries::
+
+    ./timer/{elapsed,user,system}
+    .//segment/layer[@name="recognizer"]
+    .//segment/flf-push-forward-rescoring-time
+    .//fwd-summary/total-run-time
+    .//segment
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import gzip
+import multiprocessing
+import xml.etree.ElementTree as ET
+
+TF_FWD_COMPONENT = "flf-lattice-tool.network.recognizer.feature-extraction.tf-fwd"
+
+
+# search space statistics of the recognizer layer -> key in the totals
+LAYER_STATISTICS = {
+    "ending words after pruning": "word_ends",
+    "trees after  pruning": "trees",
+    "states after pruning": "states",
+}
+
+
+def _findtext(elem: ET.Element, tag: str, default: Optional[str] = None) -> Optional[str]:
+    """
+    Same as ``elem.findtext(tag, default)`` for a plain child tag, but without the XPath overhead.
+    """
+    for child in elem:
+        if child.tag == tag:
+            return child.text or ""
+    return default
+
+
+def _parse_recognizer_layer(layer: ET.Element) -> Tuple[Dict[str, Any], List[Tuple[str, Tuple[float, ...]]], Any]:
+    """
+    One pass over the children of a recognizer layer, with the same (first match) semantics as the XPath queries.
+
+    :return: (frames, averages of LAYER_STATISTICS, recognizer time; None if not in the log),
+        list of (name, (min, avg, max)) of all scalar search space statistics,
+        first tf-fwd information element or None
+    """
+    result = {"frames": None, "word_ends": None, "trees": None, "states": None, "recognizer_time": None}
+    scalar_stats = []
+    tf_fwd = None
+    for child in layer:
+        tag = child.tag
+        if tag == "statistics":
+            if result["frames"] is None:
+                for frames in child:
+                    if frames.tag == "frames" and frames.get("port") == "features":
+                        result["frames"] = int(frames.attrib["number"])
+                        break
+        elif tag == "search-space-statistics":
+            for stat in child:
+                if stat.tag != "statistic":
+                    continue
+                key = LAYER_STATISTICS.get(stat.get("name"))
+                if key is not None and result[key] is None:
+                    avg = _findtext(stat, "avg")
+                    if avg is not None:
+                        result[key] = float(avg)
+                if stat.get("type") == "scalar":
+                    min_val = float(_findtext(stat, "min", default="0"))
+                    avg_val = float(_findtext(stat, "avg", default="0"))
+                    max_val = float(_findtext(stat, "max", default="0"))
+                    scalar_stats.append((stat.attrib["name"], (min_val, avg_val, max_val)))
+        elif tag == "information":
+            if tf_fwd is None and child.get("component") == TF_FWD_COMPONENT:
+                tf_fwd = child
+        elif tag == "flf-recognizer-time":
+            if result["recognizer_time"] is None:
+                result["recognizer_time"] = float(child.text)
+    return result, scalar_stats, tf_fwd
+
+
+def _parse_segment(seg: ET.Element, log: Dict[str, Any]):
+    seg_stats = {}
+    frames = None
+    tf_fwd = None
+    for layer in seg:
+        if layer.tag != "layer" or layer.get("name") != "recognizer":
+            continue
+        layer_result, scalar_stats, layer_tf_fwd = _parse_recognizer_layer(layer)
+        log["recognizer_layers"].append(layer_result)
+        seg_stats.update(scalar_stats)
+        if frames is None:
+            frames = layer_result["frames"]
+        if tf_fwd is None:
+            tf_fwd = layer_tf_fwd
+
+    full_name = seg.attrib["full-name"]
+    assert frames is not None, f"no frames for segment {full_name}"
+    seg_stats["frames"] = frames
+    if tf_fwd is not None:
+        seg_stats["tf_fwd"] = float(tf_fwd.text.strip().split()[-1])
+    else:
+        seg_stats["tf_fwd"] = 0.0
+    log["seq_ss_statistics"][full_name] = seg_stats
+
+    eval_stats = {}
+    for evaluation in seg.iter("evaluation"):
+        stat_name = evaluation.attrib["name"]
+        alignment = evaluation.find('statistic[@type="alignment"]')
+        eval_stats[stat_name] = {
+            "errors": int(alignment.findtext("edit-operations")),
+            "ref-tokens": int(alignment.findtext('count[@event="token"][@source="reference"]')),
+            "score": float(alignment.findtext('score[@source="best"]')),
+        }
+    log["eval_statistics"][full_name] = eval_stats
+
+
+def parse_search_log(filename: str) -> Dict[str, Any]:
+    """
+    :param filename: gzipped RASR search log
+    :return: dict with
+        "elapsed", "user", "system": the timer of the log, in seconds,
+        "recognizer_layers": per recognizer layer (in log order) "frames", "word_ends", "trees", "states"
+            (the averages after pruning) and "recognizer_time", None if not in the log,
+        "rescoring_times", "lm_times": in log order,
+        "seq_ss_statistics": segment full name -> scalar search space statistic name -> (min, avg, max),
+            and "frames" and "tf_fwd",
+        "eval_statistics": segment full name -> evaluation name -> "errors", "ref-tokens", "score"
+    """
+    log = {
+        "elapsed": None,
+        "user": None,
+        "system": None,
+        "recognizer_layers": [],
+        "rescoring_times": [],
+        "lm_times": [],
+        "seq_ss_statistics": {},
+        "eval_statistics": {},
+    }
+    with gzip.open(filename, "rt") as f:
+        stack: List[ET.Element] = []
+        num_open_segments = 0
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                if elem.tag == "segment":
+                    num_open_segments += 1
+                continue
+
+            stack.pop()
+            parent = stack[-1] if stack else None
+            if parent is None:
+                continue
+            if parent.tag == "timer" and len(stack) == 2 and elem.tag in ("elapsed", "user", "system"):
+                if log[elem.tag] is None:
+                    log[elem.tag] = float(elem.text)
+            elif parent.tag == "segment" and elem.tag == "flf-push-forward-rescoring-time":
+                log["rescoring_times"].append(float(elem.text))
+            elif parent.tag == "fwd-summary" and elem.tag == "total-run-time":
+                log["lm_times"].append(float(elem.text))
+
+            if elem.tag == "segment":
+                num_open_segments -= 1
+                if num_open_segments == 0:
+                    # nested segments are handled with the outermost one, in document order
+                    for seg in elem.iter("segment"):
+                        _parse_segment(seg, log)
+            if num_open_segments == 0:
+                # all needed values are extracted, and elem is the last child of its parent
+                parent.remove(elem)
+    assert log["elapsed"] is not None, f"no timer in {filename}"
+    return log
+
+
+def parse_search_logs(filenames: Sequence[str], *, num_processes: int = 1) -> List[Dict[str, Any]]:
+    """
+    :param filenames: RASR search logs
+    :param num_processes: number of logs which are parsed in parallel
+    :return: result of :func:`parse_search_log` for each log, in the given order
+    """
+    if num_processes <= 1 or len(filenames) <= 1:
+        return [parse_search_log(filename) for filename in filenames]
+    with multiprocessing.get_context("spawn").Pool(min(num_processes, len(filenames))) as pool:
+        return pool.map(parse_search_log, filenames, chunksize=1)
@@ -0,0 +1,210 @@
+"""
+Real time factor (RTF) profiling for PyTorch forward/search hooks in RETURNN
+(``forward_init_hook``, ``forward_step``, ``forward_finish_hook``).
+
+Usage::
+
+    def forward_init_hook(run_ctx, **kwargs):
+        run_ctx.rtf = RTFProfiler()
+
+    def forward_step(*, model, data, run_ctx, **kwargs):
+        with run_ctx.rtf.batch(audio_len_s=..., num_seqs=...):
+            with run_ctx.rtf.section("encoder"):
+                logprobs, logprobs_len = model(...)
+            with run_ctx.rtf.section("search"):
+                ...
+            with run_ctx.rtf.section("output"):
+                ...
+
+    def forward_finish_hook(run_ctx, **kwargs):
+        run_ctx.rtf.finish()
+
+Per batch, it records the audio length and the time of each section.
+With a CUDA device, it synchronizes at the section boundaries (otherwise, the asynchronous GPU time
+would be attributed to whatever section first waits for the result), and records the peak memory.
+:func:`RTFProfiler.finish` writes all of that to a JSON file (or CSV, by file extension),
+which can be registered as an output of the forward job (e.g. ``output_files=["rtf.json"]``),
+and aggregated over experiments with :class:`i6_experiments.users.rossenbach.returnn.rtf.AggregateRTFReportsJob`.
+
+This module does not depend on Sisyphus, as it is used within RETURNN.
+"""
+
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+import contextlib
+import csv
+import json
+import time
+
+import torch
+
+
+class RTFProfiler:
+    """
+    Collects timings per batch and section.
+    """
+
+    def __init__(
+        self,
+        *,
+        report_file: Optional[str] = "rtf.json",
+        sync_cuda: bool = True,
+        print_batches: bool = True,
+        parallel_sections: Optional[Sequence[str]] = None,
+    ):
+        """
+        :param report_file: written in :func:`finish`. ".csv" for one row per batch, otherwise JSON
+        :param sync_cuda: call torch.cuda.synchronize() at the section boundaries, if CUDA is used
+        :param print_batches: print the timings of each batch to stdout
+        :param parallel_sections: sections which run in parallel to each other, e.g. ("AM", "Search") with the
+            search in worker processes. The overlap is their total time minus the wall time.
+            By default all sections, except the ones ending with "-Wait", which wait for another section.
+        """
+        self.report_file = report_file
+        self.sync_cuda = sync_cuda
+        self.print_batches = print_batches
+        self.parallel_sections = parallel_sections
+        self.batches: List[Dict[str, Any]] = []
+        self._cur_batch: Optional[Dict[str, Any]] = None
+        self._start_time: Optional[float] = None
+
+    def _use_cuda(self) -> bool:
+        return torch.cuda.is_available() and torch.cuda.is_initialized()
+
+    def _sync(self):
+        if self.sync_cuda and self._use_cuda():
+            torch.cuda.synchronize()
+
+    @contextlib.contextmanager
+    def batch(self, *, audio_len_s: float, num_seqs: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Context for one batch (i.e. one forward_step).
+
+        :param audio_len_s: total audio length of the batch in seconds
+        :param num_seqs:
+        :return: the stats of this batch, can be passed to :func:`add_time` later
+        """
+        assert self._cur_batch is None, "nested batch"
+        if self._start_time is None:
+            self._start_time = time.perf_counter()
+        if self._use_cuda():
+            torch.cuda.reset_peak_memory_stats()
+        self._cur_batch = {"audio_s": float(audio_len_s), "num_seqs": num_seqs, "sections": {}}
+        self._sync()
+        start = time.perf_counter()
+        try:
+            yield self._cur_batch
+        finally:
+            self._sync()
+            batch = self._cur_batch
+            self._cur_batch = None
+        batch["total_s"] = time.perf_counter() - start
+        if self._use_cuda():
+            batch["peak_memory_bytes"] = torch.cuda.max_memory_allocated()
+        self.batches.append(batch)
+        if self.print_batches:
+            self._print_batch(batch)
+
+    @contextlib.contextmanager
+    def section(self, name: str) -> Iterator[None]:
+        """
+        Context for one part of the batch, e.g. "feature_extraction", "encoder", "search", "output".
+        Multiple sections with the same name within one batch are summed up.
+        """
+        assert self._cur_batch is not None, "section outside of batch"
+        self._sync()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._sync()
+            sections = self._cur_batch["sections"]
+            sections[name] = sections.get(name, 0.0) + time.perf_counter() - start
+
+    def add_time(self, name: str, seconds: float, *, batch: Optional[Dict[str, Any]] = None):
+        """
+        Adds the time of a section which was measured elsewhere, e.g. in a worker process.
+
+        :param name: section name
+        :param seconds:
+        :param batch: as returned by :func:`batch`. By default the current batch
+        """
+        if batch is None:
+            batch = self._cur_batch
+        assert batch is not None, "add_time outside of batch"
+        batch["sections"][name] = batch["sections"].get(name, 0.0) + seconds
+
+    @staticmethod
+    def _print_batch(batch: Dict[str, Any]):
+        audio_s = batch["audio_s"]
+        for name, seconds in batch["sections"].items():
+            print("Batch-%s-Time: %.2fs, %s-RTF: %.3f" % (name, seconds, name, seconds / audio_s))
+        print("Batch-time: %.2f, Batch-RTF: %.3f" % (batch["total_s"], batch["total_s"] / audio_s))
+
+    def get_summary(self) -> Dict[str, Any]:
+        """
+        :return: totals over all batches
+        """
+        audio_s = sum(batch["audio_s"] for batch in self.batches)
+        summary = {
+            "num_batches": len(self.batches),
+            "num_seqs": sum(batch["num_seqs"] or 0 for batch in self.batches),
+            "audio_s": audio_s,
+            "total_s": sum(batch["total_s"] for batch in self.batches),
+            "wall_s": time.perf_counter() - self._start_time if self._start_time is not None else 0.0,
+            "sections": {},
+        }
+        for batch in self.batches:
+            for name, seconds in batch["sections"].items():
+                summary["sections"][name] = summary["sections"].get(name, 0.0) + seconds
+        # if some sections run in parallel, e.g. the search in worker processes, they overlap in the wall time
+        if self.parallel_sections is not None:
+            parallel_s = sum(summary["sections"].get(name, 0.0) for name in self.parallel_sections)
+        else:
+            parallel_s = sum(t for name, t in summary["sections"].items() if not name.endswith("-Wait"))
+        summary["overlap_s"] = max(parallel_s - summary["wall_s"], 0.0)
+        summary["rtf"] = summary["total_s"] / audio_s if audio_s else None
+        summary["wall_rtf"] = summary["wall_s"] / audio_s if audio_s else None
+        summary["section_rtf"] = {
+            name: seconds / audio_s if audio_s else None for name, seconds in summary["sections"].items()
+        }
+        peak_memory = [batch["peak_memory_bytes"] for batch in self.batches if "peak_memory_bytes" in batch]
+        summary["peak_memory_bytes"] = max(peak_memory) if peak_memory else None
+        return summary
+
+    def finish(self) -> Dict[str, Any]:
+        """
+        Prints the totals and writes the report file.
+
+        :return: summary, see :func:`get_summary`
+        """
+        summary = self.get_summary()
+        audio_s = summary["audio_s"] or float("nan")
+        for name, seconds in summary["sections"].items():
+            print("Total-%s-Time: %.2fs, %s-RTF: %.3f" % (name, seconds, name, seconds / audio_s))
+        print("Total-time: %.2f, Batch-RTF: %.3f" % (summary["total_s"], summary["total_s"] / audio_s))
+        print("Total-Wall-Time: %.2fs, Wall-RTF: %.3f" % (summary["wall_s"], summary["wall_s"] / audio_s))
+        if summary["overlap_s"] > 0:
+            print("Total-Overlap-Time: %.2fs" % summary["overlap_s"])
+        if self.report_file:
+            self.write_report(self.report_file, summary=summary)
+        return summary
+
+    def write_report(self, filename: str, *, summary: Optional[Dict[str, Any]] = None):
+        """
+        :param filename: ".csv": one row per batch, otherwise JSON with the summary and all batches
+        :param summary: if already computed
+        """
+        if filename.endswith(".csv"):
+            section_names = sorted({name for batch in self.batches for name in batch["sections"]})
+            with open(filename, "wt", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["audio_s", "num_seqs", "total_s", "peak_memory_bytes"] + section_names)
+                for batch in self.batches:
+                    writer.writerow(
+                        [batch["audio_s"], batch["num_seqs"], batch["total_s"], batch.get("peak_memory_bytes")]
+                        + [batch["sections"].get(name, 0.0) for name in section_names]
+                    )
+        else:
+            with open(filename, "wt") as f:
+                json.dump({"summary": summary or self.get_summary(), "batches": self.batches}, f, indent=2)
+                f.write("\n")
@@ -10,21 +10,34 @@ from typing import List
 
 import i6_core.rasr as rasr
 import i6_core.util
-from sisyphus.hash import sis_hash_helper
 
 import i6_experiments.common.setups.rasr.util as rasr_util
 from .py_repr import py_repr
+from .memo_hash import memoized_sis_hash, sis_hash_helper
 
 
 _limit = 3
 
 
-def collect_diffs(prefix: str, orig, new) -> List[str]:
+def collect_diffs(prefix: str, orig, new, *, skip_equal_hash: bool = False) -> List[str]:
     """
+    :param prefix:
+    :param orig:
+    :param new:
+    :param skip_equal_hash: if True, do not recurse into sub objects which have the same Sisyphus hash.
+        Then only diffs which are relevant for the hash are reported.
+        Hashes are memoized (:func:`memoized_sis_hash`), so this is linear in the size of the objects.
     :return: list of diff descriptions. empty if no diffs
     """
+    with memoized_sis_hash():
+        return _collect_diffs(prefix, orig, new, skip_equal_hash=skip_equal_hash)
+
+
+def _collect_diffs(prefix: str, orig, new, *, skip_equal_hash: bool) -> List[str]:
     if orig is None and new is None:
         return []
+    if skip_equal_hash and sis_hash_helper(orig) == sis_hash_helper(new):
+        return []
     if isinstance(orig, i6_core.util.MultiPath) and isinstance(new, i6_core.util.MultiPath):
         pass  # allow different sub types
     elif isinstance(orig, sisyphus.Job) and isinstance(new, sisyphus.Job):
@@ -36,14 +49,14 @@ def collect_diffs(prefix: str, orig, new) -> List[str]:
     elif type(orig) != type(new):
         return [f"{prefix} diff type: {py_repr(orig)} != {py_repr(new)}"]
     if isinstance(orig, dict):
-        diffs = collect_diffs(f"{prefix}:keys", set(orig.keys()), set(new.keys()))
+        diffs = _collect_diffs(f"{prefix}:keys", set(orig.keys()), set(new.keys()), skip_equal_hash=skip_equal_hash)
         if diffs:
             return diffs
         num_int_key_diffs = 0
         keys = list(orig.keys())
         for i in range(len(keys)):
             key = keys[i]
-            sub_diffs = collect_diffs(f"{prefix}[{key!r}]", orig[key], new[key])
+            sub_diffs = _collect_diffs(f"{prefix}[{key!r}]", orig[key], new[key], skip_equal_hash=skip_equal_hash)
             diffs += sub_diffs
             if isinstance(key, int) and sub_diffs:
                 num_int_key_diffs += 1
@@ -95,7 +108,7 @@ def collect_diffs(prefix: str, orig, new) -> List[str]:
         diffs = []
         num_diffs = 0
         for i in range(len(orig)):
-            sub_diffs = collect_diffs(f"{prefix}[{i}]", orig[i], new[i])
+            sub_diffs = _collect_diffs(f"{prefix}[{i}]", orig[i], new[i], skip_equal_hash=skip_equal_hash)
             diffs += sub_diffs
             if sub_diffs:
                 num_diffs += 1
@@ -108,24 +121,30 @@ def collect_diffs(prefix: str, orig, new) -> List[str]:
             return [f"{prefix} diff: {py_repr(orig)} != {py_repr(new)}"]
         return _sis_hash_diff(prefix, orig, new)
     if isinstance(orig, tk.AbstractPath):
-        diffs = collect_diffs(f"{prefix}:path-state", _PathState(orig), _PathState(new))
+        diffs = _collect_diffs(
+            f"{prefix}:path-state", _PathState(orig), _PathState(new), skip_equal_hash=skip_equal_hash
+        )
         if not diffs:
             return _sis_hash_diff(prefix, orig, new)
         return diffs
     if isinstance(orig, i6_core.util.MultiPath):
         # only hidden_paths relevant (?)
-        diffs = collect_diffs(f"{prefix}.hidden_paths", orig.hidden_paths, new.hidden_paths)
+        diffs = _collect_diffs(
+            f"{prefix}.hidden_paths", orig.hidden_paths, new.hidden_paths, skip_equal_hash=skip_equal_hash
+        )
         if not diffs:
             return _sis_hash_diff(prefix, orig, new)
         return diffs
     if isinstance(orig, _expected_obj_types):
         orig_attribs = set(vars(orig).keys())
         new_attribs = set(vars(new).keys())
-        diffs = collect_diffs(f"{prefix}:attribs", orig_attribs, new_attribs)
+        diffs = _collect_diffs(f"{prefix}:attribs", orig_attribs, new_attribs, skip_equal_hash=skip_equal_hash)
         if diffs:
             return diffs
         for key in vars(orig).keys():
-            diffs += collect_diffs(f"{prefix}.{key}", getattr(orig, key), getattr(new, key))
+            diffs += _collect_diffs(
+                f"{prefix}.{key}", getattr(orig, key), getattr(new, key), skip_equal_hash=skip_equal_hash
+            )
         if not diffs:
             return _sis_hash_diff(prefix, orig, new)
         return diffs
@@ -0,0 +1,57 @@
+"""
+Memoized Sisyphus hashing.
+
+:func:`sisyphus.hash.sis_hash_helper` recursively walks the whole object.
+When we hash the same big object (or sub objects of it) multiple times,
+e.g. in :func:`dependency_boundary` or :func:`collect_diffs`, this becomes very slow.
+Within :func:`memoized_sis_hash`, the result is memoized per object identity.
+"""
+
+from typing import Any, Dict, Iterator, Optional, Tuple
+import contextlib
+import sisyphus.hash
+
+
+_memo: Optional[Dict[int, Tuple[Any, bytes]]] = None  # id(obj) -> (obj, hash). obj is kept alive so the id is unique
+
+
+@contextlib.contextmanager
+def memoized_sis_hash() -> Iterator[None]:
+    """
+    Within this context, :func:`sisyphus.hash.sis_hash_helper` (and thus also :func:`sisyphus.hash.short_hash`)
+    memoizes its result per object identity.
+    Nested usage reuses the outer memo.
+
+    The hashed objects must not be modified within the context,
+    and all hashed objects are kept alive until the context is left.
+    This patches the :mod:`sisyphus.hash` module, thus it is not thread-safe.
+    """
+    global _memo
+    if _memo is not None:
+        yield
+        return
+    orig_sis_hash_helper = sisyphus.hash.sis_hash_helper
+    memo = {}
+
+    def _sis_hash_helper(obj: Any) -> bytes:
+        entry = memo.get(id(obj))
+        if entry is not None:
+            return entry[1]
+        res = orig_sis_hash_helper(obj)
+        memo[id(obj)] = (obj, res)
+        return res
+
+    _memo = memo
+    sisyphus.hash.sis_hash_helper = _sis_hash_helper
+    try:
+        yield
+    finally:
+        sisyphus.hash.sis_hash_helper = orig_sis_hash_helper
+        _memo = None
+
+
+def sis_hash_helper(obj: Any) -> bytes:
+    """
+    Same as :func:`sisyphus.hash.sis_hash_helper`, but uses the memo if we are inside :func:`memoized_sis_hash`.
+    """
+    return sisyphus.hash.sis_hash_helper(obj)
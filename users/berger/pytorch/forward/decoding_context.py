@@ -0,0 +1,99 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import torch
+from sisyphus import tk
+
+
+@dataclass
+class DecodingContext:
+    """
+    Everything which is constant during one forward/search run: label table, priors, device and the model on it.
+    """
+
+    model: torch.nn.Module
+    device: torch.device
+    label_array: np.ndarray  # [C], label index -> label string
+    prior: Optional[np.ndarray] = None  # [C], log prior
+
+    def labels_from_indices(self, indices) -> np.ndarray:
+        """
+        :param indices: label indices, sequence or array of int
+        :return: array of label strings, same shape as indices
+        """
+        return self.label_array[np.asarray(indices, dtype=np.int64)]
+
+
+_decoding_context: Optional[DecodingContext] = None
+_decoding_context_key: Optional[tuple] = None
+
+
+def get_decoding_context(
+    *,
+    model: torch.nn.Module,
+    lexicon_file: Optional[tk.Path] = None,
+    vocab_file: Optional[tk.Path] = None,
+    prior_file: Optional[tk.Path] = None,
+    label_dtype: str = "<U3",
+) -> DecodingContext:
+    """
+    Returns the decoding context of this process, and creates it on the first call.
+    Thus, the lexicon (or vocab) and the priors are only loaded once, and the model is only moved to the device once,
+    and not in every forward step.
+
+    :param model:
+    :param lexicon_file: labels are the phonemes of this lexicon
+    :param vocab_file: alternatively, labels are taken from this RETURNN vocab
+    :param prior_file: log priors as written by :class:`ComputePriorCallback` (prior.txt)
+    :param label_dtype: numpy dtype of the label strings
+    """
+    global _decoding_context, _decoding_context_key
+    key = (id(model), str(lexicon_file), str(vocab_file), str(prior_file), label_dtype)
+    if _decoding_context is not None and _decoding_context_key == key:
+        return _decoding_context
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    assert (lexicon_file is None) != (vocab_file is None), "exactly one of lexicon_file or vocab_file is needed"
+    if lexicon_file is not None:
+        from i6_core.lib.lexicon import Lexicon
+
+        lexicon = Lexicon()
+        lexicon.load(lexicon_file)
+        labels = list(lexicon.phonemes)
+    else:
+        from returnn.datasets.util.vocabulary import Vocabulary
+
+        labels = Vocabulary.create_vocab(vocab_file=vocab_file, unknown_label=None).labels
+
+    prior = None
+    if prior_file is not None:
+        prior = np.loadtxt(str(prior_file), dtype="float32")
+
+    _decoding_context = DecodingContext(
+        model=model.to(device=device),
+        device=device,
+        label_array=np.array(labels, dtype=label_dtype),
+        prior=prior,
+    )
+    _decoding_context_key = key
+    return _decoding_context
+
+
+def forward_init_hook(run_ctx, *, model: torch.nn.Module, **kwargs):
+    """
+    For setups with init/finish hooks: creates the decoding context up front and stores it in `run_ctx`.
+    kwargs are passed to :func:`get_decoding_context`.
+    """
+    run_ctx.decoding_context = get_decoding_context(model=model, **kwargs)
+
+
+def forward_finish_hook(run_ctx, **_kwargs):
+    """
+    Releases the decoding context.
+    """
+    global _decoding_context, _decoding_context_key
+    _decoding_context = None
+    _decoding_context_key = None
+    run_ctx.decoding_context = None
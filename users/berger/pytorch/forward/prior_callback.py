@@ -5,26 +5,52 @@ from returnn.tensor.tensor_dict import TensorDict
 
 
 class ComputePriorCallback(ForwardCallbackIface):
+    """
+    Computes the prior as the average of the output probabilities over all frames of all sequences.
+    Per sequence, the probabilities are summed up in float64 in a single reduction,
+    and only divided by the total number of frames in :func:`finish`.
+    """
+
+    def __init__(self, *, use_log_sum_exp: bool = False):
+        """
+        :param use_log_sum_exp: accumulate the sum in log space (via log-sum-exp),
+            which avoids underflow of exp for very small probabilities
+        """
+        self.use_log_sum_exp = use_log_sum_exp
+
     def init(self, *, model: torch.nn.Module):
-        self.n = 1
-        self.avg_probs = None
+        self.n = 0
+        self.sum_probs = None  # [C], or log of the sum if use_log_sum_exp
 
     def process_seq(self, *, seq_tag: str, outputs: TensorDict):
         log_prob_tensor = outputs["log_probs"].raw_tensor
         assert log_prob_tensor is not None
-        prob_tensor_iter = iter(np.exp(log_prob_tensor))
+        log_prob_tensor = np.asarray(log_prob_tensor, dtype=np.float64)  # [T, C]
+        if log_prob_tensor.shape[0] == 0:
+            # nothing to accumulate, and the max in the log-sum-exp is not defined
+            return
 
-        if self.avg_probs is None:
-            self.avg_probs = next(prob_tensor_iter)
-            print("Create probs collection tensor of shape", self.avg_probs.shape)
+        if self.use_log_sum_exp:
+            seq_sum = _log_sum_exp(log_prob_tensor, axis=0)  # [C]
+        else:
+            seq_sum = np.exp(log_prob_tensor).sum(axis=0)  # [C]
 
-        for prob_tensor in prob_tensor_iter:
-            self.n += 1
-            self.avg_probs += (prob_tensor - self.avg_probs) / self.n
+        if self.sum_probs is None:
+            self.sum_probs = seq_sum
+            print("Create probs collection tensor of shape", self.sum_probs.shape)
+        elif self.use_log_sum_exp:
+            self.sum_probs = np.logaddexp(self.sum_probs, seq_sum)
+        else:
+            self.sum_probs += seq_sum
+        self.n += log_prob_tensor.shape[0]
 
     def finish(self):
-        prob_array = self.avg_probs
-        log_prob_array = np.log(prob_array)
+        if self.use_log_sum_exp:
+            log_prob_array = (self.sum_probs - np.log(self.n)).astype(np.float32)
+            prob_array = np.exp(log_prob_array)
+        else:
+            prob_array = (self.sum_probs / self.n).astype(np.float32)
+            log_prob_array = np.log(prob_array)
         log_prob_strings = ["%.20e" % s for s in log_prob_array]
 
         # Write txt file
@@ -49,3 +75,9 @@ class ComputePriorCallback(ForwardCallbackIface):
         plt.ylabel("prior")
         plt.grid(True)
         plt.savefig("../output/prior.png")
+
+
+def _log_sum_exp(x: np.ndarray, *, axis: int) -> np.ndarray:
+    x_max = np.max(x, axis=axis, keepdims=True)
+    x_max = np.where(np.isfinite(x_max), x_max, 0.0)
+    return np.log(np.sum(np.exp(x - x_max), axis=axis)) + np.squeeze(x_max, axis=axis)
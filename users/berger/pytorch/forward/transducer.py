@@ -1,11 +1,10 @@
-import torch
 import numpy as np
 from torchaudio.models.rnnt import RNNT
 from returnn.frontend import Tensor
 from returnn.tensor.tensor_dict import TensorDict
 from i6_experiments.users.berger.pytorch.forward.transducer_beam_search import beam_search
 from sisyphus import tk
-from i6_core.lib.lexicon import Lexicon
+from i6_experiments.users.berger.pytorch.forward.decoding_context import get_decoding_context
 
 
 def beam_search_forward_step(*, model: RNNT, extern_data: TensorDict, lexicon_file: tk.Path, beam_size: int, **kwargs):
@@ -18,25 +17,19 @@ def beam_search_forward_step(*, model: RNNT, extern_data: TensorDict, lexicon_fi
     assert audio_features is not None
     assert audio_features_len is not None
 
-    lexicon = Lexicon()
-    lexicon.load(lexicon_file)
-    label_list = list(lexicon.phonemes)
-
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    ctx = get_decoding_context(model=model, lexicon_file=lexicon_file)
 
     tokens_arrays = []
     tokens_len = []
 
-    for b in range(audio_features.size(0)):
-        seq_feature_len = audio_features_len[b : b + 1]
-        seq_features = audio_features[b : b + 1, : seq_feature_len[0]]
-        token_indices = beam_search(
-            model=model.to(device=device),
-            features=seq_features.to(device=device),
-            features_len=seq_feature_len.to(device=device),
-            beam_size=beam_size,
-        )
-        tokens_array = np.array([label_list[token_idx] for token_idx in token_indices], dtype="<U3")
+    batch_token_indices = beam_search(
+        model=ctx.model,
+        features=audio_features[:, : audio_features_len.max()].to(device=ctx.device),
+        features_len=audio_features_len.to(device=ctx.device),
+        beam_size=beam_size,
+    )
+    for b, token_indices in enumerate(batch_token_indices):
+        tokens_array = ctx.labels_from_indices(token_indices)
         print(f"Recognized sequence {repr(seq_tags[b])}: {tokens_array}")
         tokens_arrays.append(tokens_array)
         tokens_len.append(len(tokens_array))
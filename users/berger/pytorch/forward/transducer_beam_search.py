@@ -1,86 +1,102 @@
-from functools import lru_cache
 from typing import List
-from dataclasses import dataclass
 
 import torch
-from torchaudio.models.rnnt import RNNT
 
-from i6_experiments.users.berger.pytorch.models.conformer_transducer import FFNNTransducer
-
-
-@dataclass
-class Hypothesis:
-    tokens: List[int]
-    score: float
-    timestep: int
-
-    @property
-    def avg_score(self) -> float:
-        return self.score / len(self.tokens)
-
-
-def extended_hypothesis(base_hyp: Hypothesis, token: int, is_blank: bool, score: float) -> Hypothesis:
-    return Hypothesis(
-        base_hyp.tokens + [token],
-        base_hyp.score + score,
-        base_hyp.timestep + int(is_blank),
-    )
-
-
-def beam_search(*, model: RNNT, features: torch.Tensor, features_len: torch.Tensor, beam_size: int = 100) -> List[int]:
-    # Some dimension checks
-    assert features.dim() == 2 or (features.dim() == 3 and features.size(0) == 1)  # [T, F] or [1, T, F]
-    if features.dim() == 2:
-        features = features.unsqueeze(0)  # [1, T, F]
-
-    assert features_len.dim() == 0 or (features_len.dim() == 1 and features_len.size(0) == 1)  # [] or [1]
-    if features_len.dim() == 0:
-        features_len = features_len.unsqueeze(0)  # [1]
-
-    # Compute encoder once
-    enc, enc_lens = model.forward_encoder(features, features_len)  # [1, T, C], [1]
-    T = enc_lens[0].cpu().item()
-
-    # Function to get scores for time and history to avoid duplicate computation
-    @lru_cache
-    def cached_forward(timestep: int, context_tensor: torch.Tensor) -> torch.Tensor:
-        enc_state = enc[:, timestep]  # [1, C]
-        log_probs = model.forward_single(enc_state, context_tensor.unsqueeze(0))[0]  # [C]
-        scores = -log_probs  # [C]
-        return scores.cpu()
-
-    # Initial hypothesis contains all-blank history with 0 score
-    hypotheses = [Hypothesis([model.blank_idx] * model.context_history_size, 0, 0)]
-
-    # all_finished indicated if all hypotheses have reached the end of the time axis
-    all_finished = False
-    while not all_finished:
-        next_hypotheses = []  # accumulate extended hypotheses in here
-        all_finished = True
-
-        # iterate over all existing hypotheses and extend them
-        for hypothesis in hypotheses:
-            if hypothesis.timestep == T:
-                # hypothesis has already reached end of time axis and is not extended
-                next_hypotheses.append(hypothesis)
-                continue
-
-            # hypothesis gets extended, so not all are finished
-            all_finished = False
-
-            # form limited context of hypothesis into a tensor and compute log probs with it
-            context_tensor = torch.tensor(hypothesis.tokens[-model.context_history_size :], device=enc.device)  # [H]
-            scores = cached_forward(hypothesis.timestep, context_tensor)  # [C]
-
-            # extend hypothesis with all possible next classes
-            for c in range(scores.size(0)):
-                next_hypotheses.append(extended_hypothesis(hypothesis, c, c == model.blank_idx, scores[c].item()))
-
-        # Pruning
-        hypotheses = sorted(next_hypotheses, key=lambda hyp: hyp.avg_score)[:beam_size]
-
-    best_hypothesis = hypotheses[0]  # list has been sorted at the end of the loop so the best is first in the list
-    assert best_hypothesis.timestep == T
-    non_blanks = list(filter(lambda c: c != model.blank_idx, best_hypothesis.tokens))
-
-    return non_blanks
+from i6_experiments.users.berger.pytorch.models.conformer_transducer_v1 import FFNNTransducer
+
+
+def beam_search(
+    *, model: FFNNTransducer, features: torch.Tensor, features_len: torch.Tensor, beam_size: int = 100
+) -> List[List[int]]:
+    """
+    Batched transducer beam search. All hypotheses of all sequences are handled as one [B, K, C] tensor.
+
+    Each hypothesis is extended by every class, where blank advances the time frame and a non-blank label
+    stays on the same frame. Hypotheses which reached the end of their sequence are kept as they are.
+    All candidates are ranked by their score (negative log prob) averaged over the number of tokens
+    (including blanks and the initial blank history), and the best `beam_size` ones are kept.
+
+    The model is only evaluated once for each unique (sequence, time frame, context history).
+    For that, the context history is encoded as a single integer key.
+
+    :param model:
+    :param features: [B, T, F]
+    :param features_len: [B]
+    :param beam_size:
+    :return: per sequence, the non-blank labels of the best hypothesis
+    """
+    assert features.dim() == 3 and features_len.dim() == 1  # [B, T, F], [B]
+    enc, enc_lens = model.forward_encoder(features, features_len)  # [B, T, C], [B]
+    device = enc.device
+    enc_lens = enc_lens.to(device=device, dtype=torch.int64)
+
+    B, T_max, C = enc.shape
+    K = beam_size
+    H = model.context_history_size
+    blank = model.blank_idx
+    assert B * T_max * C**H < 2**63, "context history too long for integer keys"
+    context_key_weights = C ** torch.arange(H, device=device)  # [H]
+
+    context = torch.full([B, K, H], blank, dtype=torch.int64, device=device)  # [B, K, H]
+    score = torch.full([B, K], float("inf"), dtype=torch.float64, device=device)  # [B, K], inf -> no hyp
+    score[:, 0] = 0.0
+    timestep = torch.zeros([B, K], dtype=torch.int64, device=device)  # [B, K]
+    num_tokens = torch.full([B, K], H, dtype=torch.int64, device=device)  # [B, K]
+    keep_label = C  # extra candidate "label" for hypotheses which are kept unchanged
+
+    step_labels = []  # per step: [B, K], -1 if no label was added
+    step_backrefs = []  # per step: [B, K] -> prev K
+
+    while True:
+        valid = torch.isfinite(score)  # [B, K]
+        active = valid & (timestep < enc_lens[:, None])  # [B, K]
+        if not active.any():
+            break
+
+        # Evaluate the model only once per unique (sequence, time frame, context history)
+        b_idx, k_idx = active.nonzero(as_tuple=True)  # [N], [N]
+        t_idx = timestep[b_idx, k_idx]  # [N]
+        hyp_context = context[b_idx, k_idx]  # [N, H]
+        keys = (b_idx * T_max + t_idx) * C**H + (hyp_context * context_key_weights).sum(dim=1)  # [N]
+        unique_keys, inverse = torch.unique(keys, return_inverse=True)  # [U], [N]
+        rep = torch.empty_like(unique_keys).scatter_(0, inverse, torch.arange(len(keys), device=device))  # [U]
+        with torch.no_grad():
+            log_probs = model.forward_single(enc[b_idx[rep], t_idx[rep]], hyp_context[rep])  # [U, C]
+
+        cand_score = torch.full([B, K, C + 1], float("inf"), dtype=torch.float64, device=device)  # [B, K, C+1]
+        cand_score[b_idx, k_idx, :C] = score[b_idx, k_idx, None] - log_probs[inverse].to(torch.float64)
+        cand_score[..., keep_label] = torch.where(valid & ~active, score, float("inf"))
+        cand_len = torch.cat(
+            [(num_tokens + 1)[:, :, None].expand(B, K, C), num_tokens[:, :, None]], dim=2
+        )  # [B, K, C+1]
+
+        # Stable sort, such that ties are resolved by hypothesis order, then class order
+        order = torch.sort((cand_score / cand_len).view(B, -1), dim=1, stable=True).indices[:, :K]  # [B, K]
+        backref = order // (C + 1)  # [B, K] -> prev K
+        label = order % (C + 1)  # [B, K]
+        is_new_label = label != keep_label  # [B, K]
+
+        score = cand_score.view(B, -1).gather(1, order)  # [B, K]
+        timestep = timestep.gather(1, backref) + (label == blank).to(torch.int64)  # [B, K]
+        num_tokens = num_tokens.gather(1, backref) + is_new_label.to(torch.int64)  # [B, K]
+        context = context.gather(1, backref[:, :, None].expand(B, K, H))  # [B, K, H]
+        context = torch.where(
+            is_new_label[:, :, None], torch.cat([context[:, :, 1:], label[:, :, None]], dim=2), context
+        )  # [B, K, H]
+
+        step_labels.append(torch.where(is_new_label, label, -1).cpu())
+        step_backrefs.append(backref.cpu())
+
+    # Backtrack the best hypothesis, which is the first one due to the sorting
+    result = []
+    for b in range(B):
+        k = 0
+        labels = []
+        for labels_, backrefs_ in zip(reversed(step_labels), reversed(step_backrefs)):
+            label_ = labels_[b, k].item()
+            if label_ >= 0 and label_ != blank:
+                labels.append(label_)
+            k = backrefs_[b, k].item()
+        result.append(labels[::-1])
+
+    return result
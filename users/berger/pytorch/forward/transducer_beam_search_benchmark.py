@@ -0,0 +1,182 @@
+"""
+CPU benchmark: batched :func:`beam_search` vs the previous per-utterance implementation,
+with a small randomly initialized :class:`FFNNTransducer`.
+
+Reports utterances/sec and checks that both give the same recognition result.
+
+Run as:
+
+    python -m i6_experiments.users.berger.pytorch.forward.transducer_beam_search_benchmark
+"""
+
+import argparse
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Tuple
+
+import torch
+
+from i6_models.config import ModelConfiguration, ModuleFactoryV1
+from i6_experiments.users.berger.pytorch.models.conformer_transducer_v1 import FFNNTransducer, FFNNTransducerConfig
+from i6_experiments.users.berger.pytorch.forward.transducer_beam_search import beam_search
+
+
+@dataclass
+class Hypothesis:
+    tokens: List[int]
+    score: float
+    timestep: int
+
+    @property
+    def avg_score(self) -> float:
+        return self.score / len(self.tokens)
+
+
+def extended_hypothesis(base_hyp: Hypothesis, token: int, is_blank: bool, score: float) -> Hypothesis:
+    return Hypothesis(
+        base_hyp.tokens + [token],
+        base_hyp.score + score,
+        base_hyp.timestep + int(is_blank),
+    )
+
+
+def beam_search_per_utterance(
+    *, model: FFNNTransducer, features: torch.Tensor, features_len: torch.Tensor, beam_size: int = 100
+) -> List[int]:
+    """
+    Previous implementation, one utterance at a time. features: [1, T, F], features_len: [1]
+    """
+    enc, enc_lens = model.forward_encoder(features, features_len)  # [1, T, C], [1]
+    T = enc_lens[0].cpu().item()
+
+    @lru_cache
+    def cached_forward(timestep: int, context_tensor: torch.Tensor) -> torch.Tensor:
+        enc_state = enc[:, timestep]  # [1, C]
+        log_probs = model.forward_single(enc_state, context_tensor.unsqueeze(0))[0]  # [C]
+        scores = -log_probs  # [C]
+        return scores.cpu()
+
+    hypotheses = [Hypothesis([model.blank_idx] * model.context_history_size, 0, 0)]
+
+    all_finished = False
+    while not all_finished:
+        next_hypotheses = []
+        all_finished = True
+        for hypothesis in hypotheses:
+            if hypothesis.timestep == T:
+                next_hypotheses.append(hypothesis)
+                continue
+            all_finished = False
+            context_tensor = torch.tensor(hypothesis.tokens[-model.context_history_size :], device=enc.device)  # [H]
+            scores = cached_forward(hypothesis.timestep, context_tensor)  # [C]
+            for c in range(scores.size(0)):
+                next_hypotheses.append(extended_hypothesis(hypothesis, c, c == model.blank_idx, scores[c].item()))
+        hypotheses = sorted(next_hypotheses, key=lambda hyp: hyp.avg_score)[:beam_size]
+
+    best_hypothesis = hypotheses[0]
+    assert best_hypothesis.timestep == T
+    return list(filter(lambda c: c != model.blank_idx, best_hypothesis.tokens))
+
+
+@dataclass
+class _IdentityConfig(ModelConfiguration):
+    pass
+
+
+class _Identity(torch.nn.Module):
+    def __init__(self, cfg: _IdentityConfig):
+        super().__init__()
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return x
+
+
+@dataclass
+class _FeedForwardEncoderConfig(ModelConfiguration):
+    in_dim: int
+    out_dim: int
+
+
+class _FeedForwardEncoder(torch.nn.Module):
+    """Stands in for the conformer, same interface"""
+
+    def __init__(self, cfg: _FeedForwardEncoderConfig):
+        super().__init__()
+        self.linear = torch.nn.Linear(cfg.in_dim, cfg.out_dim)
+
+    def forward(self, x: torch.Tensor, sequence_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        return torch.tanh(self.linear(x)), sequence_mask
+
+
+def make_random_model(*, num_inputs: int, num_classes: int, context_history_size: int) -> FFNNTransducer:
+    torch.manual_seed(42)
+    cfg = FFNNTransducerConfig(
+        specaugment=ModuleFactoryV1(_Identity, _IdentityConfig()),
+        conformer=ModuleFactoryV1(_FeedForwardEncoder, _FeedForwardEncoderConfig(in_dim=num_inputs, out_dim=128)),
+        encoder_dim=128,
+        prediction_layers=1,
+        prediction_layer_size=128,
+        prediction_act=torch.nn.Tanh(),
+        prediction_dropout=0.0,
+        joint_layer_size=64,
+        joint_act=torch.nn.Tanh(),
+        context_history_size=context_history_size,
+        context_embedding_size=32,
+        target_size=num_classes,
+        blank_idx=0,
+    )
+    model = FFNNTransducer(step=0, cfg=cfg)
+    with torch.no_grad():
+        # Mostly emit blank, as a trained model would. Otherwise the search might not end.
+        model.joint[-1].bias[0] += 4.0
+    return model.eval()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-utterances", type=int, default=16)
+    parser.add_argument("--num-frames", type=int, default=50)
+    parser.add_argument("--num-inputs", type=int, default=40)
+    parser.add_argument("--num-classes", type=int, default=40)
+    parser.add_argument("--context-history-size", type=int, default=1)
+    parser.add_argument("--beam-size", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    model = make_random_model(
+        num_inputs=args.num_inputs, num_classes=args.num_classes, context_history_size=args.context_history_size
+    )
+    gen = torch.Generator().manual_seed(0)
+    features = torch.randn(args.num_utterances, args.num_frames, args.num_inputs, generator=gen)
+    features_len = torch.randint(args.num_frames // 2, args.num_frames + 1, (args.num_utterances,), generator=gen)
+    features_len[0] = args.num_frames
+
+    with torch.no_grad():
+        start = time.perf_counter()
+        per_utterance = [
+            beam_search_per_utterance(
+                model=model,
+                features=features[b : b + 1, : features_len[b]],
+                features_len=features_len[b : b + 1],
+                beam_size=args.beam_size,
+            )
+            for b in range(args.num_utterances)
+        ]
+        elapsed_per_utterance = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched = beam_search(model=model, features=features, features_len=features_len, beam_size=args.beam_size)
+        elapsed_batched = time.perf_counter() - start
+
+    for name, elapsed in [("per-utterance", elapsed_per_utterance), ("batched", elapsed_batched)]:
+        print(f"{name:>14}: {args.num_utterances / elapsed:8.2f} utterances/sec")
+
+    num_equal = sum(a == b for a, b in zip(per_utterance, batched))
+    print(f"identical results: {num_equal}/{args.num_utterances}")
+    assert num_equal == args.num_utterances
+
+
+if __name__ == "__main__":
+    main()
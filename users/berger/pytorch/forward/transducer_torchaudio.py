@@ -1,11 +1,10 @@
-import torch
 from torchaudio.models.rnnt import RNNT
 from torchaudio.models.rnnt_decoder import RNNTBeamSearch, _get_hypo_tokens, _get_hypo_score
 import numpy as np
 from returnn.frontend import Tensor
 from returnn.tensor.tensor_dict import TensorDict
 from sisyphus import tk
-from i6_core.lib.lexicon import Lexicon
+from i6_experiments.users.berger.pytorch.forward.decoding_context import get_decoding_context
 
 
 def beam_search_forward_step(
@@ -20,33 +19,28 @@ def beam_search_forward_step(
     assert audio_features is not None
     assert audio_features_len is not None
 
-    lexicon = Lexicon()
-    lexicon.load(lexicon_file)
-    label_list = list(lexicon.phonemes)
+    ctx = get_decoding_context(model=model, lexicon_file=lexicon_file)
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-    beam_search = RNNTBeamSearch(model=model, blank=blank_id, step_max_tokens=1)
+    beam_search = RNNTBeamSearch(model=ctx.model, blank=blank_id, step_max_tokens=1)
 
     tokens_arrays = []
     tokens_len = []
 
     for b in range(audio_features.size(0)):
         top_hypotheses = beam_search.forward(
-            input=audio_features[b : b + 1, : audio_features_len[b]].to(device=device),
-            length=audio_features_len[b : b + 1].to(device=device),
+            input=audio_features[b : b + 1, : audio_features_len[b]].to(device=ctx.device),
+            length=audio_features_len[b : b + 1].to(device=ctx.device),
             beam_width=beam_size,
         )
         top_hypothesis = top_hypotheses[0]
         tokens = _get_hypo_tokens(top_hypothesis)
         score = _get_hypo_score(top_hypothesis)
 
-        clean_tokens = filter(lambda idx: idx != blank_id, tokens)
-        clean_tokens_str = [label_list[token] for token in clean_tokens]
+        tokens_array = ctx.labels_from_indices(tokens)
+        tokens_array = tokens_array[np.asarray(tokens) != blank_id]
         print(f"Recognized sequence {repr(seq_tags[b])}. Top hypothesis (score {score}, avg: {score / len(tokens)}):")
-        print(f"    {repr(clean_tokens_str)}")
+        print(f"    {repr(tokens_array.tolist())}")
 
-        tokens_array = np.array(clean_tokens_str, dtype="<U3")
         tokens_arrays.append(tokens_array)
         tokens_len.append(len(tokens_array))
 
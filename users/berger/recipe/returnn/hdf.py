@@ -98,9 +98,11 @@ class BlissCorpusToTargetHdfJob(Job):
         else:
             word_separation_targets = []
 
+        from i6_experiments.common.helpers.hdf import BufferedSimpleHDFWriter
+
         # Create hdf writer
-        out_hdf_writer = get_returnn_simple_hdf_writer(self.returnn_root.get())(
-            filename=self.out_hdf, dim=self.dim, ndim=1
+        out_hdf_writer = BufferedSimpleHDFWriter(
+            get_returnn_simple_hdf_writer(self.returnn_root.get())(filename=self.out_hdf, dim=self.dim, ndim=1)
         )
 
         # Load corpus
@@ -127,11 +129,7 @@ class BlissCorpusToTargetHdfJob(Job):
             segment_targets.extend(word_targets[-1])
 
             # Write target sequence into hdf
-            out_hdf_writer.insert_batch(
-                inputs=np.array(segment_targets).reshape((1, -1)),
-                seq_len=[len(segment_targets)],
-                seq_tag=[segment.fullname()],
-            )
+            out_hdf_writer.insert(np.array(segment_targets), segment.fullname())
         out_hdf_writer.close()
 
 
@@ -140,18 +138,35 @@ def _identity(x):
 
 
 class MatchLengthsJob(Job):
+    """
+    Pads (by repeating the last frame) or cuts the sequences of data_hdf,
+    such that their lengths match the lengths of the same sequences in match_hdfs.
+
+    The data is processed in chunks of consecutive sequences, thus the memory usage is bounded by the chunk size.
+    """
+
+    __sis_hash_exclude__ = {"chunk_size": 1_000_000}
+
     def __init__(
         self,
         data_hdf: tk.Path,
         match_hdfs: List[tk.Path],
         match_len_transform_func: Optional[Callable[[int], int]] = None,
+        chunk_size: int = 1_000_000,
     ) -> None:
+        """
+        :param data_hdf:
+        :param match_hdfs:
+        :param match_len_transform_func: applied to the lengths of match_hdfs
+        :param chunk_size: number of input frames which are processed at once (at least one full sequence)
+        """
         self.data_hdf = data_hdf
         self.match_hdfs = match_hdfs
         if match_len_transform_func is None:
             self.match_len_transform_func = _identity
         else:
             self.match_len_transform_func = match_len_transform_func
+        self.chunk_size = chunk_size
 
         self.out_hdf = self.output_path("data.hdf")
 
@@ -188,50 +203,72 @@ class MatchLengthsJob(Job):
                 dict(
                     zip(
                         match_hdf_file["seqTags"],
-                        [self.match_len_transform_func(length[0]) for length in match_hdf_file["seqLengths"]],
+                        [self.match_len_transform_func(int(length)) for length in match_hdf_file["seqLengths"][:, 0]],
                     )
                 )
             )
 
-        matched_inputs = []
-        matched_lengths = []
-        current_begin_pos = 0
-        num_mismatches = 0
-        for tag, length in zip(hdf_file["seqTags"], [length[0] for length in hdf_file["seqLengths"]]):
-            target_length = match_length_map.get(tag, length)
-
-            if target_length == length:
-                matched_seq = hdf_file["inputs"][current_begin_pos : current_begin_pos + length]
-            elif length < target_length:
-                pad_value = hdf_file["inputs"][current_begin_pos + length - 1]
-                pad_list = np.array([pad_value for _ in range(target_length - length)])
-                matched_seq = np.concatenate(
-                    [hdf_file["inputs"][current_begin_pos : current_begin_pos + length], pad_list], axis=0
-                )
-                print(
-                    f"Length for segment {tag} is shorter ({length}) than the target ({target_length}). Append {pad_list}."
-                )
-                num_mismatches += 1
-            else:  # length > target_length
-                print(
-                    f"Length for segment {tag} is longer ({length}) than the target ({target_length}). Cut off {hdf_file['inputs'][current_begin_pos + target_length : current_begin_pos + length]}."
+        # Compute all lengths and offsets up front
+        inputs = hdf_file["inputs"]
+        tags = hdf_file["seqTags"][:]
+        lengths = hdf_file["seqLengths"][:, 0].astype(np.int64)  # [N]
+        target_lengths = np.array(
+            [match_length_map.get(tag, length) for tag, length in zip(tags, lengths)], dtype=np.int64
+        )  # [N]
+        num_seqs = len(lengths)
+        in_offsets = np.concatenate([[0], np.cumsum(lengths)])  # [N+1]
+        out_offsets = np.concatenate([[0], np.cumsum(target_lengths)])  # [N+1]
+        assert np.all(lengths[target_lengths > lengths] > 0), "cannot pad empty sequences"
+
+        matched_inputs = out_hdf.create_dataset(
+            "inputs", shape=(out_offsets[-1],) + inputs.shape[1:], dtype=inputs.dtype
+        )
+        for attr_key, attr_val in inputs.attrs.items():
+            matched_inputs.attrs[attr_key] = attr_val
+
+        seq_start = 0
+        while seq_start < num_seqs:
+            # consecutive sequences with at most chunk_size input frames, but at least one sequence
+            seq_end = max(
+                int(np.searchsorted(in_offsets, in_offsets[seq_start] + self.chunk_size, side="right")) - 1,
+                seq_start + 1,
+            )
+            seq_end = min(seq_end, num_seqs)
+            chunk = inputs[in_offsets[seq_start] : in_offsets[seq_end]]
+
+            chunk_lengths = lengths[seq_start:seq_end]
+            chunk_target_lengths = target_lengths[seq_start:seq_end]
+            if np.array_equal(chunk_lengths, chunk_target_lengths):
+                matched_chunk = chunk
+            else:
+                # For each output frame, the input frame, where padded frames repeat the last frame of the sequence
+                seq_idx = np.repeat(np.arange(seq_end - seq_start), chunk_target_lengths)
+                pos = np.arange(len(seq_idx)) - (out_offsets[seq_start:seq_end] - out_offsets[seq_start])[seq_idx]
+                src = (in_offsets[seq_start:seq_end] - in_offsets[seq_start])[seq_idx] + np.minimum(
+                    pos, chunk_lengths[seq_idx] - 1
                 )
-                matched_seq = hdf_file["inputs"][current_begin_pos : current_begin_pos + target_length]
-                num_mismatches += 1
-
-            assert len(matched_seq) == target_length
-            matched_inputs.extend(matched_seq)
-            matched_lengths.append([target_length])
-            current_begin_pos += length
-
+                matched_chunk = chunk[src]
+
+                for i in np.flatnonzero(chunk_lengths != chunk_target_lengths):
+                    tag, length, target_length = tags[seq_start + i], chunk_lengths[i], chunk_target_lengths[i]
+                    begin = in_offsets[seq_start + i] - in_offsets[seq_start]
+                    if length < target_length:
+                        print(
+                            f"Length for segment {tag} is shorter ({length}) than the target ({target_length}). Append {target_length - length} times {chunk[begin + length - 1]}."
+                        )
+                    else:
+                        print(
+                            f"Length for segment {tag} is longer ({length}) than the target ({target_length}). Cut off {chunk[begin + target_length : begin + length]}."
+                        )
+
+            matched_inputs[out_offsets[seq_start] : out_offsets[seq_end]] = matched_chunk
+            seq_start = seq_end
+
+        num_mismatches = int(np.sum(lengths != target_lengths))
         print(f"Finished processing. Corrected {num_mismatches} mismatched lengths in total.")
 
-        matched_inputs = np.array(matched_inputs, dtype=hdf_file["inputs"].dtype)
-        matched_lengths = np.array(matched_lengths, dtype=hdf_file["seqLengths"].dtype)
+        matched_lengths = target_lengths[:, None].astype(hdf_file["seqLengths"].dtype)
 
-        out_hdf.create_dataset("inputs", data=matched_inputs)
-        for attr_key, attr_val in hdf_file["inputs"].attrs.items():
-            out_hdf["inputs"].attrs[attr_key] = attr_val
         copy_data_group(hdf_file, "seqTags", out_hdf)
         out_hdf.create_dataset("seqLengths", data=matched_lengths)
         for attr_key, attr_val in hdf_file["seqLengths"].attrs.items():
@@ -1,14 +1,15 @@
 from difflib import SequenceMatcher
 import logging
 import numpy as np
-import subprocess
-from typing import Iterator, List, Tuple, TypeVar
-import sys
+import pickle
+from typing import Dict, Iterator, List, Tuple, TypeVar
 
 from sisyphus import Job, Path, Task
 
 from i6_core.lib.rasr_cache import FileArchiveBundle
 
+from ..cache_manager import cache_file
+
 
 NUM_TASKS = 16
 
@@ -16,7 +17,7 @@ T = TypeVar("T")
 
 
 def cache(path: Path) -> str:
-    return subprocess.check_output(["cf", path.get_path()]).decode(sys.stdout.encoding).strip()
+    return cache_file(path)
 
 
 def get_mixture_indices(a_cache: FileArchiveBundle, segment: str) -> np.ndarray:
@@ -36,9 +37,12 @@ class ComputeTimestampErrorJob(Job):
 
     The reference alignment can be more fine-grained on the timescale
     than the alignment to be tested.
+
+    The segments are distributed across `num_tasks` subtasks, whose partial
+    results are reduced in a final merge task.
     """
 
-    __sis_hash_exclude__ = {"fuzzy_match_mismatching_phoneme_sequences": False}
+    __sis_hash_exclude__ = {"fuzzy_match_mismatching_phoneme_sequences": False, "num_tasks": NUM_TASKS}
 
     def __init__(
         self,
@@ -50,8 +54,10 @@ class ComputeTimestampErrorJob(Job):
         reference_alignment: Path,
         reference_t_step: float,
         fuzzy_match_mismatching_phoneme_sequences: bool = False,
+        num_tasks: int = NUM_TASKS,
     ):
         assert t_step >= reference_t_step > 0
+        assert num_tasks > 0
 
         super().__init__()
 
@@ -64,6 +70,7 @@ class ComputeTimestampErrorJob(Job):
         self.reference_t_step = reference_t_step
 
         self.fuzzy_match_mismatching_phoneme_sequences = fuzzy_match_mismatching_phoneme_sequences
+        self.num_tasks = num_tasks
 
         self.out_num_processed = self.output_var("num_processed")
         self.out_num_skipped = self.output_var("num_skipped")
@@ -73,17 +80,24 @@ class ComputeTimestampErrorJob(Job):
         self.rqmt = {"cpu": 1, "mem": 8, "time": 1}
 
     def tasks(self) -> Iterator[Task]:
-        yield Task("run", resume="run", rqmt=self.rqmt)
+        yield Task("run", resume="run", rqmt=self.rqmt, args=list(range(self.num_tasks)))
+        yield Task("merge", mini_task=True)
+
+    @staticmethod
+    def _partial_file(task_index: int) -> str:
+        # relative to the job's work directory
+        return f"tse.{task_index}.pkl"
 
-    def run(self):
+    def run(self, task_index: int):
         alignment = FileArchiveBundle(cache(self.alignment))
         alignment.setAllophones(self.allophones.get_path())
 
         ref_alignment = FileArchiveBundle(cache(self.reference_alignment))
         ref_alignment.setAllophones(self.reference_allophones.get_path())
 
-        segments = [f for f in alignment.file_list() if not f.endswith(".attribs")]
-        self.out_num_processed.set(len(segments))
+        all_segments = [f for f in alignment.file_list() if not f.endswith(".attribs")]
+        segments = all_segments[task_index :: self.num_tasks]
+        logging.info(f"processing {len(segments)}/{len(all_segments)} segments in task {task_index}")
 
         s_idx = next(iter(alignment.files.values())).allophones.index("[SILENCE]{#+#}@i@f")
         ref_s_idx = next(iter(ref_alignment.files.values())).allophones.index("[SILENCE]{#+#}@i@f")
@@ -164,6 +178,34 @@ class ComputeTimestampErrorJob(Job):
             total_dist += sum(dists)
             tse[seg] = (sum(dists) / sum(nums)) * self.t_step
 
+        partial = {
+            "num_processed": len(segments),
+            "num_skipped": skipped,
+            "total_dist": total_dist,
+            "total_num": total_num,
+            "tse": tse,
+        }
+        with open(self._partial_file(task_index), "wb") as f:
+            pickle.dump(partial, f)
+
+    def merge(self):
+        num_processed = 0
+        skipped = 0
+        total_dist = 0
+        total_num = 0
+        tse: Dict[str, float] = {}
+
+        for i in range(self.num_tasks):
+            with open(self._partial_file(i), "rb") as f:
+                partial = pickle.load(f)
+
+            num_processed += partial["num_processed"]
+            skipped += partial["num_skipped"]
+            total_dist += partial["total_dist"]
+            total_num += partial["total_num"]
+            tse.update(partial["tse"])
+
+        self.out_num_processed.set(num_processed)
         self.out_num_skipped.set(skipped)
         self.out_tse.set((total_dist / total_num) * self.t_step)
         self.out_tse_per_seq.set(tse)
@@ -200,13 +242,16 @@ class ComputeWordLevelTimestampErrorJob(ComputeTimestampErrorJob):
         # Find the next phoneme that is at the word-end and "smear" it over
         # the word. This way we consider word-ends for the TSE only.
         #
-        # Probably pretty slow this here, but we should be able to avoid separate
-        # phoneme sequences this way.
+        # Frames w/o a following word-end phoneme keep their own mixture index.
         all_allos = alignment.files[seg_name].allophones
-        final_phonemes = [
-            next((mix_j for mix_j in mix_indices[i:] if "@f" in all_allos[mix_j]), mix)
-            for i, mix in enumerate(mix_indices)
-        ]
+        mix_indices = mix_indices.astype(int)
+        is_final = {mix: "@f" in all_allos[mix] for mix in np.unique(mix_indices)}
+
+        n = len(mix_indices)
+        final_positions = np.where([is_final[mix] for mix in mix_indices], np.arange(n), n)
+        next_final = np.minimum.accumulate(final_positions[::-1])[::-1]
+        final_phonemes = np.where(next_final < n, mix_indices[np.minimum(next_final, n - 1)], mix_indices)
+
         return super()._compute_begins_ends(
-            alignment=alignment, seg_name=seg_name, mix_indices=np.array(final_phonemes), silence_idx=silence_idx
+            alignment=alignment, seg_name=seg_name, mix_indices=final_phonemes, silence_idx=silence_idx
         )
@@ -0,0 +1,308 @@
+__all__ = ["AddAlignmentScoresToNBestJob", "LatticeToNBestJob", "NBestToCorpusJob", "RescoreNBestJob"]
+
+import itertools
+import shutil
+import typing
+
+from i6_core import rasr, util
+from i6_experiments.common.helpers.nbest import (
+    HTK_SCORE_FIELDS,
+    NBestLists,
+    find_best_scales,
+    read_htk_nbest_archive,
+    read_rasr_alignment_scores,
+    with_rank_scores,
+)
+
+from sisyphus import tk, Job, Task
+
+
+Path = tk.setup_path(__package__)
+
+
+class LatticeToNBestJob(rasr.RasrCommand, Job):
+    """
+    Extracts the N best hypotheses of RASR lattices together with their unscaled AM and LM scores,
+    and stores them in a single N-best file, see i6_experiments.common.helpers.nbest.
+
+    The AM score contains everything the acoustic model adds, i.e. also the prior and the TDPs.
+    To only tune the AM and LM scales, OptimizeAMandLMScaleJob on the lattices (opt_lm_am) is sufficient,
+    to separate the prior and the TDPs, see NBestToCorpusJob and AddAlignmentScoresToNBestJob.
+    """
+
+    def __init__(
+        self,
+        crp: rasr.CommonRasrParameters,
+        lattice_cache: tk.Path,
+        n: int = 100,
+        parallelize: bool = True,
+        extra_config: typing.Optional[rasr.RasrConfig] = None,
+        extra_post_config: typing.Optional[rasr.RasrConfig] = None,
+    ):
+        self.set_vis_name("Lattice to N-best")
+        kwargs = locals()
+        del kwargs["self"]
+
+        self.config, self.post_config = LatticeToNBestJob.create_config(**kwargs)
+        self.exe = self.select_exe(crp.flf_tool_exe, "flf-tool")
+        self.concurrent = crp.concurrent if parallelize else 1
+
+        self.out_log_file = self.log_file_output_path("lattice_to_nbest", crp, self.concurrent > 1)
+        self.out_nbest = self.output_path("nbest.npz")
+
+        self.rqmt = {"time": 2, "cpu": 1, "mem": 4}
+
+    def tasks(self):
+        yield Task("create_files", mini_task=True)
+        yield Task("run", resume="run", rqmt=self.rqmt, args=range(1, self.concurrent + 1))
+        yield Task("convert", rqmt={"time": 1, "cpu": 1, "mem": 8})
+
+    def create_files(self):
+        self.write_config(self.config, self.post_config, "lattice_to_nbest.config")
+        self.write_run_script(self.exe, "lattice_to_nbest.config")
+
+    def run(self, task_id):
+        log_file = self.out_log_file if self.concurrent <= 1 else self.out_log_file[task_id]
+        self.run_script(task_id, log_file)
+
+    def cleanup_before_run(self, cmd, retry, task_id, *args):
+        util.backup_if_exists("lattice_to_nbest.log.%d" % task_id)
+        shutil.rmtree("nbest.%d" % task_id, ignore_errors=True)
+
+    def convert(self):
+        nbest = {}
+        for task_id in range(1, self.concurrent + 1):
+            nbest.update(read_htk_nbest_archive("nbest.%d" % task_id))
+
+        NBestLists.from_hyps(nbest, list(HTK_SCORE_FIELDS.values())).save(self.out_nbest.get_path())
+
+    @classmethod
+    def create_config(cls, crp, lattice_cache, n, parallelize, extra_config, extra_post_config, **kwargs):
+        config, post_config = rasr.build_config_from_mapping(
+            crp,
+            {
+                "corpus": "flf-lattice-tool.corpus",
+                "lexicon": "flf-lattice-tool.lexicon",
+            },
+            parallelize=parallelize,
+        )
+
+        # segment
+        config.flf_lattice_tool.network.initial_nodes = "segment"
+        config.flf_lattice_tool.network.segment.type = "speech-segment"
+        config.flf_lattice_tool.network.segment.links = "1->archive-reader:1 0->archive-writer:1"
+
+        # read lattice
+        config.flf_lattice_tool.network.archive_reader.type = "archive-reader"
+        config.flf_lattice_tool.network.archive_reader.links = "to-lemma"
+        config.flf_lattice_tool.network.archive_reader.format = "flf"
+        config.flf_lattice_tool.network.archive_reader.path = lattice_cache
+
+        # map alphabet
+        config.flf_lattice_tool.network.to_lemma.type = "map-alphabet"
+        config.flf_lattice_tool.network.to_lemma.links = "n-best"
+        config.flf_lattice_tool.network.to_lemma.map_input = "to-lemma"
+        config.flf_lattice_tool.network.to_lemma.project_input = True
+
+        # n-best, w.r.t. the scales of the search
+        config.flf_lattice_tool.network.n_best.type = "n-best"
+        config.flf_lattice_tool.network.n_best.links = "archive-writer"
+        config.flf_lattice_tool.network.n_best.n = n
+        config.flf_lattice_tool.network.n_best.remove_duplicates = True
+        config.flf_lattice_tool.network.n_best.ignore_non_words = True
+
+        # write the n-best lattices with the unscaled scores of all dimensions
+        config.flf_lattice_tool.network.archive_writer.type = "archive-writer"
+        config.flf_lattice_tool.network.archive_writer.links = "sink:1"
+        config.flf_lattice_tool.network.archive_writer.format = "htk"
+        config.flf_lattice_tool.network.archive_writer.path = "nbest.$(TASK)"
+
+        # sink
+        config.flf_lattice_tool.network.sink.type = "sink"
+        post_config.flf_lattice_tool.network.sink.warn_on_empty_lattice = True
+        post_config.flf_lattice_tool.network.sink.error_on_empty_lattice = False
+
+        config._update(extra_config)
+        post_config._update(extra_post_config)
+
+        return config, post_config
+
+    @classmethod
+    def hash(cls, kwargs):
+        config, post_config = cls.create_config(**kwargs)
+        return super().hash({"config": config, "exe": kwargs["crp"].flf_tool_exe})
+
+
+class NBestToCorpusJob(Job):
+    """
+    Creates one corpus per rank of the N-best lists, with the words of the hypothesis of this rank as orthography
+    of each segment, to score all hypotheses by forced alignment.
+
+    The segment names stay the same, so that the features are found in the same caches. Segments with fewer
+    hypotheses repeat their last one, and segments without hypotheses get an empty orthography,
+    the scores of these are not used.
+    """
+
+    def __init__(self, nbest: tk.Path, bliss_corpus: tk.Path, n: int):
+        """
+        :param nbest: N-best file, e.g. from LatticeToNBestJob
+        :param bliss_corpus: the corpus of the N-best lists
+        :param n: number of ranks, i.e. the n of the N-best lists
+        """
+        self.nbest = nbest
+        self.bliss_corpus = bliss_corpus
+        self.n = n
+
+        self.out_corpora = {rank: self.output_path(f"corpus.{rank}.xml.gz") for rank in range(n)}
+
+        self.rqmt = {"time": 1, "cpu": 1, "mem": 4}
+
+    def tasks(self):
+        yield Task("run", rqmt=self.rqmt)
+
+    def run(self):
+        from i6_core.lib import corpus
+
+        nbest = NBestLists.load(self.nbest.get_path())
+        hyps = {
+            segment: [" ".join(nbest.get_hyp(h)) for h in hyp_indices] for segment, hyp_indices in nbest.iter_segments()
+        }
+
+        c = corpus.Corpus()
+        c.load(self.bliss_corpus.get_path())
+        for rank, out_corpus in self.out_corpora.items():
+            for seg in c.segments():
+                seg_hyps = hyps.get(seg.fullname(), [])
+                seg.orth = seg_hyps[min(rank, len(seg_hyps) - 1)] if seg_hyps else ""
+            c.dump(out_corpus.get_path())
+
+
+class AddAlignmentScoresToNBestJob(Job):
+    """
+    Replaces the AM score of N-best lists by separate components from forced alignments of the hypotheses,
+    e.g. the acoustic model without prior and TDPs, the priors and the TDPs.
+
+    `base` is aligned without all other components (e.g. prior and TDP scale 0), and each other component is aligned
+    with only this one added at scale 1. The costs of the other components are the differences to `base`.
+    As each alignment has its own best path, this is an approximation of their costs on one path.
+    Hypotheses which could not be aligned in all alignments are dropped.
+    """
+
+    def __init__(
+        self,
+        nbest: tk.Path,
+        alignment_logs: typing.Dict[str, typing.Sequence[typing.Dict[int, tk.Path]]],
+        base: str = "am",
+        keep: typing.Sequence[str] = ("lm",),
+    ):
+        """
+        :param nbest: N-best file, e.g. from LatticeToNBestJob
+        :param alignment_logs: score component -> per rank the logs of the alignment of the corpus of this rank,
+            see NBestToCorpusJob
+        :param base: component which is aligned without all others
+        :param keep: components of the N-best file which are kept, e.g. the LM score
+        """
+        assert base in alignment_logs
+        assert len(set(len(logs) for logs in alignment_logs.values())) == 1, "need the same ranks for all components"
+
+        self.nbest = nbest
+        self.alignment_logs = alignment_logs
+        self.base = base
+        self.keep = keep
+
+        self.out_nbest = self.output_path("nbest.npz")
+        self.out_num_dropped = self.output_var("num_dropped")
+
+        self.rqmt = {"time": 1, "cpu": 1, "mem": 8}
+
+    def tasks(self):
+        yield Task("run", rqmt=self.rqmt)
+
+    def run(self):
+        rank_scores = {}
+        for name, logs in self.alignment_logs.items():
+            rank_scores[name] = []
+            for rank_logs in logs:
+                scores = {}
+                for log in rank_logs.values():
+                    scores.update(read_rasr_alignment_scores(log.get_path()))
+                rank_scores[name].append(scores)
+
+        base_scores = rank_scores.pop(self.base)
+        components = {self.base: base_scores}
+        for name, scores in rank_scores.items():
+            components[name] = [
+                {segment: cost - base[segment] for segment, cost in rank.items() if segment in base}
+                for rank, base in zip(scores, base_scores)
+            ]
+
+        nbest = NBestLists.load(self.nbest.get_path())
+        rescored = with_rank_scores(nbest, components, keep=self.keep)
+        rescored.save(self.out_nbest.get_path())
+        self.out_num_dropped.set(nbest.num_hyps - rescored.num_hyps)
+
+
+class RescoreNBestJob(Job):
+    """
+    Re-ranks N-best lists with all combinations of the given scales and counts the word errors against
+    the orthography of the corpus, to find the best scales without a recognition per combination.
+
+    The errors are counted per word after removing `ignore_words`, without the normalization of sclite,
+    so the WERs are only meant for ranking the scales. The chosen scales should be confirmed with a recognition.
+    """
+
+    def __init__(
+        self,
+        nbest: tk.Path,
+        bliss_corpus: tk.Path,
+        scales: typing.Dict[str, typing.Sequence[float]],
+        ignore_words: typing.Sequence[str] = ("[SILENCE]", "[NOISE]", "[VOCALIZED-NOISE]", "[LAUGHTER]", "[UNKNOWN]"),
+    ):
+        """
+        :param nbest: N-best file, e.g. from LatticeToNBestJob
+        :param bliss_corpus: for the reference orthographies
+        :param scales: score component -> values, all components of the N-best file are needed
+        :param ignore_words: non speech lemmas, removed from the references and the hypotheses
+        """
+        self.nbest = nbest
+        self.bliss_corpus = bliss_corpus
+        self.scales = scales
+        self.ignore_words = ignore_words
+
+        self.out_best_scales = {name: self.output_var(f"best_{name}_scale") for name in scales}
+        self.out_num_errors = self.output_var("num_errors")
+        self.out_wer = self.output_var("wer")
+        self.out_report = self.output_path("report.txt")
+
+        self.rqmt = {"time": 1, "cpu": 1, "mem": 8}
+
+    def tasks(self):
+        yield Task("run", rqmt=self.rqmt)
+
+    def run(self):
+        import numpy as np
+        from i6_core.lib import corpus
+
+        nbest = NBestLists.load(self.nbest.get_path())
+        assert set(nbest.score_names) == set(self.scales), f"need scales for {nbest.score_names}"
+
+        c = corpus.Corpus()
+        c.load(self.bliss_corpus.get_path())
+        references = {seg.fullname(): (seg.orth or "").split() for seg in c.segments()}
+        missing = [segment for segment in nbest.segments if segment not in references]
+        assert not missing, f"{len(missing)} N-best segments not in the corpus, e.g. {missing[0]}"
+
+        combinations = np.array(list(itertools.product(*(self.scales[name] for name in nbest.score_names))))
+        best, num_errors, num_ref_words = find_best_scales(
+            nbest, combinations, references, ignore_words=self.ignore_words
+        )
+
+        with open(self.out_report.get_path(), "wt") as f:
+            f.write(" ".join(nbest.score_names) + " num_errors wer\n")
+            for scales, errors in sorted(zip(combinations.tolist(), num_errors.tolist()), key=lambda x: x[1]):
+                f.write(f"{' '.join(str(s) for s in scales)} {errors} {100.0 * errors / max(num_ref_words, 1):.2f}\n")
+
+        for name, value in zip(nbest.score_names, combinations[best].tolist()):
+            self.out_best_scales[name].set(value)
+        self.out_num_errors.set(int(num_errors[best]))
+        self.out_wer.set(100.0 * num_errors[best] / max(num_ref_words, 1))
@@ -1,2 +1,2 @@
-from .alignment import RasrAlignmentToHDF, RasrForcedTriphoneAlignmentToHDF
+from .alignment import RasrAlignmentToHDF, RasrForcedTriphoneAlignmentToHDF, ShardedRasrAlignmentToHDF
 from .features import RasrFeaturesToHdf
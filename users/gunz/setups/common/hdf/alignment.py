@@ -1,6 +1,4 @@
-__all__ = ["RasrAlignmentToHDF", "RasrForcedTriphoneAlignmentToHDF"]
-
-import dataclasses
+__all__ = ["RasrAlignmentToHDF", "RasrForcedTriphoneAlignmentToHDF", "ShardedRasrAlignmentToHDF"]
 
 import h5py
 import logging
@@ -12,7 +10,8 @@ import typing
 
 from sisyphus import tk, Job, Task
 
-from i6_core.lib.rasr_cache import FileArchiveBundle
+from i6_core.lib.rasr_cache import FileArchive, FileArchiveBundle
+from i6_core.util import chunks
 
 from ..analysis.allophone_state import AllophoneState
 from ...common.cache_manager import cache_file
@@ -112,29 +111,218 @@ class RasrAlignmentToHDF(Job):
         return targets
 
 
+def force_triphone_contexts(alignment_states: typing.List[str]) -> typing.List[str]:
+    """
+    Replaces the contexts of every non-silence allophone state by the neighboring phonemes.
+
+    The left/right context of a frame is the phoneme of the closest frame before/after it
+    carrying a different phoneme, or `#` for silence and the sequence borders. Silence
+    states are kept unchanged.
+
+    Runs in linear time: the phoneme runs are computed once and the contexts are assigned
+    per run instead of rescanning the alignment for every frame.
+    """
+
+    if len(alignment_states) == 0:
+        return []
+
+    # every distinct state only needs to be parsed once
+    parsed = {s: AllophoneState.from_alignment_state(s) for s in set(alignment_states)}
+    decomposed_alignment = [parsed[s] for s in alignment_states]
+
+    phonemes = sorted({st.ph for st in parsed.values()})
+    phoneme_index = {ph: i for i, ph in enumerate(phonemes)}
+    ph_ids = np.array([phoneme_index[st.ph] for st in decomposed_alignment], dtype=np.int64)
+
+    run_starts = np.flatnonzero(np.concatenate(([True], ph_ids[1:] != ph_ids[:-1])))
+    run_lens = np.diff(np.append(run_starts, len(ph_ids)))
+    run_ph = ph_ids[run_starts]
+
+    # the last entry stands for the sequence border
+    border = len(phonemes)
+    contexts = np.array(["#" if ph == "[SILENCE]" else ph for ph in phonemes] + ["#"], dtype=object)
+
+    ctx_l = np.repeat(contexts[np.concatenate(([border], run_ph[:-1]))], run_lens)
+    ctx_r = np.repeat(contexts[np.concatenate((run_ph[1:], [border]))], run_lens)
+
+    return [
+        str(st) if st.ph == "[SILENCE]" else f"{st.ph}{{{l}+{r}}}{st.rest}"
+        for st, l, r in zip(decomposed_alignment, ctx_l, ctx_r)
+    ]
+
+
 class RasrForcedTriphoneAlignmentToHDF(RasrAlignmentToHDF):
     first = True
 
     def compute_targets(
         self, alignment_states: typing.List[str], state_tying: typing.Dict[str, int]
     ) -> typing.List[int]:
-        decomposed_alignment = [AllophoneState.from_alignment_state(s) for s in alignment_states]
-        forced_triphone_alignment = []
-
-        for i, a_st in enumerate(decomposed_alignment):
-            if a_st.ph == "[SILENCE]":
-                forced_triphone_alignment.append(str(a_st))
-                continue
-
-            next_left = (st.as_context() for st in decomposed_alignment[i::-1] if st.ph != a_st.ph)
-            next_right = (st.as_context() for st in decomposed_alignment[i:] if st.ph != a_st.ph)
-
-            in_ctx = dataclasses.replace(a_st, ctx_l=next(next_left, "#"), ctx_r=next(next_right, "#"))
-
-            forced_triphone_alignment.append(str(in_ctx))
+        forced_triphone_alignment = force_triphone_contexts(alignment_states)
 
         if self.first:
             self.first = False
             logging.info(f"Example alignment: {forced_triphone_alignment}")
 
         return super().compute_targets(forced_triphone_alignment, state_tying)
+
+
+def build_state_tying_lookup(allophones: typing.List[str], state_tying: typing.Dict[str, int]) -> np.ndarray:
+    """
+    Precomputes the `(allophone index, state) -> tied class` table for an allophone list.
+
+    Entries for allophone states that are not part of the state tying are set to -1.
+    """
+
+    num_states = 1 + max(int(k.rsplit(".", 1)[1]) for k in state_tying.keys())
+    lookup = np.full((len(allophones), num_states), -1, dtype=np.int32)
+
+    for i, allophone in enumerate(allophones):
+        for state in range(num_states):
+            lookup[i, state] = state_tying.get(f"{allophone}.{state:d}", -1)
+
+    return lookup
+
+
+class ShardedRasrAlignmentToHDF(Job):
+    """
+    Converts a RASR alignment bundle into a single RETURNN HDF file (to be read via `HDFDataset`).
+
+    The archives of the bundle are split across `num_tasks` subtasks. Each subtask maps
+    the `(allophone, state)` indices of the alignment through a precomputed integer lookup
+    table and writes its sequences concatenated into one flat, length-indexed dataset.
+    A final task merges the partial files into `out_hdf_file`.
+    """
+
+    def __init__(
+        self,
+        alignment_bundle: tk.Path,
+        allophones: tk.Path,
+        state_tying: tk.Path,
+        num_tied_classes: int,
+        num_tasks: int = 10,
+        tmp_dir: typing.Optional[str] = "/var/tmp",
+        remap_segment_names: typing.Optional[typing.Callable[[str], str]] = None,
+    ):
+        assert num_tasks > 0
+
+        self.alignment_bundle = alignment_bundle
+        self.allophones = allophones
+        self.num_tasks = num_tasks
+        self.num_tied_classes = num_tied_classes
+        self.remap_segment_names = remap_segment_names
+        self.state_tying = state_tying
+        self.tmp_dir = tmp_dir
+
+        self.out_hdf_file = self.output_path("alignment.hdf")
+        self.out_segments = self.output_path("segments")
+
+        self.rqmt = {"cpu": 1, "mem": 4, "time": 1}
+        self.merge_rqmt = {"cpu": 1, "mem": 4, "time": 1}
+
+    def tasks(self):
+        yield Task("run", resume="run", rqmt=self.rqmt, args=list(range(self.num_tasks)))
+        yield Task("merge", rqmt=self.merge_rqmt)
+
+    @staticmethod
+    def _partial_file(task_index: int) -> str:
+        # relative to the job's work directory
+        return f"alignment.{task_index}.hdf"
+
+    def _archive_paths(self) -> typing.List[str]:
+        with open(self.alignment_bundle.get_path(), "rt") as bundle:
+            return [line.strip() for line in bundle if line.strip()]
+
+    def run(self, task_index: int):
+        archives = list(chunks(self._archive_paths(), self.num_tasks))[task_index]
+        logging.info(f"processing {len(archives)} archives in task {task_index}")
+
+        with open(self.state_tying, "rt") as st:
+            state_tying = {k: int(v) for line in st for k, v in [line.strip().split()[0:2]]}
+
+        lookup = None
+        seq_names = []
+        seq_lens = []
+        targets = []
+
+        for archive_path in archives:
+            archive = FileArchive(cache_file(archive_path))
+            archive.setAllophones(self.allophones.get_path())
+
+            if lookup is None:
+                lookup = build_state_tying_lookup(archive.allophones, state_tying)
+
+            for file in archive.file_list():
+                if file.endswith(".attribs"):
+                    continue
+
+                alignment = archive.read(file, "align")
+                indices = np.array([t[1:3] for t in alignment], dtype=np.int64).reshape(-1, 2)
+                seq_targets = lookup[indices[:, 0], indices[:, 1]]
+
+                if np.any(seq_targets < 0):
+                    missing = indices[np.argmax(seq_targets < 0)]
+                    raise KeyError(f"{archive.allophones[missing[0]]}.{missing[1]:d}")
+
+                seq_names.append(file if self.remap_segment_names is None else self.remap_segment_names(file))
+                seq_lens.append(len(seq_targets))
+                targets.append(seq_targets)
+
+        string_dt = h5py.special_dtype(vlen=str)
+
+        with tempfile.TemporaryDirectory(dir=self.tmp_dir) as tmp_dir:
+            f = path.join(tmp_dir, "data.hdf")
+
+            with h5py.File(f, "w") as out:
+                out.create_dataset(
+                    "inputs",
+                    data=np.concatenate(targets) if len(targets) > 0 else np.zeros((0,), dtype=np.int32),
+                    dtype=np.int32,
+                )
+                out.create_dataset("seqLengths", data=np.array(seq_lens, dtype=np.int32))
+                out.create_dataset("seqTags", data=[s.encode() for s in seq_names], dtype=string_dt)
+
+            shutil.move(f, self._partial_file(task_index))
+
+    def merge(self):
+        string_dt = h5py.special_dtype(vlen=str)
+        partials = [h5py.File(self._partial_file(i), "r") for i in range(self.num_tasks)]
+
+        try:
+            seq_lens = np.concatenate([p["seqLengths"][...] for p in partials]).astype(np.int32)
+            seq_names = [s.decode() if isinstance(s, bytes) else s for p in partials for s in p["seqTags"][...]]
+            num_timesteps = int(seq_lens.sum())
+
+            with tempfile.TemporaryDirectory(dir=self.tmp_dir) as tmp_dir:
+                f = path.join(tmp_dir, "data.hdf")
+                logging.info(f"merging {len(partials)} partial files into {f}")
+
+                with h5py.File(f, "w") as out:
+                    out.attrs["inputPattSize"] = self.num_tied_classes
+                    out.attrs["numDims"] = 1
+                    out.attrs["numLabels"] = self.num_tied_classes
+                    out.attrs["numSeqs"] = len(seq_names)
+                    out.attrs["numTimesteps"] = num_timesteps
+
+                    out.create_dataset(
+                        "labels",
+                        data=[b"label_%d" % l for l in range(self.num_tied_classes)],
+                        dtype=string_dt,
+                    )
+                    out.create_dataset("seqTags", data=[s.encode() for s in seq_names], dtype=string_dt)
+                    out.create_dataset("seqLengths", data=np.stack([seq_lens, seq_lens], axis=1))
+
+                    inputs = out.create_dataset("inputs", shape=(num_timesteps,), dtype=np.int32)
+                    offset = 0
+                    for p in partials:
+                        data = p["inputs"][...]
+                        inputs[offset : offset + len(data)] = data
+                        offset += len(data)
+                    assert offset == num_timesteps
+
+                shutil.move(f, self.out_hdf_file.get_path())
+        finally:
+            for p in partials:
+                p.close()
+
+        with open(self.out_segments, "wt") as file:
+            file.writelines((f"{seq_name.strip()}\n" for seq_name in seq_names))
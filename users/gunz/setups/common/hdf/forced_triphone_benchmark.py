@@ -0,0 +1,74 @@
+"""
+Benchmarks `force_triphone_contexts` against the previous quadratic implementation
+on a long synthetic alignment and checks that both produce identical outputs.
+
+Run as:
+
+    python -m i6_experiments.users.gunz.setups.common.hdf.forced_triphone_benchmark
+"""
+
+import argparse
+import dataclasses
+import random
+import time
+import typing
+
+from ..analysis.allophone_state import AllophoneState
+from .alignment import force_triphone_contexts
+
+
+def force_triphone_contexts_quadratic(alignment_states: typing.List[str]) -> typing.List[str]:
+    decomposed_alignment = [AllophoneState.from_alignment_state(s) for s in alignment_states]
+    forced_triphone_alignment = []
+
+    for i, a_st in enumerate(decomposed_alignment):
+        if a_st.ph == "[SILENCE]":
+            forced_triphone_alignment.append(str(a_st))
+            continue
+
+        next_left = (st.as_context() for st in decomposed_alignment[i::-1] if st.ph != a_st.ph)
+        next_right = (st.as_context() for st in decomposed_alignment[i:] if st.ph != a_st.ph)
+
+        in_ctx = dataclasses.replace(a_st, ctx_l=next(next_left, "#"), ctx_r=next(next_right, "#"))
+
+        forced_triphone_alignment.append(str(in_ctx))
+
+    return forced_triphone_alignment
+
+
+def synthetic_alignment(num_frames: int, seed: int = 42) -> typing.List[str]:
+    rng = random.Random(seed)
+    phonemes = [f"p{i}" for i in range(40)] + ["[SILENCE]"]
+
+    states = []
+    while len(states) < num_frames:
+        ph = rng.choice(phonemes)
+        rest = "@i@f" if rng.random() < 0.1 else ""
+        for state in range(3):
+            states.extend([f"{ph}{{#+#}}{rest}.{state}"] * rng.randint(1, 6))
+
+    return states[:num_frames]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-frames", type=int, default=20_000)
+    parser.add_argument("--repetitions", type=int, default=3)
+    args = parser.parse_args()
+
+    alignment = synthetic_alignment(args.num_frames)
+
+    for name, f in [("quadratic", force_triphone_contexts_quadratic), ("run-length", force_triphone_contexts)]:
+        start = time.perf_counter()
+        for _ in range(args.repetitions):
+            result = f(alignment)
+        elapsed = (time.perf_counter() - start) / args.repetitions
+
+        print(f"{name:>12}: {elapsed * 1000:10.2f}ms per alignment of {args.num_frames} frames")
+
+    assert force_triphone_contexts_quadratic(alignment) == force_triphone_contexts(alignment)
+    print("outputs are identical")
+
+
+if __name__ == "__main__":
+    main()
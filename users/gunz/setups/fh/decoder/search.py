@@ -15,12 +15,13 @@ from i6_core.lm import CreateLmImageJob
 from sisyphus import tk
 from sisyphus.delayed_ops import Delayed, DelayedBase, DelayedJoin
 
+from ...common.decoder.nbest import AddAlignmentScoresToNBestJob, LatticeToNBestJob, NBestToCorpusJob, RescoreNBestJob
 from ...common.decoder.rtf import ExtractSearchStatisticsJob
 from ...common.lm_config import TfRnnLmRasrConfig
 from ...common.tdp import TDP, format_tdp
 from ..factored import LabelInfo, PhoneticContext
 from ..rust_scorer import RecompileTfGraphJob
-from ..util.argmin import ComputeArgminJob
+from ..util.argmin import ComputeArgminJob, SuccessiveHalvingArgminJob
 from .config import PosteriorScales, PriorInfo, SearchParameters
 from .scorer import FactoredHybridFeatureScorer
 
@@ -637,7 +638,14 @@ class FHDecoder:
         lm_config: rasr.RasrConfig = None,
         create_lattice: bool = True,
         remove_or_set_concurrency: typing.Union[bool, int] = False,
+        segment_file: typing.Optional[tk.Path] = None,
     ) -> RecognitionJobs:
+        """
+        :param opt_lm_am: tune the LM (and with only_lm_opt=False also the AM) scale on the lattices of this
+            recognition via OptimizeAMandLMScaleJob, no recognition per scale is needed. Needs altas=None and beam>=15.
+        :param rerun_after_opt_lm: recognize again with the tuned LM scale
+        :param segment_file: only recognize these segments, e.g. for tuning on a subset
+        """
         return self.recognize(
             label_info=label_info,
             num_encoder_output=num_encoder_output,
@@ -663,6 +671,7 @@ class FHDecoder:
             rtf_gpu=rtf_gpu,
             create_lattice=create_lattice,
             remove_or_set_concurrency=remove_or_set_concurrency,
+            segment_file=segment_file,
         )
 
     def recognize_optimize_scales(
@@ -689,7 +698,20 @@ class FHDecoder:
         crp_update: typing.Optional[typing.Callable[[rasr.RasrConfig], typing.Any]] = None,
         pre_path: str = "scales",
         cpu_slow: bool = True,
+        adaptive_segment_fractions: typing.Optional[typing.Sequence[float]] = None,
+        adaptive_reduction_factor: float = 3.0,
     ) -> SearchParameters:
+        """
+        Recognizes with all combinations of the given scales and returns the search parameters with the best ones.
+
+        :param adaptive_segment_fractions: if set, the scales are tuned by successive halving instead of recognizing
+            the full dev set with every combination: all combinations are recognized on a random subset of the
+            segments of the size of the first fraction, the best 1/adaptive_reduction_factor of them on a subset of
+            the size of the next fraction, and so on, and the remaining ones on the full dev set.
+            E.g. (0.1, 0.3) with a reduction factor of 3 needs 225 * 0.1 + 75 * 0.3 + 25 = 70 instead of 225
+            dev set recognitions for a 5x5x3x3 grid.
+        :param adaptive_reduction_factor: see adaptive_segment_fractions
+        """
         assert len(prior_scales) > 0
         assert len(tdp_scales) > 0
 
@@ -713,45 +735,62 @@ class FHDecoder:
         tdp_sil = tdp_sil if tdp_sil is not None else [recog_args.tdp_silence]
         tdp_speech = tdp_speech if tdp_speech is not None else [recog_args.tdp_speech]
 
-        jobs = {
-            ((c, l, r), tdp, tdp_sl, tdp_sp): self.recognize_count_lm(
-                add_sis_alias_and_output=False,
-                calculate_stats=False,
-                cpu_rqmt=cpu_rqmt,
-                crp_update=crp_update,
-                gpu=gpu,
-                is_min_duration=False,
-                keep_value=keep_value,
-                label_info=label_info,
-                mem_rqmt=mem_rqmt,
-                name_override=f"{self.name}-pC{c}-pL{l}-pR{r}-tdp{tdp}-tdpSil{tdp_sl}-tdpSp{tdp_sp}",
-                num_encoder_output=num_encoder_output,
-                opt_lm_am=False,
-                rerun_after_opt_lm=False,
-                search_parameters=dataclasses.replace(
-                    recog_args, tdp_scale=tdp, tdp_silence=tdp_sl, tdp_speech=tdp_sp
-                ).with_prior_scale(left=l, center=c, right=r),
-                remove_or_set_concurrency=False,
-            )
-            for ((c, l, r), tdp, tdp_sl, tdp_sp) in itertools.product(prior_scales, tdp_scales, tdp_sil, tdp_speech)
-        }
-        jobs_num_e = {k: v.sclite.out_num_errors for k, v in jobs.items()}
-
-        for ((c, l, r), tdp, tdp_sl, tdp_sp), recog_jobs in jobs.items():
-            if cpu_slow:
-                recog_jobs.search.update_rqmt("run", {"cpu_slow": True})
-
-            pre_name = f"{pre_path}/{self.name}/Lm{recog_args.lm_scale}-Pron{recog_args.pron_scale}-pC{c}-pL{l}-pR{r}-tdp{tdp}-tdpSil{format_tdp(tdp_sl)}-tdpSp{format_tdp(tdp_sp)}"
+        recognize_scales = _RecognizeWithScales(
+            decoder=self,
+            recog_args=recog_args,
+            segment_files={},
+            label_info=label_info,
+            num_encoder_output=num_encoder_output,
+            keep_value=keep_value,
+            gpu=gpu,
+            cpu_rqmt=cpu_rqmt,
+            mem_rqmt=mem_rqmt,
+            crp_update=crp_update,
+            pre_path=pre_path,
+            cpu_slow=cpu_slow,
+        )
+        candidates = list(itertools.product(prior_scales, tdp_scales, tdp_sil, tdp_speech))
 
-            recog_jobs.lat2ctm.set_keep_value(keep_value)
-            recog_jobs.search.set_keep_value(keep_value)
+        if adaptive_segment_fractions is None:
+            jobs = {k: recognize_scales.recognize(k) for k in candidates}
+            jobs_num_e = {k: v.sclite.out_num_errors for k, v in jobs.items()}
 
-            recog_jobs.search.add_alias(pre_name)
-            tk.register_output(f"{pre_name}.err", recog_jobs.sclite.out_num_errors)
-            tk.register_output(f"{pre_name}.wer", recog_jobs.sclite.out_wer)
+            best_overall_wer = ComputeArgminJob({k: v.sclite.out_wer for k, v in jobs.items()})
+            best_overall_n = ComputeArgminJob(jobs_num_e)
+            tk.register_output(
+                f"scales-best/{self.name}/wer",
+                best_overall_wer.out_min,
+            )
+        else:
+            fractions = sorted(round(f, 2) for f in adaptive_segment_fractions)
+            assert all(0.0 < f < 1.0 for f in fractions)
+
+            all_segments = i6_core.corpus.SegmentCorpusJob(self.search_crp.corpus_config.file, 1)
+            for f in fractions:
+                # same seed, thus the smaller subsets are contained in the larger ones
+                split = i6_core.corpus.ShuffleAndSplitSegmentsJob(
+                    all_segments.out_single_segment_files[1], split={"subset": f, "rest": 1.0 - f}
+                )
+                recognize_scales.segment_files[f] = split.out_segments["subset"]
+            rounds = [*fractions, 1.0]
+
+            best_overall_n = SuccessiveHalvingArgminJob(
+                initial_results={k: recognize_scales(k, rounds[0]) for k in candidates},
+                evaluate=recognize_scales,
+                rounds=rounds,
+                score="num_errors",
+                reduction_factor=adaptive_reduction_factor,
+            )
+            best_overall_n.add_alias(f"{pre_path}/{self.name}/successive-halving")
+            tk.register_output(
+                f"scales-best/{self.name}/wer",
+                best_overall_n.out_best["wer"],
+            )
+            tk.register_output(
+                f"scales-best/{self.name}/scores",
+                best_overall_n.out_scores,
+            )
 
-        best_overall_wer = ComputeArgminJob({k: v.sclite.out_wer for k, v in jobs.items()})
-        best_overall_n = ComputeArgminJob(jobs_num_e)
         tk.register_output(
             f"scales-best/{self.name}/args",
             best_overall_n.out_argmin,
@@ -760,10 +799,6 @@ class FHDecoder:
             f"scales-best/{self.name}/num_err",
             best_overall_n.out_min,
         )
-        tk.register_output(
-            f"scales-best/{self.name}/wer",
-            best_overall_wer.out_min,
-        )
 
         # cannot destructure, need to use indices
         best_priors = best_overall_n.out_argmin[0]
@@ -798,6 +833,178 @@ class FHDecoder:
             right=best_right_prior,
         )
 
+    def recognize_optimize_scales_nbest(
+        self,
+        *,
+        label_info: LabelInfo,
+        num_encoder_output: int,
+        search_parameters: SearchParameters,
+        center_prior_scales: typing.Union[typing.List[float], np.ndarray],
+        tdp_scales: typing.Union[typing.List[float], np.ndarray],
+        left_prior_scales: typing.Optional[typing.Union[typing.List[float], np.ndarray]] = None,
+        right_prior_scales: typing.Optional[typing.Union[typing.List[float], np.ndarray]] = None,
+        lm_scales: typing.Optional[typing.Union[typing.List[float], np.ndarray]] = None,
+        n: int = 10,
+        gpu: typing.Optional[bool] = None,
+        cpu_rqmt: typing.Optional[int] = None,
+        mem_rqmt: typing.Optional[int] = None,
+        crp_update: typing.Optional[typing.Callable[[rasr.RasrConfig], typing.Any]] = None,
+        pre_path: str = "scales-nbest",
+        confirm: bool = True,
+    ) -> SearchParameters:
+        """
+        Tunes the prior, TDP and LM scales on the N-best lists of one recognition instead of recognizing with every
+        combination of scales, see recognize_optimize_scales.
+
+        The hypotheses of the N-best lists are force aligned to get their AM costs without prior and TDPs, and the
+        costs of each prior and of the TDPs, see AddAlignmentScoresToNBestJob. This needs n * (2 + number of priors)
+        alignments of the dev set. All combinations of the scales are then rescored in one job.
+        Use a wide beam in the search parameters, the N-best lists cannot contain hypotheses which were pruned.
+
+        Only the scales are tuned, the TDP values are the ones of the search parameters.
+
+        :param left_prior_scales: defaults to the scale of the search parameters, only with a left context prior
+        :param right_prior_scales: defaults to the scale of the search parameters, only with a right context prior
+        :param lm_scales: defaults to the LM scale of the search parameters
+        :param n: number of hypotheses per segment
+        :param confirm: recognize again with the best scales, to confirm the WER with the full search
+        """
+        assert len(center_prior_scales) > 0
+        assert len(tdp_scales) > 0
+        assert search_parameters.tdp_scale is not None, "the TDPs need to be used to tune their scale"
+
+        def round_scales(scales, default):
+            return [round(s, 2) for s in scales] if scales is not None else [default]
+
+        prior_info = search_parameters.prior_info
+        prior_scales = {"center": round_scales(center_prior_scales, None)}
+        if prior_info.left_context_prior is not None:
+            prior_scales["left"] = round_scales(left_prior_scales, prior_info.left_context_prior.scale)
+        if prior_info.right_context_prior is not None:
+            prior_scales["right"] = round_scales(right_prior_scales, prior_info.right_context_prior.scale)
+
+        # the search parameters of each score component, i.e. only this one on top of the AM without prior and TDPs
+        no_prior = {k: 0.0 for k in prior_scales}
+        components = {"am": search_parameters.with_prior_scale(**no_prior).with_tdp_scale(0.0)}
+        for k in prior_scales:
+            components[f"prior_{k}"] = search_parameters.with_prior_scale(**{**no_prior, k: 1.0}).with_tdp_scale(0.0)
+        components["tdp"] = search_parameters.with_prior_scale(**no_prior).with_tdp_scale(1.0)
+
+        name = f"{self.name}-nbest{n}"
+        pre_name = f"{pre_path}/{self.name}/Beam{search_parameters.beam}-Lm{search_parameters.lm_scale}-nbest{n}"
+
+        recog_jobs = self.recognize_count_lm(
+            add_sis_alias_and_output=False,
+            calculate_stats=False,
+            cpu_rqmt=cpu_rqmt,
+            crp_update=crp_update,
+            gpu=gpu,
+            label_info=label_info,
+            mem_rqmt=mem_rqmt,
+            name_override=name,
+            num_encoder_output=num_encoder_output,
+            opt_lm_am=False,
+            rerun_after_opt_lm=False,
+            search_parameters=search_parameters,
+        )
+        recog_jobs.search.add_alias(pre_name)
+
+        nbest = LatticeToNBestJob(
+            crp=recog_jobs.search_crp,
+            lattice_cache=recog_jobs.search.out_lattice_bundle,
+            n=n,
+        )
+        nbest.add_alias(f"{pre_name}/nbest")
+        corpora = NBestToCorpusJob(nbest=nbest.out_nbest, bliss_corpus=recog_jobs.search_crp.corpus_config.file, n=n)
+
+        alignment_logs = {}
+        for component, params in components.items():
+            loop_scale, forward_scale = params.transition_scales or (1.0, 1.0)
+            sil_loop_penalty, sil_fwd_penalty = params.silence_penalties or (0.0, 0.0)
+            feature_scorer = get_feature_scorer(
+                context_type=self.context_type,
+                label_info=label_info,
+                feature_scorer_config=self.featureScorerConfig,
+                mixtures=self.mixtures,
+                silence_id=self.silence_id,
+                prior_info=params.prior_info,
+                posterior_scales=params.posterior_scales,
+                num_label_contexts=label_info.n_contexts,
+                num_states_per_phone=label_info.n_states_per_phone,
+                num_encoder_output=num_encoder_output,
+                loop_scale=loop_scale,
+                forward_scale=forward_scale,
+                silence_loop_penalty=sil_loop_penalty,
+                silence_forward_penalty=sil_fwd_penalty,
+                state_dependent_tdp_file=params.state_dependent_tdps,
+                is_multi_encoder_output=self.is_multi_encoder_output,
+                set_is_batch_major=self.set_batch_major,
+            )
+
+            alignment_logs[component] = []
+            for rank, rank_corpus in corpora.out_corpora.items():
+                # same segments as the search, only the orthographies differ
+                align_crp = copy.deepcopy(recog_jobs.search_crp)
+                self._set_acoustic_model_config(align_crp, label_info=label_info, search_parameters=params)
+                align_crp.corpus_config.file = rank_corpus
+
+                alignment = self.align(
+                    f"{name}/{component}/rank{rank}",
+                    crp=align_crp,
+                    feature_scorer=feature_scorer,
+                    default_tdp=False,
+                    add_sis_alias_and_output=False,
+                )
+                alignment.add_alias(f"{pre_name}/align/{component}/rank{rank}")
+                alignment_logs[component].append(alignment.out_log_file)
+
+        scores = AddAlignmentScoresToNBestJob(nbest=nbest.out_nbest, alignment_logs=alignment_logs, base="am")
+        rescore = RescoreNBestJob(
+            nbest=scores.out_nbest,
+            bliss_corpus=recog_jobs.search_crp.corpus_config.file,
+            scales={
+                "am": [1.0],
+                **{f"prior_{k}": v for k, v in prior_scales.items()},
+                "tdp": round_scales(tdp_scales, None),
+                "lm": round_scales(lm_scales, search_parameters.lm_scale),
+            },
+        )
+        scores.add_alias(f"{pre_name}/scores")
+        rescore.add_alias(f"{pre_name}/rescore")
+        tk.register_output(f"{pre_name}.report", rescore.out_report)
+        tk.register_output(f"{pre_name}.num_dropped", scores.out_num_dropped)
+        for component, scale in rescore.out_best_scales.items():
+            tk.register_output(f"scales-nbest-best/{self.name}/{component}_scale", scale)
+        tk.register_output(f"scales-nbest-best/{self.name}/wer", rescore.out_wer)
+
+        best_scales = rescore.out_best_scales
+        best = (
+            search_parameters.with_tdp_scale(best_scales["tdp"])
+            .with_lm_scale(best_scales["lm"])
+            .with_prior_scale(
+                center=best_scales["prior_center"],
+                left=best_scales.get("prior_left"),
+                right=best_scales.get("prior_right"),
+            )
+        )
+        if confirm:
+            self.recognize_count_lm(
+                calculate_stats=False,
+                cpu_rqmt=cpu_rqmt,
+                crp_update=crp_update,
+                gpu=gpu,
+                label_info=label_info,
+                mem_rqmt=mem_rqmt,
+                name_override=f"{name}-best",
+                num_encoder_output=num_encoder_output,
+                opt_lm_am=False,
+                pre_path=pre_path,
+                rerun_after_opt_lm=False,
+                search_parameters=best,
+            )
+
+        return best
+
     def recognize_ls_lstm_lm(
         self,
         *,
@@ -900,6 +1107,44 @@ class FHDecoder:
             **kwargs,
         )
 
+    @staticmethod
+    def _set_acoustic_model_config(
+        crp: rasr.CommonRasrParameters, *, label_info: LabelInfo, search_parameters: SearchParameters
+    ):
+        state_tying = crp.acoustic_model_config.state_tying.type
+
+        tdp_transition = (
+            search_parameters.tdp_speech if search_parameters.tdp_scale is not None else (0.0, 0.0, "infinity", 0.0)
+        )
+        tdp_silence = (
+            search_parameters.tdp_silence if search_parameters.tdp_scale is not None else (0.0, 0.0, "infinity", 0.0)
+        )
+        tdp_non_word = (
+            search_parameters.tdp_non_word
+            if search_parameters.tdp_non_word is not None
+            else (0.0, 0.0, "infinity", 0.0)
+        )
+
+        crp.acoustic_model_config = am.acoustic_model_config(
+            state_tying=state_tying,
+            states_per_phone=label_info.n_states_per_phone,
+            state_repetitions=1,
+            across_word_model=True,
+            early_recombination=False,
+            tdp_scale=search_parameters.tdp_scale,
+            tdp_transition=tdp_transition,
+            tdp_silence=tdp_silence,
+            tdp_nonword=tdp_non_word,
+            nonword_phones=search_parameters.non_word_phonemes,
+            tying_type="global-and-nonword",
+        )
+
+        crp.acoustic_model_config.allophones.add_all = search_parameters.add_all_allophones
+        crp.acoustic_model_config.allophones.add_from_lexicon = not search_parameters.add_all_allophones
+
+        crp.acoustic_model_config.state_tying.use_boundary_classes = label_info.phoneme_state_classes.use_boundary()
+        crp.acoustic_model_config.state_tying.use_word_end_classes = label_info.phoneme_state_classes.use_word_end()
+
     def recognize(
         self,
         *,
@@ -929,6 +1174,7 @@ class FHDecoder:
         create_lattice: bool = True,
         remove_or_set_concurrency: typing.Union[bool, int] = False,
         lookahead_with_4gram: bool = False,
+        segment_file: typing.Optional[tk.Path] = None,
     ) -> RecognitionJobs:
         if (
             isinstance(search_parameters, SearchParameters)
@@ -1014,43 +1260,7 @@ class FHDecoder:
             if not create_lattice:
                 name += "-noLattice"
 
-        state_tying = search_crp.acoustic_model_config.state_tying.type
-
-        tdp_transition = (
-            search_parameters.tdp_speech if search_parameters.tdp_scale is not None else (0.0, 0.0, "infinity", 0.0)
-        )
-        tdp_silence = (
-            search_parameters.tdp_silence if search_parameters.tdp_scale is not None else (0.0, 0.0, "infinity", 0.0)
-        )
-        tdp_non_word = (
-            search_parameters.tdp_non_word
-            if search_parameters.tdp_non_word is not None
-            else (0.0, 0.0, "infinity", 0.0)
-        )
-
-        search_crp.acoustic_model_config = am.acoustic_model_config(
-            state_tying=state_tying,
-            states_per_phone=label_info.n_states_per_phone,
-            state_repetitions=1,
-            across_word_model=True,
-            early_recombination=False,
-            tdp_scale=search_parameters.tdp_scale,
-            tdp_transition=tdp_transition,
-            tdp_silence=tdp_silence,
-            tdp_nonword=tdp_non_word,
-            nonword_phones=search_parameters.non_word_phonemes,
-            tying_type="global-and-nonword",
-        )
-
-        search_crp.acoustic_model_config.allophones.add_all = search_parameters.add_all_allophones
-        search_crp.acoustic_model_config.allophones.add_from_lexicon = not search_parameters.add_all_allophones
-
-        search_crp.acoustic_model_config.state_tying.use_boundary_classes = (
-            label_info.phoneme_state_classes.use_boundary()
-        )
-        search_crp.acoustic_model_config.state_tying.use_word_end_classes = (
-            label_info.phoneme_state_classes.use_word_end()
-        )
+        self._set_acoustic_model_config(search_crp, label_info=label_info, search_parameters=search_parameters)
 
         orig_lm_config = search_crp.language_model_config
 
@@ -1149,6 +1359,15 @@ class FHDecoder:
                 search_crp.corpus_config.file, concurrent
             ).out_segment_path
 
+        if segment_file is not None:
+            # only recognize a subset of the corpus, e.g. for tuning
+            flow = copy.deepcopy(flow)
+            flow.flags["cache_mode"] = "bundle"
+
+            search_crp.segment_path = i6_core.corpus.SplitSegmentFileJob(
+                segment_file, search_crp.concurrent
+            ).out_segment_path
+
         search = recog.AdvancedTreeSearchJob(
             crp=search_crp,
             feature_flow=flow,
@@ -1279,6 +1498,7 @@ class FHDecoder:
         set_do_not_normalize_lemma_sequence_scores: bool = True,
         set_no_tying_dense: bool = True,
         rtf=4,
+        add_sis_alias_and_output=True,
     ):
         align_crp = copy.deepcopy(crp) if crp is not None else self.search_crp
 
@@ -1311,7 +1531,100 @@ class FHDecoder:
         )
         alignment.update_rqmt("run", {"mem": 4})
 
-        alignment.add_alias(f"alignments/{name}")
-        tk.register_output(f"alignments/{name}", alignment.out_alignment_bundle)
+        if add_sis_alias_and_output:
+            alignment.add_alias(f"alignments/{name}")
+            tk.register_output(f"alignments/{name}", alignment.out_alignment_bundle)
 
         return alignment
+
+
+class _RecognizeWithScales:
+    """
+    Recognition with one combination of scales of FHDecoder.recognize_optimize_scales,
+    on the full dev set or on a segment subset.
+
+    Used as evaluate function of the SuccessiveHalvingArgminJob, thus also called in the graph proc.
+    The job does not pickle it, the decoder and crp_update can thus hold state which cannot be pickled.
+    """
+
+    def __init__(
+        self,
+        *,
+        decoder: FHDecoder,
+        recog_args: SearchParameters,
+        segment_files: typing.Dict[float, tk.Path],
+        label_info: LabelInfo,
+        num_encoder_output: int,
+        keep_value: int,
+        gpu: typing.Optional[bool],
+        cpu_rqmt: typing.Optional[int],
+        mem_rqmt: typing.Optional[int],
+        crp_update: typing.Optional[typing.Callable[[rasr.RasrConfig], typing.Any]],
+        pre_path: str,
+        cpu_slow: bool,
+    ):
+        """
+        :param segment_files: segment fraction -> segment subset, the full dev set is used for 1.0
+        """
+        self.decoder = decoder
+        self.recog_args = recog_args
+        self.segment_files = segment_files
+        self.label_info = label_info
+        self.num_encoder_output = num_encoder_output
+        self.keep_value = keep_value
+        self.gpu = gpu
+        self.cpu_rqmt = cpu_rqmt
+        self.mem_rqmt = mem_rqmt
+        self.crp_update = crp_update
+        self.pre_path = pre_path
+        self.cpu_slow = cpu_slow
+
+    def __call__(self, scales: tuple, segment_fraction: float = 1.0) -> typing.Dict[str, tk.Variable]:
+        """
+        :return: number of errors and WER, the WER is only meaningful on the full dev set
+        """
+        sclite = self.recognize(scales, segment_fraction).sclite
+        return {"num_errors": sclite.out_num_errors, "wer": sclite.out_wer}
+
+    def recognize(self, scales: tuple, segment_fraction: float = 1.0) -> RecognitionJobs:
+        (c, l, r), tdp, tdp_sl, tdp_sp = scales
+
+        # on a subset, the number of errors contains the deletions of all other segments of the reference,
+        # these are the same for all scales, thus they can still be compared
+        suffix = f"-seg{segment_fraction}" if segment_fraction < 1.0 else ""
+
+        name = self.decoder.name
+        recog_jobs = self.decoder.recognize_count_lm(
+            add_sis_alias_and_output=False,
+            calculate_stats=False,
+            cpu_rqmt=self.cpu_rqmt,
+            crp_update=self.crp_update,
+            gpu=self.gpu,
+            is_min_duration=False,
+            keep_value=self.keep_value,
+            label_info=self.label_info,
+            mem_rqmt=self.mem_rqmt,
+            name_override=f"{name}-pC{c}-pL{l}-pR{r}-tdp{tdp}-tdpSil{tdp_sl}-tdpSp{tdp_sp}{suffix}",
+            num_encoder_output=self.num_encoder_output,
+            opt_lm_am=False,
+            rerun_after_opt_lm=False,
+            search_parameters=dataclasses.replace(
+                self.recog_args, tdp_scale=tdp, tdp_silence=tdp_sl, tdp_speech=tdp_sp
+            ).with_prior_scale(left=l, center=c, right=r),
+            remove_or_set_concurrency=False,
+            segment_file=self.segment_files[segment_fraction] if segment_fraction < 1.0 else None,
+        )
+
+        if self.cpu_slow:
+            recog_jobs.search.update_rqmt("run", {"cpu_slow": True})
+
+        pre_name = f"{self.pre_path}/{name}/Lm{self.recog_args.lm_scale}-Pron{self.recog_args.pron_scale}-pC{c}-pL{l}-pR{r}-tdp{tdp}-tdpSil{format_tdp(tdp_sl)}-tdpSp{format_tdp(tdp_sp)}{suffix}"
+
+        recog_jobs.lat2ctm.set_keep_value(self.keep_value)
+        recog_jobs.search.set_keep_value(self.keep_value)
+
+        recog_jobs.search.add_alias(pre_name)
+        tk.register_output(f"{pre_name}.err", recog_jobs.sclite.out_num_errors)
+        tk.register_output(f"{pre_name}.wer", recog_jobs.sclite.out_wer)
+
+        return recog_jobs
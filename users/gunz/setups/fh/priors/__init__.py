@@ -4,6 +4,7 @@ from .augment import (
     get_returnn_configs_for_right_context_prior_estimation,
 )
 from .combine import combine_priors_across_hmm_states
+from .export import ExportPriorsToXmlJob
 from .flat import CreateFlatPriorsJob
 from .smoothen import smoothen_priors, SmoothenPriorsJob
 from .scale import scale_priors, ScalePriorsJob
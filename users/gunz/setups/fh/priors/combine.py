@@ -8,7 +8,7 @@ from sisyphus import Job, Path, Task
 
 from ..decoder.config import PriorInfo
 from ..factored import LabelInfo
-from .util import read_prior_xml, write_prior_xml
+from .util import read_priors, write_prior_xml, write_priors_npy
 
 
 def combine_priors_across_hmm_states(
@@ -34,7 +34,9 @@ def combine_priors_across_hmm_states(
 
 
 class CombinePriorsAcrossHmmStatesJob(Job):
-    def __init__(self, prior_xml: Path, label_info_in: LabelInfo, label_info_out: LabelInfo):
+    __sis_hash_exclude__ = {"write_xml": True}
+
+    def __init__(self, prior_xml: Path, label_info_in: LabelInfo, label_info_out: LabelInfo, write_xml: bool = True):
         assert label_info_in.n_contexts == label_info_out.n_contexts
         assert label_info_in.phoneme_state_classes == label_info_out.phoneme_state_classes
         assert label_info_out.n_states_per_phone == 1
@@ -42,14 +44,16 @@ class CombinePriorsAcrossHmmStatesJob(Job):
         self.label_info_in = label_info_in
         self.label_info_out = label_info_out
         self.prior_xml = prior_xml
+        self.write_xml = write_xml
 
-        self.out_priors = self.output_path("priors.xml")
+        self.out_priors = self.output_path("priors.xml") if write_xml else None
+        self.out_priors_npy = self.output_path("priors.npy")
 
     def tasks(self) -> Iterator[Task]:
         yield Task("run", mini_task=True)
 
     def run(self):
-        parsed = read_prior_xml(self.prior_xml)
+        parsed = read_priors(self.prior_xml)
 
         priors = np.exp(parsed.priors_log)
         shaped = np.reshape(
@@ -70,4 +74,8 @@ class CombinePriorsAcrossHmmStatesJob(Job):
         else:
             target_shape = (-1, parsed.shape[1])
 
-        write_prior_xml(np.reshape(log_priors, target_shape), self.out_priors)
+        log_priors = np.reshape(log_priors, target_shape)
+
+        write_priors_npy(log_priors, self.out_priors_npy)
+        if self.write_xml:
+            write_prior_xml(log_priors, self.out_priors)
@@ -0,0 +1,28 @@
+__all__ = ["ExportPriorsToXmlJob"]
+
+import typing
+
+from sisyphus import Job, Path, Task
+
+from .util import read_priors, write_prior_xml
+
+
+class ExportPriorsToXmlJob(Job):
+    """
+    Converts priors stored in `.npy` format into the XML format RASR understands.
+
+    Allows running a pipeline of prior jobs with `write_xml=False` and only exporting
+    the final result for decoding.
+    """
+
+    def __init__(self, priors: Path):
+        self.priors = priors
+
+        self.out_priors = self.output_path("priors.xml")
+
+    def tasks(self) -> typing.Iterator[Task]:
+        yield Task("run", mini_task=True)
+
+    def run(self):
+        parsed = read_priors(self.priors)
+        write_prior_xml(parsed.priors_log.reshape(parsed.shape), self.out_priors)
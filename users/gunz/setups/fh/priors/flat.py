@@ -1,23 +1,34 @@
 __all__ = ["CreateFlatPriorsJob"]
 
 import math
+import numpy as np
 import typing
 
 from sisyphus import Job, Task
 
+from .util import write_priors_npy
+
 
 class CreateFlatPriorsJob(Job):
     """
     Creates normalized priors with the same probability for every state.
 
     Most useful if a given prior scale is 0.
+
+    The RASR XML output can be disabled via `write_xml` if only `out_priors_npy` is used further
+    down the pipeline.
     """
 
-    def __init__(self, shape: typing.Union[int, typing.Tuple[int], typing.Tuple[int, int]]):
+    __sis_hash_exclude__ = {"write_xml": True}
+
+    def __init__(self, shape: typing.Union[int, typing.Tuple[int], typing.Tuple[int, int]], write_xml: bool = True):
         assert isinstance(shape, int) or len(shape) in [1, 2]
 
         self.shape = shape
-        self.out_priors = self.output_path("priors.xml")
+        self.write_xml = write_xml
+
+        self.out_priors = self.output_path("priors.xml") if write_xml else None
+        self.out_priors_npy = self.output_path("priors.npy")
 
     def tasks(self) -> typing.Iterator[Task]:
         yield Task("run", mini_task=True)
@@ -37,6 +48,11 @@ class CreateFlatPriorsJob(Job):
 
         p_value = math.log(1.0 / float(num_priors))
 
+        write_priors_npy(np.full(priors_to_gen, p_value, dtype=np.float64), self.out_priors_npy)
+
+        if not self.write_xml:
+            return
+
         with open(self.out_priors, "w") as xml:
             xml.write('<?xml version="1.0" encoding="UTF-8"?>\n')
 
@@ -7,7 +7,7 @@ import typing
 from sisyphus import Job, Path, Task
 
 from ..decoder.config import PriorConfig, PriorInfo
-from .util import read_prior_xml, write_prior_xml
+from .util import read_priors, write_prior_xml, write_priors_npy
 
 Indices = typing.Union[typing.List[int], typing.List[typing.Tuple[int, int]], typing.List[typing.Tuple[int, int, int]]]
 
@@ -38,23 +38,34 @@ class ScalePriorsJob(Job):
     Scales computed priors by a constant value.
 
     Computes `np.array(priors) * scale`.
+
+    Reads priors in XML or `.npy` format. The RASR XML output can be disabled via `write_xml`
+    if only `out_priors_npy` is used further down the pipeline.
     """
 
-    def __init__(self, prior_xml: Path, scale: float):
+    __sis_hash_exclude__ = {"write_xml": True}
+
+    def __init__(self, prior_xml: Path, scale: float, write_xml: bool = True):
         self.prior_xml = prior_xml
         self.scale = scale
+        self.write_xml = write_xml
 
-        self.out_priors = self.output_path("priors.xml")
+        self.out_priors = self.output_path("priors.xml") if write_xml else None
+        self.out_priors_npy = self.output_path("priors.npy")
 
     def tasks(self) -> typing.Iterator[Task]:
         yield Task("run", mini_task=True)
 
     def run(self):
-        parse_result = read_prior_xml(self.prior_xml)
+        parse_result = read_priors(self.prior_xml)
 
         priors = np.exp(parse_result.priors_log).reshape(parse_result.shape) * self.scale
 
         total_weight = priors.flatten().sum()
         print(f"total prior weight: {total_weight}")
 
-        write_prior_xml(np.log(priors), self.out_priors)
+        log_priors = np.log(priors)
+
+        write_priors_npy(log_priors, self.out_priors_npy)
+        if self.write_xml:
+            write_prior_xml(log_priors, self.out_priors)
@@ -1,10 +1,12 @@
 __all__ = ["JoinRightContextPriorsJob", "ReshapeCenterStatePriorsJob"]
 
+import numpy as np
 import typing
 
 from sisyphus import Job, Path, Task
 
 from ..factored import LabelInfo
+from .util import write_priors_npy
 
 
 def chunks(lst: typing.List, n: int):
@@ -15,12 +17,16 @@ def chunks(lst: typing.List, n: int):
 
 
 class JoinRightContextPriorsJob(Job):
-    def __init__(self, log_prior_txts: typing.List[Path], label_info: LabelInfo):
+    __sis_hash_exclude__ = {"write_xml": True}
+
+    def __init__(self, log_prior_txts: typing.List[Path], label_info: LabelInfo, write_xml: bool = True):
         self.prior_file_paths = log_prior_txts
         self.label_info = label_info
+        self.write_xml = write_xml
 
         self.out_prior_txt = self.output_path("priors.txt")
-        self.out_prior_xml = self.output_path("priors.xml")
+        self.out_prior_xml = self.output_path("priors.xml") if write_xml else None
+        self.out_priors_npy = self.output_path("priors.npy")
 
     def tasks(self) -> typing.Iterator[Task]:
         yield Task("run", mini_task=True)
@@ -35,12 +41,17 @@ class JoinRightContextPriorsJob(Job):
         with open(self.out_prior_txt, "w") as txt:
             txt.writelines(priors)
 
+        n_rows = self.label_info.n_contexts * self.label_info.get_n_state_classes()
+        values = np.array(" ".join(priors).split(), dtype=np.float64)
+        write_priors_npy(values.reshape((n_rows, self.label_info.n_contexts)), self.out_priors_npy)
+
+        if not self.write_xml:
+            return
+
         priors = [p.strip() for p in priors]
         per_c_l_context = chunks(lst=priors, n=self.label_info.n_contexts)
 
         with open(self.out_prior_xml, "w") as xml:
-            n_rows = self.label_info.n_contexts * self.label_info.get_n_state_classes()
-
             xml.write('<?xml version="1.0" encoding="UTF-8"?>\n')
             xml.write(f'<matrix-f32 nRows="{n_rows}" nColumns="{self.label_info.n_contexts}">\n')
             for prior_chunk in per_c_l_context:
@@ -56,12 +67,16 @@ class ReshapeCenterStatePriorsJob(Job):
     Due to historic reasons it cannot deal with a flat priors list, but must load from a 2D-matrix instead.
     """
 
-    def __init__(self, log_prior_txt: Path, label_info: LabelInfo):
+    __sis_hash_exclude__ = {"write_xml": True}
+
+    def __init__(self, log_prior_txt: Path, label_info: LabelInfo, write_xml: bool = True):
         self.prior_file_path = log_prior_txt
         self.label_info = label_info
+        self.write_xml = write_xml
 
         self.out_prior_txt = self.output_path("priors.txt")
-        self.out_prior_xml = self.output_path("priors.xml")
+        self.out_prior_xml = self.output_path("priors.xml") if write_xml else None
+        self.out_priors_npy = self.output_path("priors.npy")
 
     def tasks(self) -> typing.Iterator[Task]:
         yield Task("run", mini_task=True)
@@ -70,11 +85,16 @@ class ReshapeCenterStatePriorsJob(Job):
         with open(self.prior_file_path, "r") as file:
             priors = [p.strip() for p in file.readlines()]
 
+        n_rows = self.label_info.n_contexts
+        values = np.array(" ".join(priors).split(), dtype=np.float64)
+        write_priors_npy(values.reshape((n_rows, self.label_info.get_n_state_classes())), self.out_priors_npy)
+
+        if not self.write_xml:
+            return
+
         per_l_context = chunks(lst=priors, n=self.label_info.get_n_state_classes())
 
         with open(self.out_prior_xml, "w") as xml:
-            n_rows = self.label_info.n_contexts
-
             xml.write('<?xml version="1.0" encoding="UTF-8"?>\n')
             xml.write(f'<matrix-f32 nRows="{n_rows}" nColumns="{self.label_info.get_n_state_classes()}">\n')
             for prior_chunk in per_l_context:
@@ -1,4 +1,4 @@
-__all__ = ["read_prior_xml", "write_prior_xml"]
+__all__ = ["read_prior_xml", "read_priors", "write_prior_xml", "write_priors_npy"]
 
 from dataclasses import dataclass
 import numpy as np
@@ -10,12 +10,30 @@ from sisyphus import Path
 
 @dataclass(frozen=True, eq=True)
 class ParsedPriors:
-    priors_log: typing.List[float]
+    priors_log: np.ndarray
     shape: typing.Union[typing.Tuple[int], typing.Tuple[int, int]]
 
 
+def read_priors(path: typing.Union[Path, str]) -> ParsedPriors:
+    """
+    Reads log priors from either the binary `.npy` format or from RASR XML.
+
+    `.npy` files are memory-mapped, so reading them is (almost) free regardless of their size.
+    """
+
+    file = path.get_path() if isinstance(path, Path) else path
+
+    if file.endswith(".npy"):
+        priors = np.load(file, mmap_mode="r")
+        assert priors.ndim in [1, 2], f"unsupported prior array dim: {priors.ndim}"
+
+        return ParsedPriors(priors_log=priors.reshape(-1), shape=tuple(priors.shape))
+
+    return read_prior_xml(file)
+
+
 def read_prior_xml(path: typing.Union[Path, str]) -> ParsedPriors:
-    tree = ET.parse(path.get_path())
+    tree = ET.parse(path.get_path() if isinstance(path, Path) else path)
 
     root = tree.getroot()
 
@@ -23,7 +41,7 @@ def read_prior_xml(path: typing.Union[Path, str]) -> ParsedPriors:
     n_cols = root.attrib.get("nColumns")
     vec_size = root.attrib.get("size")
 
-    priors = [float(num.strip()) for num in root.text.strip().split()]
+    priors = np.array(root.text.split(), dtype=np.float64)
 
     if vec_size is not None:
         shape = (int(vec_size),)
@@ -34,17 +52,26 @@ def read_prior_xml(path: typing.Union[Path, str]) -> ParsedPriors:
     return ParsedPriors(priors_log=priors, shape=shape)
 
 
+def write_priors_npy(log_priors: np.ndarray, path: typing.Union[Path, str]):
+    if log_priors.ndim not in [1, 2]:
+        raise AttributeError(f"unsupported prior array dim: {log_priors.ndim}")
+
+    with open(path, "wb") as file:
+        np.save(file, np.ascontiguousarray(log_priors, dtype=np.float64))
+
+
 def write_prior_xml(log_priors: np.ndarray, path: typing.Union[Path, str]):
     if log_priors.ndim == 1:
         attrs = {"size": str(len(log_priors))}
         element = "vector-f32"
-        table = " ".join(f"{v:.20e}" for v in log_priors)
+        table = " ".join(["%.20e"] * len(log_priors)) % tuple(log_priors)
     elif log_priors.ndim == 2:
         attrs = {"nRows": str(log_priors.shape[0]), "nColumns": str(log_priors.shape[1])}
         element = "matrix-f32"
-        table = "\n".join(" ".join(f"{v:.20e}" for v in row) for row in log_priors[:])
+        row_fmt = " ".join(["%.20e"] * log_priors.shape[1])
+        table = "\n".join(row_fmt % tuple(row) for row in log_priors[:])
     else:
-        raise f"unsupported prior array dim: {log_priors.ndim}"
+        raise AttributeError(f"unsupported prior array dim: {log_priors.ndim}")
 
     node = ET.Element(element, attrib=attrs)
     node.text = f"\n{table}\n"
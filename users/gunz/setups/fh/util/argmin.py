@@ -1,3 +1,4 @@
+import math
 import typing
 
 from sisyphus import tk, Job, Task
@@ -28,3 +29,115 @@ class ComputeArgminJob(Job, typing.Generic[K, V]):
 
         self.out_argmin.set(argmin)
         self.out_min.set(self.dict[argmin])
+
+
+class SuccessiveHalvingArgminJob(Job, typing.Generic[K]):
+    """
+    Finds the candidate with the minimal score by successive halving instead of scoring all candidates in full.
+
+    All candidates are scored in the first round (e.g. on a small segment subset), and only the best
+    ceil(n / reduction_factor) advance to the next round (e.g. a larger subset). The survivors of the second to last
+    round are scored in the last round (e.g. the full dev set), which determines the argmin. The scores of
+    different rounds are never compared with each other.
+
+    The results of the later rounds are created dynamically in update() via `evaluate`, called in the graph proc.
+    `evaluate` is not pickled with the job, it may thus hold state which cannot be pickled, e.g. a crp_update
+    function defined within another function.
+    """
+
+    def __init__(
+        self,
+        initial_results: typing.Dict[K, typing.Dict[str, tk.Variable]],
+        evaluate: typing.Callable[[K, typing.Any], typing.Dict[str, tk.Variable]],
+        rounds: typing.Sequence[typing.Any],
+        score: str,
+        reduction_factor: float = 3.0,
+    ):
+        """
+        :param initial_results: candidate -> results in the first round, i.e. evaluate(candidate, rounds[0])
+        :param evaluate: (candidate, round) -> results, e.g. {"num_errors": ..., "wer": ...}. Not part of the hash,
+            thus it must be determined by the initial results and the rounds.
+        :param rounds: round argument to `evaluate` per round, e.g. the segment subset, the last one is final
+        :param score: name of the result which is minimized, lower is better
+        :param reduction_factor: fraction of the candidates which are dropped after each round is 1 - 1/this
+        """
+        assert len(initial_results) > 0
+        assert len(rounds) > 0
+        assert reduction_factor > 1
+        result_names = set(next(iter(initial_results.values())))
+        assert score in result_names
+        assert all(set(results) == result_names for results in initial_results.values())
+
+        self.initial_results = initial_results
+        self.evaluate = evaluate
+        self.rounds = list(rounds)
+        self.score = score
+        self.reduction_factor = reduction_factor
+
+        self._results = {0: dict(initial_results)}  # round index -> candidate -> results
+
+        self.out_min = self.output_var("min", pickle=False)
+        self.out_argmin = self.output_var("argmin", pickle=False)
+        self.out_best = {name: self.output_var(f"best_{name}", pickle=False) for name in sorted(result_names)}
+        self.out_scores = self.output_var("scores", pickle=False)
+
+        self.rqmt = None
+
+    @classmethod
+    def hash(cls, kwargs):
+        d = dict(kwargs)
+        del d["evaluate"]
+        return super().hash(d)
+
+    def __getstate__(self):
+        # evaluate is only needed in the graph proc, the results of all rounds are part of the state
+        state = dict(super().__getstate__())
+        state["evaluate"] = None
+        return state
+
+    def update(self):
+        """
+        Called when all scores of the current round are available, adds the next round.
+        """
+        current_round = max(self._results)
+        if current_round == len(self.rounds) - 1:
+            return
+        scores = self._get_scores(current_round)
+        if not all(v.available() for v in scores.values()):
+            return
+        assert self.evaluate is not None, "evaluate is not available in an unpickled job"
+
+        survivors = self._sorted_candidates(scores)[: max(math.ceil(len(scores) / self.reduction_factor), 1)]
+        # rounds in between cannot change the result for a single candidate
+        next_round = current_round + 1 if len(survivors) > 1 else len(self.rounds) - 1
+
+        next_results = {}
+        for candidate in survivors:
+            results = self.evaluate(candidate, self.rounds[next_round])
+            assert set(results) == set(self.out_best), f"results {list(results)} != {list(self.out_best)}"
+            for v in results.values():
+                self.add_input(v)
+            next_results[candidate] = results
+        self._results[next_round] = next_results
+
+    def tasks(self) -> typing.Iterator[Task]:
+        yield Task("run", mini_task=True)
+
+    def run(self):
+        final_round = len(self.rounds) - 1
+        argmin = self._sorted_candidates(self._get_scores(final_round))[0]
+        best = self._results[final_round][argmin]
+
+        self.out_argmin.set(argmin)
+        self.out_min.set(best[self.score].get())
+        for name, var in self.out_best.items():
+            var.set(best[name].get())
+        self.out_scores.set([{k: v.get() for k, v in self._get_scores(r).items()} for r in sorted(self._results)])
+
+    def _get_scores(self, round_idx: int) -> typing.Dict[K, tk.Variable]:
+        return {k: results[self.score] for k, results in self._results[round_idx].items()}
+
+    @staticmethod
+    def _sorted_candidates(scores: typing.Dict[K, tk.Variable]) -> typing.List[K]:
+        # stable, ties are broken by the order of the candidates
+        return sorted(scores, key=lambda k: scores[k].get())
@@ -108,6 +108,8 @@ def get_pytorch_serializer_v3(
         make_local_package_copy=not debug,
         packages={
             package,
+            # the decoders use i6_experiments.common.helpers.rtf
+            "i6_experiments.common.helpers",
         },
     )
 
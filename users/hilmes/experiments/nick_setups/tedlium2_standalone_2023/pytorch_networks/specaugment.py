@@ -1,47 +1,49 @@
 import torch
 
 
-def _mask(tensor, batch_axis, axis, pos, max_amount):
-    batch_dim = tensor.shape[batch_axis]
-    dim = tensor.shape[axis]
-    amount = torch.randint(low=1, high=max_amount + 1, size=(batch_dim,), dtype=torch.int32).to(device=tensor.device)
-    pos2 = torch.min(pos + amount, torch.tensor([dim] * batch_dim).to(device=tensor.device))
-    idxs = torch.arange(0, dim).to(device=tensor.device).unsqueeze(0)  # [1,dim]
-    pos_bc = pos.unsqueeze(1)  # [B,1]
-    pos2_bc = pos2.unsqueeze(1)  # [B,1]
-    cond = torch.logical_and(torch.greater_equal(idxs, pos_bc), torch.less(idxs, pos2_bc))  # [B,dim]
-    if batch_axis > axis:
-        cond = cond.transpose(0, 1)  # [dim,B]
-    cond = torch.reshape(
-        cond, shape=[tensor.shape[i] if i in (batch_axis, axis) else 1 for i in range(len(tensor.shape))]
-    )
-    tensor = torch.where(cond, 0.0, tensor)
-    return tensor
+def _random_mask(tensor, batch_axis, axis, min_num, max_num, max_dims):
+    """
+    Masks (sets to 0) between min_num and max_num-1 random intervals of size 1..max_dims along axis,
+    independently for every sequence in the batch.
 
+    All intervals are combined into a single [B,dim] mask first, which is then applied once to the tensor.
 
-def _random_mask(tensor, batch_axis, axis, min_num, max_num, max_dims):
+    :param torch.Tensor tensor: e.g. [B,T,F]
+    :param int batch_axis:
+    :param int axis:
+    :param int min_num:
+    :param int max_num: exclusive
+    :param int max_dims: inclusive
+    :return: masked tensor
+    """
     batch_dim = tensor.shape[batch_axis]
+    dim = tensor.shape[axis]
+    device = tensor.device
     if min_num >= max_num:
-        num_masks = torch.ones((batch_dim,), dtype=torch.int64) * min_num
+        num_masks = torch.full((batch_dim,), min_num, dtype=torch.int64, device=device)
     else:
-        num_masks = torch.randint(min_num, max_num, size=(batch_dim,))  # [B]
-    max_num_masks = num_masks.max().item()
-    z = -torch.log(-torch.log(torch.rand((batch_dim, tensor.shape[axis])).to(device=tensor.device)))  # [B,dim]
-    _, indices = torch.topk(z, max_num_masks, dim=1)
-
-    # Make num_masks broadcastable to shape of tensor for torch.where.
-    for i in range(tensor.dim() - 1):
-        if i < batch_axis:
-            num_masks = num_masks.unsqueeze(0)
-        else:
-            num_masks = num_masks.unsqueeze(-1)
+        num_masks = torch.randint(min_num, max_num, size=(batch_dim,), device=device)  # [B]
+    max_num_masks = min(int(num_masks.max()), dim)
+    if max_num_masks <= 0:
+        return tensor
+    z = -torch.log(-torch.log(torch.rand((batch_dim, dim), device=device)))  # [B,dim]
+    _, pos = torch.topk(z, max_num_masks, dim=1)  # [B,M]
+    amount = torch.randint(low=1, high=max_dims + 1, size=(batch_dim, max_num_masks), device=device)  # [B,M]
+    pos2 = torch.clamp(pos + amount, max=dim)  # [B,M]
+    enabled = (torch.arange(max_num_masks, device=device)[None, :] < num_masks[:, None]).to(torch.int32)  # [B,M]
 
-    num_masks = num_masks.to(device=tensor.device)
+    # Interval starts +1, ends -1, cumsum > 0 is then inside of any interval
+    delta = torch.zeros((batch_dim, dim + 1), dtype=torch.int32, device=device)  # [B,dim+1]
+    delta.scatter_add_(1, pos, enabled)
+    delta.scatter_add_(1, pos2, -enabled)
+    cond = torch.cumsum(delta[:, :dim], dim=1) > 0  # [B,dim]
 
-    for i in range(max_num_masks):
-        tensor = torch.where(i < num_masks, _mask(tensor, batch_axis, axis, indices[:, i], max_dims), tensor)
-
-    return tensor
+    if batch_axis > axis:
+        cond = cond.transpose(0, 1)  # [dim,B]
+    cond = torch.reshape(
+        cond, shape=[tensor.shape[i] if i in (batch_axis, axis) else 1 for i in range(len(tensor.shape))]
+    )
+    return tensor.masked_fill(cond, 0.0)
 
 
 def returnn_specaugment(tensor: torch.Tensor, time_num_masks, time_mask_max_size, freq_num_masks, freq_mask_max_size):
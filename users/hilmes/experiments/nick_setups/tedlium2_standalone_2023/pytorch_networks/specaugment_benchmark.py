@@ -0,0 +1,102 @@
+"""
+CPU micro-benchmark: single-pass :func:`returnn_specaugment` vs the previous implementation,
+which applied one full-tensor `torch.where` per mask.
+
+Run as:
+
+    python -m i6_experiments.users.hilmes.experiments.nick_setups.tedlium2_standalone_2023.pytorch_networks.specaugment_benchmark
+"""
+
+import argparse
+import time
+
+import torch
+
+from .specaugment import returnn_specaugment
+
+
+def _mask_legacy(tensor, batch_axis, axis, pos, max_amount):
+    batch_dim = tensor.shape[batch_axis]
+    dim = tensor.shape[axis]
+    amount = torch.randint(low=1, high=max_amount + 1, size=(batch_dim,), dtype=torch.int32).to(device=tensor.device)
+    pos2 = torch.min(pos + amount, torch.tensor([dim] * batch_dim).to(device=tensor.device))
+    idxs = torch.arange(0, dim).to(device=tensor.device).unsqueeze(0)  # [1,dim]
+    pos_bc = pos.unsqueeze(1)  # [B,1]
+    pos2_bc = pos2.unsqueeze(1)  # [B,1]
+    cond = torch.logical_and(torch.greater_equal(idxs, pos_bc), torch.less(idxs, pos2_bc))  # [B,dim]
+    if batch_axis > axis:
+        cond = cond.transpose(0, 1)  # [dim,B]
+    cond = torch.reshape(
+        cond, shape=[tensor.shape[i] if i in (batch_axis, axis) else 1 for i in range(len(tensor.shape))]
+    )
+    tensor = torch.where(cond, 0.0, tensor)
+    return tensor
+
+
+def _random_mask_legacy(tensor, batch_axis, axis, min_num, max_num, max_dims):
+    batch_dim = tensor.shape[batch_axis]
+    if min_num >= max_num:
+        num_masks = torch.ones((batch_dim,), dtype=torch.int64) * min_num
+    else:
+        num_masks = torch.randint(min_num, max_num, size=(batch_dim,))  # [B]
+    max_num_masks = num_masks.max().item()
+    z = -torch.log(-torch.log(torch.rand((batch_dim, tensor.shape[axis])).to(device=tensor.device)))  # [B,dim]
+    _, indices = torch.topk(z, max_num_masks, dim=1)
+
+    # Make num_masks broadcastable to shape of tensor for torch.where.
+    for i in range(tensor.dim() - 1):
+        if i < batch_axis:
+            num_masks = num_masks.unsqueeze(0)
+        else:
+            num_masks = num_masks.unsqueeze(-1)
+
+    num_masks = num_masks.to(device=tensor.device)
+
+    for i in range(max_num_masks):
+        tensor = torch.where(i < num_masks, _mask_legacy(tensor, batch_axis, axis, indices[:, i], max_dims), tensor)
+
+    return tensor
+
+
+def returnn_specaugment_legacy(
+    tensor: torch.Tensor, time_num_masks, time_mask_max_size, freq_num_masks, freq_mask_max_size
+):
+    """
+    Previous implementation of :func:`returnn_specaugment`
+    """
+    assert len(tensor.shape) == 3
+    tensor = _random_mask_legacy(tensor, 0, 1, 2, time_num_masks, time_mask_max_size)  # time masking
+    tensor = _random_mask_legacy(tensor, 0, 2, 2, freq_num_masks, freq_mask_max_size)  # freq masking
+    return tensor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--num-frames", type=int, default=1500)
+    parser.add_argument("--num-features", type=int, default=80)
+    parser.add_argument("--repeat-per-n-frames", type=int, default=25)
+    parser.add_argument("--repetitions", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    features = torch.randn(args.batch_size, args.num_frames, args.num_features)
+    spec_args = dict(
+        time_num_masks=args.num_frames // args.repeat_per_n_frames,
+        time_mask_max_size=20,
+        freq_num_masks=5,
+        freq_mask_max_size=8,
+    )
+
+    for name, func in [("legacy", returnn_specaugment_legacy), ("single-pass", returnn_specaugment)]:
+        func(features, **spec_args)  # warmup
+        start = time.perf_counter()
+        for _ in range(args.repetitions):
+            func(features, **spec_args)
+        elapsed = (time.perf_counter() - start) / args.repetitions
+        print(f"{name:>12}: {elapsed * 1000:8.2f}ms per batch {list(features.shape)}")
+
+
+if __name__ == "__main__":
+    main()
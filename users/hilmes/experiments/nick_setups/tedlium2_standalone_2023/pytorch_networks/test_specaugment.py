@@ -0,0 +1,43 @@
+"""
+Statistical equivalence of the single-pass :func:`returnn_specaugment` and the previous implementation.
+Both use different random numbers, so we compare the distributions of the masks.
+"""
+
+import torch
+
+from .specaugment import returnn_specaugment
+from .specaugment_benchmark import returnn_specaugment_legacy
+
+
+def _mask_stats(func, *, num_batches: int = 200, seed: int = 42):
+    torch.manual_seed(seed)
+    masked_frames_hist = torch.zeros(101)  # number of masked frames per seq
+    masked_time = torch.zeros(100)  # per frame, how often it was masked
+    masked_freq = torch.zeros(40)  # per feature, how often it was masked
+    for _ in range(num_batches):
+        x = torch.ones(16, 100, 40)
+        y = func(x, time_num_masks=4, time_mask_max_size=10, freq_num_masks=3, freq_mask_max_size=5)
+        time_masked = (y == 0).all(dim=2)  # [B,T], only time masking masks whole frames
+        freq_masked = (y == 0).all(dim=1)  # [B,F]
+        masked_frames_hist += torch.bincount(time_masked.sum(dim=1), minlength=101).float()
+        masked_time += time_masked.float().sum(dim=0)
+        masked_freq += freq_masked.float().sum(dim=0)
+    num_seqs = num_batches * 16
+    return masked_frames_hist / num_seqs, masked_time / num_seqs, masked_freq / num_seqs
+
+
+def test_specaugment_statistical_equivalence():
+    hist_legacy, time_legacy, freq_legacy = _mask_stats(returnn_specaugment_legacy)
+    hist_new, time_new, freq_new = _mask_stats(returnn_specaugment)
+
+    # Distribution of the number of masked frames per seq: total variation distance, and mean.
+    # With 3200 seqs, the total variation distance of two samples of the same distribution is around 0.05.
+    assert 0.5 * (hist_legacy - hist_new).abs().sum() < 0.1
+    num_frames = torch.arange(101, dtype=torch.float32)
+    assert abs((hist_legacy * num_frames).sum() - (hist_new * num_frames).sum()) < 0.5
+    # Masking rate per frame/feature. The standard error here is around 0.01.
+    assert (time_legacy - time_new).abs().max() < 0.05
+    assert (freq_legacy - freq_new).abs().max() < 0.05
+    assert abs(time_legacy.mean() - time_new.mean()) < 0.01
+    assert abs(freq_legacy.mean() - freq_new.mean()) < 0.01
+
@@ -1,38 +1,234 @@
 from sisyphus import *
+import contextlib
+import multiprocessing
+import pickle
 import soundfile
 import librosa
 import numpy
+from typing import Any, Dict, List, Optional
 
 from i6_core.lib import corpus
 
 
+# default parameters for the feature extraction, shared by all jobs here
+_feature_opts = {
+  "step_len": 0.0125,
+  "window_len": 0.05,
+  "fmin_pyin": 60,
+  "fmin_ex": 60,
+  "fmax_ex": 7600,
+  "fmax_pyin": 1000,
+  "center": True,
+  "n_mels": 80,
+}
+
+
+def _get_segment_audio_files(bliss_file: str, segment_list: List[str]) -> Dict[str, str]:
+  """
+  :return: segment name -> audio file, for all segments in segment_list
+  """
+  segment_set = set(segment_list)
+  bliss = corpus.Corpus()
+  bliss.load(bliss_file)
+  recordings = {}
+  for recording in bliss.all_recordings():
+    for segment in recording.segments:
+      if segment.fullname() in segment_set:
+        recordings[segment.fullname()] = recording.audio
+  return recordings
+
+
+def _extract_features(audio_file: str, extract_f0: bool = True) -> Dict[str, Any]:
+  """
+  :return: mel filterbank, energy and (if extract_f0) F0 and voicing of the audio file
+  """
+  opts = _feature_opts
+  signal, sample_rate = soundfile.read(audio_file)
+  features = {"sample_rate": sample_rate}
+  features["mel"] = librosa.feature.melspectrogram(
+    y=signal, sr=sample_rate,
+    n_mels=opts["n_mels"],
+    hop_length=int(opts["step_len"] * sample_rate),
+    n_fft=int(opts["window_len"] * sample_rate),
+    fmin=opts["fmin_ex"], fmax=opts["fmax_ex"], center=opts["center"]
+  )
+  energy = librosa.feature.rms(
+    y=signal,
+    hop_length=int(opts["step_len"] * sample_rate), frame_length=int(opts["window_len"] * sample_rate))
+  features["energy"] = numpy.squeeze(energy, axis=0)
+  if extract_f0:
+    features["f0"], features["voiced"], _ = librosa.pyin(y=signal, sr=sample_rate,
+      hop_length=int(opts["step_len"] * sample_rate),
+      frame_length=int(opts["window_len"] * sample_rate), win_length=int(opts["window_len"] * sample_rate) // 2,
+      fmin=opts["fmin_pyin"], fmax=opts["fmax_pyin"], center=opts["center"], fill_na=0.0)
+  return features
+
+
+def _extract_features_star(args):
+  return _extract_features(*args)
+
+
+@contextlib.contextmanager
+def _get_imap(num_workers: int):
+  """
+  :return: imap of a process pool, or the builtin map for a single worker
+  """
+  if num_workers <= 1:
+    yield map
+  else:
+    with multiprocessing.Pool(num_workers) as pool:
+      yield pool.imap
+
+
+def _get_features(
+  features_file: Optional[tk.Path], bliss_file: tk.Path, segment_list: List[str], *, extract_f0: bool, imap
+) -> Dict[str, Dict[str, Any]]:
+  """
+  :return: segment name -> features, either loaded from the output of :class:`ExtractScoringFeaturesJob`,
+    or extracted here
+  """
+  if features_file is not None:
+    with open(features_file.get_path(), "rb") as f:
+      features = pickle.load(f)
+    missing = [segment for segment in segment_list if segment not in features]
+    assert not missing, "features missing for %i segments, e.g. %s" % (len(missing), missing[0])
+    if extract_f0:
+      assert all("f0" in features[segment] and "voiced" in features[segment] for segment in segment_list), (
+        "no F0 in %s, use ExtractScoringFeaturesJob(extract_f0=True)" % features_file)
+    return features
+  recordings = _get_segment_audio_files(bliss_file.get_path(), segment_list)
+  assert len(recordings) == len(segment_list)
+  args = [(recordings[segment], extract_f0) for segment in segment_list]
+  return dict(zip(segment_list, imap(_extract_features_star, args)))
+
+
+def _dtw(features_1, features_2, dtw: bool):
+  mel_filterbank_1 = features_1["mel"]
+  mel_filterbank_2 = features_2["mel"]
+  if dtw:
+    D, wp = librosa.sequence.dtw(mel_filterbank_1, mel_filterbank_2)
+  else:
+    assert len(mel_filterbank_1) == len(mel_filterbank_2), "If no DTW sequences need same length"
+    wp = list(zip(range(len(mel_filterbank_1)), range(len(mel_filterbank_2))))
+  return wp
+
+
+def _score_f0(args):
+  features_1, features_2, dtw, check_voiced = args
+  assert features_1["sample_rate"] == features_2["sample_rate"], "Sample rates must match"
+  wp = _dtw(features_1, features_2, dtw)
+  f0_1, voiced_1 = features_1["f0"], features_1["voiced"]
+  f0_2, voiced_2 = features_2["f0"], features_2["voiced"]
+
+  scale = 1200 / len(wp)
+  sum = 0
+  pitch_ls_1 = []
+  pitch_ls_2 = []
+  wrong_mappings = 0
+  for t_1, t_2 in wp:
+    if (voiced_1[t_1] and voiced_2[t_2]) or not check_voiced:
+      pitch_ls_1.append(f0_1[t_1])
+      pitch_ls_2.append(f0_2[t_2])
+      sum += abs(numpy.log2((f0_2[t_2] / f0_1[t_1])))
+    if (voiced_1[t_1] and not voiced_2[t_2]) or (not voiced_1[t_1] and voiced_2[t_2]):
+      wrong_mappings += 1
+
+  mae = scale * sum
+  return mae, pitch_ls_1, pitch_ls_2, wrong_mappings, wp, len(features_1["mel"]), len(features_2["mel"])
+
+
+def _score_energy(args):
+  features_1, features_2 = args
+  assert features_1["sample_rate"] == features_2["sample_rate"], "Sample rates must match"
+  wp = _dtw(features_1, features_2, True)
+  energy_1, energy_2 = features_1["energy"], features_2["energy"]
+
+  energy_ls_1 = []
+  energy_ls_2 = []
+  for t_1, t_2 in wp:
+    energy_ls_1.append(energy_1[t_1])
+    energy_ls_2.append(energy_2[t_2])
+  corr = numpy.corrcoef(energy_ls_1, energy_ls_2)
+  mae = numpy.mean(numpy.abs(numpy.array(energy_ls_1) - numpy.array(energy_ls_2)))
+  return mae, corr
+
+
+def _get_rqmt(num_workers: int, mem: float, time: float) -> Dict[str, Any]:
+  return {"cpu": num_workers, "mem": mem, "time": time}
+
+
+class ExtractScoringFeaturesJob(Job):
+  """
+  Extracts the features which are needed by :class:`CompareF0ValuesJob` and :class:`CompareEnergyValuesJob`
+  (mel filterbank, energy, F0 and voicing) for all segments of a corpus, in parallel.
+  As pyin is expensive, this allows to reuse them, e.g. for the reference corpus,
+  or for scoring with different check_voiced/dtw settings.
+  """
+
+  def __init__(self, bliss_corpus: tk.Path, segment_list: tk.Path, extract_f0: bool = True, num_workers: int = 4):
+    """
+    :param bliss_corpus:
+    :param segment_list:
+    :param extract_f0: F0 and voicing are only needed for CompareF0ValuesJob
+    :param num_workers: number of processes for the extraction
+    """
+    self.bliss_corpus = bliss_corpus
+    self.segment_list = segment_list
+    self.extract_f0 = extract_f0
+    self.num_workers = num_workers
+
+    self.rqmt = _get_rqmt(num_workers, mem=4, time=4)
+
+    self.out_features = self.output_path("features.pkl")
+
+  @classmethod
+  def hash(cls, parsed_args):
+    d = dict(parsed_args)
+    d.pop("num_workers")
+    return super().hash(d)
+
+  def tasks(self):
+    yield Task("run", rqmt=self.rqmt)
+
+  def run(self):
+    with open(self.segment_list.get_path(), "r") as f:
+      segment_list = f.read().splitlines()
+    with _get_imap(self.num_workers) as imap:
+      features = _get_features(None, self.bliss_corpus, segment_list, extract_f0=self.extract_f0, imap=imap)
+    with open(self.out_features.get_path(), "wb") as f:
+      pickle.dump(features, f)
+
+
 class CompareF0ValuesJob(Job):
   """
   Extracts F0 for two given Corpora and calculates MAE over both
   """
 
-  def __init__(self, ref_corpus: tk.Path, test_corpus: tk.Path, segment_list: tk.Path, dtw: bool = True, check_voiced = True):
+  __sis_hash_exclude__ = {"ref_features": None, "test_features": None}
+
+  def __init__(self, ref_corpus: tk.Path, test_corpus: tk.Path, segment_list: tk.Path, dtw: bool = True, check_voiced = True,
+    num_workers: int = 1, ref_features: Optional[tk.Path] = None, test_features: Optional[tk.Path] = None):
+    """
+    :param num_workers: number of processes for the feature extraction and scoring
+    :param ref_features: precomputed features of ref_corpus, see :class:`ExtractScoringFeaturesJob`
+    :param test_features: precomputed features of test_corpus, see :class:`ExtractScoringFeaturesJob`
+    """
 
     self.ref_corpus = ref_corpus
     self.test_corpus = test_corpus
     self.segment_list = segment_list
     self.dtw = dtw
     self.check_voiced = check_voiced
+    self.num_workers = num_workers
+    self.ref_features = ref_features
+    self.test_features = test_features
 
     self.rqmt = {
       "mem": 1,
       "time": 4,
     }
-
-    # default parameter for DTW
-    self.step_len = 0.0125
-    self.window_len = 0.05
-    self.fmin_pyin = 60
-    self.fmin_ex = 60
-    self.fmax_ex = 7600
-    self.fmax_pyin = 1000
-    self.center = True
-    self.n_mels = 80
+    if num_workers > 1:
+      self.rqmt = _get_rqmt(num_workers, mem=4, time=4)
 
     self.out_maes = self.output_path("maes")
     self.out_ref_means = self.output_path("ref_means")
@@ -44,9 +240,17 @@ class CompareF0ValuesJob(Job):
     self.out_avg_mae = self.output_var("avrg_mae")
     self.out_total_wrong_mappings = self.output_var("total_wrong_mappings")
 
-  def tasks(self):
+  @classmethod
+  def hash(cls, parsed_args):
+    d = dict(parsed_args)
+    d.pop("num_workers")
+    return super().hash(d)
 
-    yield Task("run", mini_task=True)
+  def tasks(self):
+    if self.num_workers > 1:
+      yield Task("run", rqmt=self.rqmt)
+    else:
+      yield Task("run", mini_task=True)
 
   def run(self):
 
@@ -61,84 +265,22 @@ class CompareF0ValuesJob(Job):
     with open(self.segment_list.get_path(), "r") as f:
       segment_list = f.read().splitlines()
 
-    bliss_1 = corpus.Corpus()
-    bliss_1.load(self.ref_corpus.get_path())
-    bliss_2 = corpus.Corpus()
-    bliss_2.load(self.test_corpus.get_path())
-
-    recordings_1 = {}
-    for recording in bliss_1.all_recordings():
-      for segment in recording.segments:
-        if segment.fullname() in segment_list:
-          recordings_1[segment.fullname()] = recording.audio
-
-    recordings_2 = {}
-    for recording in bliss_2.all_recordings():
-      for segment in recording.segments:
-        if segment.fullname() in segment_list:
-          recordings_2[segment.fullname()] = recording.audio
-
-    assert len(recordings_1) == len(segment_list)
-    assert len(segment_list) == len(recordings_2)
-    for segment in segment_list:
-      signal_1, sr_1 = soundfile.read(recordings_1[segment])
-      signal_2, sr_2 = soundfile.read(recordings_2[segment])
-
-      assert sr_1 == sr_2, "Sample rates must match"
-      sample_rate = sr_1
-
-      mel_filterbank_1 = librosa.feature.melspectrogram(
-        y=signal_1, sr=sample_rate,
-        n_mels=self.n_mels,
-        hop_length=int(self.step_len * sample_rate),
-        n_fft=int(self.window_len * sample_rate),
-        fmin=self.fmin_ex, fmax=self.fmax_ex, center=self.center
-      )
-      mel_filterbank_2 = librosa.feature.melspectrogram(
-        y=signal_2, sr=sample_rate,
-        n_mels=self.n_mels,
-        hop_length=int(self.step_len * sample_rate),
-        n_fft=int(self.window_len * sample_rate),
-        fmin=self.fmin_ex, fmax=self.fmax_ex, center=self.center
-      )
-
-      if self.dtw:
-        D, wp = librosa.sequence.dtw(mel_filterbank_1, mel_filterbank_2)
-      else:
-        assert len(mel_filterbank_1) == len(mel_filterbank_2), "If no DTW sequences need same length"
-        wp = list(zip(range(len(mel_filterbank_1)), range(len(mel_filterbank_2))))
-
-      f0_1, voiced_1, _ = librosa.pyin(y=signal_1, sr=sample_rate, hop_length=int(self.step_len * sample_rate),
-        frame_length=int(self.window_len * sample_rate), win_length=int(self.window_len * sample_rate) // 2,
-        fmin=self.fmin_pyin, fmax=self.fmax_pyin, center=self.center, fill_na=0.0)
-      f0_2, voiced_2, _ = librosa.pyin(y=signal_2, sr=sample_rate, hop_length=int(self.step_len * sample_rate),
-        frame_length=int(self.window_len * sample_rate), win_length=int(self.window_len * sample_rate) // 2,
-        fmin=self.fmin_pyin, fmax=self.fmax_pyin, center=self.center, fill_na=0.0)
-
-      scale = 1200 / len(wp)
-      sum = 0
-      pitch_ls_1 = []
-      pitch_ls_2 = []
-      wrong_mappings = 0
-      for t_1, t_2 in wp:
-        if (voiced_1[t_1] and voiced_2[t_2]) or not self.check_voiced:
-          pitch_ls_1.append(f0_1[t_1])
-          pitch_ls_2.append(f0_2[t_2])
-          sum += abs(numpy.log2((f0_2[t_2] / f0_1[t_1])))
-        if (voiced_1[t_1] and not voiced_2[t_2]) or (not voiced_1[t_1] and voiced_2[t_2]):
-          wrong_mappings += 1
-
-      mae = scale * sum
-      print("MAE     Real Data        Synth Data        Wrong Mappings", "Total Lengths (real/synth)")
-      print("%.2f " % mae, "%.2f+-%.2f" % (float(numpy.mean(pitch_ls_1)), float(numpy.std(pitch_ls_1))),
-        "   %.2f+-%.2f " % (float(numpy.mean(pitch_ls_2)), float(numpy.std(pitch_ls_2))), wrong_mappings, len(mel_filterbank_1), len(mel_filterbank_2))
-      mae_ls.append(mae)
-      mean_1_ls.append(numpy.mean(pitch_ls_1))
-      mean_2_ls.append(numpy.mean(pitch_ls_2))
-      std_1_ls.append(numpy.std(pitch_ls_1))
-      std_2_ls.append(numpy.std(pitch_ls_2))
-      wrong_mappings_ls.append(wrong_mappings)
-      mappings_ls.append(wp)
+    with _get_imap(self.num_workers) as imap:
+      features_1 = _get_features(self.ref_features, self.ref_corpus, segment_list, extract_f0=True, imap=imap)
+      features_2 = _get_features(self.test_features, self.test_corpus, segment_list, extract_f0=True, imap=imap)
+      args = [(features_1[segment], features_2[segment], self.dtw, self.check_voiced) for segment in segment_list]
+
+      for mae, pitch_ls_1, pitch_ls_2, wrong_mappings, wp, len_1, len_2 in imap(_score_f0, args):
+        print("MAE     Real Data        Synth Data        Wrong Mappings", "Total Lengths (real/synth)")
+        print("%.2f " % mae, "%.2f+-%.2f" % (float(numpy.mean(pitch_ls_1)), float(numpy.std(pitch_ls_1))),
+          "   %.2f+-%.2f " % (float(numpy.mean(pitch_ls_2)), float(numpy.std(pitch_ls_2))), wrong_mappings, len_1, len_2)
+        mae_ls.append(mae)
+        mean_1_ls.append(numpy.mean(pitch_ls_1))
+        mean_2_ls.append(numpy.mean(pitch_ls_2))
+        std_1_ls.append(numpy.std(pitch_ls_1))
+        std_2_ls.append(numpy.std(pitch_ls_2))
+        wrong_mappings_ls.append(wrong_mappings)
+        mappings_ls.append(wp)
 
     with open(self.out_maes.get_path(), "w") as f:
       for mae in mae_ls:
@@ -171,28 +313,39 @@ class CompareF0ValuesJob(Job):
 
 class CompareEnergyValuesJob(Job):
 
-  def __init__(self, ref_corpus: tk.Path, test_corpus: tk.Path, segment_list: tk.Path, dtw: bool = True):
+  __sis_hash_exclude__ = {"ref_features": None, "test_features": None}
+
+  def __init__(self, ref_corpus: tk.Path, test_corpus: tk.Path, segment_list: tk.Path, dtw: bool = True,
+    num_workers: int = 1, ref_features: Optional[tk.Path] = None, test_features: Optional[tk.Path] = None):
+    """
+    :param num_workers: number of processes for the feature extraction and scoring
+    :param ref_features: precomputed features of ref_corpus, see :class:`ExtractScoringFeaturesJob`
+    :param test_features: precomputed features of test_corpus, see :class:`ExtractScoringFeaturesJob`
+    """
     self.ref_corpus = ref_corpus
     self.test_corpus = test_corpus
     self.segment_list = segment_list
     self.dtw = dtw
+    self.num_workers = num_workers
+    self.ref_features = ref_features
+    self.test_features = test_features
 
-    # default parameter for Extraction
-    self.step_len = 0.0125
-    self.window_len = 0.05
-    self.fmin_pyin = 60
-    self.fmin_ex = 60
-    self.fmax_ex = 7600
-    self.fmax_pyin = 1000
-    self.center = True
-    self.n_mels = 80
+    self.rqmt = _get_rqmt(num_workers, mem=4, time=4)
 
     self.out_maes = self.output_path("maes")
     self.out_corrs = self.output_path("corrs")
 
+  @classmethod
+  def hash(cls, parsed_args):
+    d = dict(parsed_args)
+    d.pop("num_workers")
+    return super().hash(d)
+
   def tasks(self):
-    # TODO: Caching and then with rqmt
-    yield Task("run", mini_task=True)
+    if self.num_workers > 1:
+      yield Task("run", rqmt=self.rqmt)
+    else:
+      yield Task("run", mini_task=True)
 
   def run(self):
     maes = []
@@ -200,63 +353,13 @@ class CompareEnergyValuesJob(Job):
     with open(self.segment_list.get_path(), "r") as f:
       segment_list = f.read().splitlines()
 
-    bliss_1 = corpus.Corpus()
-    bliss_1.load(self.ref_corpus.get_path())
-    bliss_2 = corpus.Corpus()
-    bliss_2.load(self.test_corpus.get_path())
-
-    recordings_1 = {}
-    for recording in bliss_1.all_recordings():
-      for segment in recording.segments:
-        if segment.fullname() in segment_list:
-          recordings_1[segment.fullname()] = recording.audio
-
-    recordings_2 = {}
-    for recording in bliss_2.all_recordings():
-      for segment in recording.segments:
-        if segment.fullname() in segment_list:
-          recordings_2[segment.fullname()] = recording.audio
-
-    for segment in segment_list:
-      signal_1, sr_1 = soundfile.read(recordings_1[segment])
-      signal_2, sr_2 = soundfile.read(recordings_2[segment])
-
-      assert sr_1 == sr_2, "Sample rates must match"
-      sample_rate = sr_1
-
-      mel_filterbank_1 = librosa.feature.melspectrogram(
-        y=signal_1, sr=sample_rate,
-        n_mels=self.n_mels,
-        hop_length=int(self.step_len * sample_rate),
-        n_fft=int(self.window_len * sample_rate),
-        fmin=self.fmin_ex, fmax=self.fmax_ex, center=self.center
-      )
-      mel_filterbank_2 = librosa.feature.melspectrogram(
-        y=signal_2, sr=sample_rate,
-        n_mels=self.n_mels,
-        hop_length=int(self.step_len * sample_rate),
-        n_fft=int(self.window_len * sample_rate),
-        fmin=self.fmin_ex, fmax=self.fmax_ex, center=self.center
-      )
-
-      D, wp = librosa.sequence.dtw(mel_filterbank_1, mel_filterbank_2)
-
-      energy_1 = librosa.feature.rms(
-        y=signal_1,
-        hop_length=int(self.step_len * sample_rate), frame_length=int(self.window_len * sample_rate))
-      energy_1 = numpy.squeeze(energy_1, axis=0)
-      energy_2 = librosa.feature.rms(
-        y=signal_2,
-        hop_length=int(self.step_len * sample_rate), frame_length=int(self.window_len * sample_rate))
-      energy_2 = numpy.squeeze(energy_2, axis=0)
-
-      energy_ls_1 = []
-      energy_ls_2 = []
-      for t_1, t_2 in wp:
-        energy_ls_1.append(energy_1[t_1])
-        energy_ls_2.append(energy_2[t_2])
-      corrs.append(numpy.corrcoef(energy_ls_1, energy_ls_2))
-      maes.append(numpy.mean(numpy.abs(numpy.array(energy_ls_1) - numpy.array(energy_ls_2))))
+    with _get_imap(self.num_workers) as imap:
+      features_1 = _get_features(self.ref_features, self.ref_corpus, segment_list, extract_f0=False, imap=imap)
+      features_2 = _get_features(self.test_features, self.test_corpus, segment_list, extract_f0=False, imap=imap)
+      args = [(features_1[segment], features_2[segment]) for segment in segment_list]
+      for mae, corr in imap(_score_energy, args):
+        corrs.append(corr)
+        maes.append(mae)
 
     with open(self.out_maes.get_path(), "w") as f:
       for mae in maes:
@@ -9,6 +9,7 @@ from typing import Iterator, Optional, Dict
 
 from i6_core.lib.hdf import get_returnn_simple_hdf_writer
 from i6_core.lib import corpus
+from i6_experiments.common.helpers.hdf import BufferedSimpleHDFWriter, SimpleHDFReader
 import collections
 
 class DistributeSpeakerEmbeddings(Job):
@@ -61,10 +62,8 @@ class DistributeSpeakerEmbeddings(Job):
         random.shuffle(self.speaker_embedding_features)
         embedding_index = 0
         for seq_tag in seq_tags:
-            self.hdf_writer.insert_batch(
-                numpy.asarray([self.speaker_embedding_features[embedding_index]]),
-                [1],
-                [seq_tag],
+            self.hdf_writer.insert(
+                self.speaker_embedding_features[embedding_index], seq_tag
             )
             embedding_index += 1
             if embedding_index >= len(self.speaker_embedding_features):
@@ -128,34 +127,28 @@ class DistributeSpeakerEmbeddings(Job):
                     break
 
             speaker_embedding = buckets[target_bucket][bucket_indices[target_bucket]]
-            self.hdf_writer.insert_batch(
-                numpy.asarray([speaker_embedding]), [1], [segment_name]
-            )
+            self.hdf_writer.insert(speaker_embedding, segment_name)
             bucket_indices[target_bucket] += 1
             if bucket_indices[target_bucket] >= len(buckets[target_bucket]):
                 bucket_indices[target_bucket] = 0
 
     def run(self):
 
-        speaker_embedding_data = h5py.File(
-            tk.uncached_path(self.speaker_embedding_hdf), "r"
+        speaker_embedding_data = SimpleHDFReader(
+            tk.uncached_path(self.speaker_embedding_hdf)
         )
-        speaker_embedding_inputs = speaker_embedding_data["inputs"]
-        speaker_embedding_raw_tags = speaker_embedding_data["seqTags"]
-        speaker_embedding_lengths = speaker_embedding_data["seqLengths"]
 
         self.speaker_embedding_features = []
         self.speaker_embedding_tags = []
-        offset = 0
-        for tag, length in zip(speaker_embedding_raw_tags, speaker_embedding_lengths):
-            self.speaker_embedding_features.append(
-                speaker_embedding_inputs[offset : offset + length[0]]
-            )
+        for tag, feature in speaker_embedding_data.iter_seqs():
+            self.speaker_embedding_features.append(feature)
             self.speaker_embedding_tags.append(tag)
-            offset += length[0]
 
-        self.hdf_writer = get_returnn_simple_hdf_writer(returnn_root=None)(
-            tk.uncached_path(self.out), dim=self.speaker_embedding_features[0].shape[-1]
+        self.hdf_writer = BufferedSimpleHDFWriter(
+            get_returnn_simple_hdf_writer(returnn_root=None)(
+                tk.uncached_path(self.out),
+                dim=self.speaker_embedding_features[0].shape[-1],
+            )
         )
 
         seq_tags = []
@@ -211,8 +204,10 @@ class SpeakerLabelHDFFromBliss(Job):
 
         pickle.dump(speaker_by_index, open(tk.uncached_path(self.speaker_dict), "wb"))
 
-        hdf_writer = get_returnn_simple_hdf_writer(returnn_root=None)(
-            tk.uncached_path(self.out), dim=num_speakers, ndim=1
+        hdf_writer = BufferedSimpleHDFWriter(
+            get_returnn_simple_hdf_writer(returnn_root=None)(
+                tk.uncached_path(self.out), dim=num_speakers, ndim=1
+            )
         )
 
         for recording in bliss.all_recordings():
@@ -220,8 +215,8 @@ class SpeakerLabelHDFFromBliss(Job):
                 speaker_name = segment.speaker_name or recording.speaker_name
                 speaker_index = index_by_speaker[speaker_name]
                 segment_name = "/".join([bliss.name, recording.name, segment.name])
-                hdf_writer.insert_batch(
-                    numpy.asarray([[speaker_index]], dtype="int32"), [1], [segment_name]
+                hdf_writer.insert(
+                    numpy.asarray([speaker_index], dtype="int32"), segment_name
                 )
 
         hdf_writer.close()
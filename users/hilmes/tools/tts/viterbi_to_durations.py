@@ -2,10 +2,39 @@ import numpy
 from sisyphus import tk, Job, Task
 from i6_private.users.rossenbach.lib.hdf import SimpleHDFWriter
 import h5py
-import sys
+
+
+def alignment_to_durations(alignment, seq_lengths, skip_token):
+  """
+  Converts a flat alignment of several sequences into durations via run-length encoding.
+  A new label starts at a frame if it is not the skip token and it differs from the previous frame
+  (or it is the first frame of the sequence). Skip tokens are added to the duration of the previous label.
+    Example [1,skip_token,1] -> [1,1] with durations [2,1]
+
+  :param numpy.ndarray alignment: flat alignment of all sequences, shape [sum(seq_lengths)]
+  :param numpy.ndarray seq_lengths: shape [num_seqs]
+  :param int skip_token:
+  :return: flat durations of all sequences (int32) and the number of durations per sequence
+  :rtype: (numpy.ndarray, numpy.ndarray)
+  """
+  seq_starts = numpy.zeros(len(alignment), dtype=bool)
+  seq_offsets = numpy.cumsum(seq_lengths) - seq_lengths
+  seq_starts[seq_offsets[seq_lengths > 0]] = True
+  assert not numpy.any(alignment[seq_starts] == skip_token), "alignment must not start with the skip token"
+  label_starts = alignment != skip_token
+  label_starts[1:] &= alignment[1:] != alignment[:-1]
+  label_starts |= seq_starts
+  start_frames = numpy.flatnonzero(label_starts)
+  durations = numpy.diff(numpy.append(start_frames, len(alignment))).astype(numpy.int32)
+  num_label_starts = numpy.concatenate([[0], numpy.cumsum(label_starts)])
+  num_durations = num_label_starts[seq_offsets + seq_lengths] - num_label_starts[seq_offsets]
+  return durations, num_durations
 
 
 class ViterbiToDurationsJob(Job):
+
+  __sis_hash_exclude__ = {"chunk_size": 10_000_000}
+
   def __init__(
     self,
     viterbi_alignment,
@@ -13,14 +42,18 @@ class ViterbiToDurationsJob(Job):
     dataset_to_check=None,
     time_rqmt=2,
     mem_rqmt=4,
+    chunk_size=10_000_000,
   ):
     """
     :param Path viterbi_alignment: Path to the alignment HDF produced by CTC/Viterbi
     :param skip_token: Value of the blank token in CTC. This is the last value in the vocabulary.
+    :param Path|None dataset_to_check: HDF with the spectrograms, the durations have to sum up to their lengths
+    :param int chunk_size: max number of alignment frames which are loaded and converted at once
     """
     self.skip_token = skip_token
     self.align = viterbi_alignment
     self.check = dataset_to_check
+    self.chunk_size = chunk_size
     self.out_durations_hdf = self.output_path("durations.hdf")
     self.rqmt = {"time": time_rqmt, "mem": mem_rqmt}
 
@@ -28,90 +61,48 @@ class ViterbiToDurationsJob(Job):
     yield Task("run", rqmt=self.rqmt)
 
   def run(self):
-    # Load HDF data
     input_dur_data = h5py.File(self.align.get_path(), "r")
-    num_seqs = -1
     inputs = input_dur_data["inputs"]
-    seq_tags = input_dur_data["seqTags"]
-    lengths = input_dur_data["seqLengths"]
-    alignment, tags = self.load_normal_data(inputs, seq_tags, lengths, num_seqs)
+    tags = [tag if isinstance(tag, str) else tag.decode() for tag in input_dur_data["seqTags"][...]]
+    lengths = input_dur_data["seqLengths"][:, 0]
+    ends = numpy.cumsum(lengths)
+    offsets = ends - lengths
 
-    durations_total = []
-
-    # sort based on tags
+    # Only the lengths are needed for the check, the durations of a sequence sum up to the alignment length
+    check_lengths = None
     if self.check is not None:
-      check, check_tag = self.load_spect_data(self.check)
+      with h5py.File(self.check.get_path(), "r") as check_data:
+        check_lengths = check_data["seqLengths"][:, 0]
+      assert len(check_lengths) >= len(lengths), (
+        f"spectrogram dataset has {len(check_lengths)} sequences, alignment has {len(lengths)}"
+      )
+
+    writer = SimpleHDFWriter(self.out_durations_hdf.get_path(), dim=1, ndim=2)
+    seq_idx = 0
+    while seq_idx < len(lengths):
+      # Chunk of consecutive sequences, thus one contiguous read of the flat inputs
+      chunk_end = max(seq_idx + 1, numpy.searchsorted(ends, offsets[seq_idx] + self.chunk_size, side="right"))
+      chunk_lengths = lengths[seq_idx:chunk_end]
+      alignment = inputs[offsets[seq_idx] : offsets[seq_idx] + chunk_lengths.sum()]
+      if alignment.ndim == 2:
+        assert alignment.shape[1] == 1, f"unexpected alignment shape {alignment.shape}"
+        alignment = alignment[:, 0]
+      durations, num_durations = alignment_to_durations(alignment, chunk_lengths, self.skip_token)
 
-    # Alignemnt to duration conversion
-    for alignment_idx, s in enumerate(alignment):
-      durations = []
-      for idx, p in enumerate(s):
-        # Skip_token only appears now if 2 labels following each other are the same.
-        #   Example [1,skip_token,1] -> [1,1]
-        if p == self.skip_token:
-          durations[-1] += 1
-          continue
-        if idx != 0 and s[idx] != s[idx - 1]:
-          durations.append(1)
-        elif idx != 0 and s[idx] == s[idx - 1]:
-          durations[-1] += 1
-        else:
-          durations.append(1)
-      # Check if lengths match if dataset is provided
-      if self.check is not None:
-        assert sum(durations) == len(check[alignment_idx]), (
-          f"durations {sum(durations)} and spectrogram length {len(check[alignment_idx])}"
-          f"do not match in length "
+      if check_lengths is not None:
+        durations_cumsum = numpy.concatenate([[0], numpy.cumsum(durations)])
+        num_durations_cumsum = numpy.cumsum(num_durations)
+        duration_sums = durations_cumsum[num_durations_cumsum] - durations_cumsum[num_durations_cumsum - num_durations]
+        mismatch = numpy.flatnonzero(duration_sums != check_lengths[seq_idx:chunk_end])
+        assert len(mismatch) == 0, (
+          f"durations {duration_sums[mismatch[0]]} and spectrogram length {check_lengths[seq_idx + mismatch[0]]}"
+          f" do not match in length for {tags[seq_idx + mismatch[0]]}"
         )
-      durations_total.append(durations)
 
-    # Dump into HDF
-    new_lengths = []
-    for seq in durations_total:
-      new_lengths.append([len(seq), 2, 2])
-    duration_sequence = numpy.hstack(durations_total).astype(numpy.int32)
-    dim = 1
-    writer = SimpleHDFWriter(self.out_durations_hdf.get_path(), dim=dim, ndim=2)
-    offset = 0
-    for tag, length in zip(tags, new_lengths):
-      in_data = duration_sequence[offset : offset + length[0]]
-      in_data = numpy.expand_dims(in_data, axis=1)
-      offset += length[0]
-      writer.insert_batch(numpy.asarray([in_data]), [in_data.shape[0]], [tag])
+      # Padded batch for the whole chunk, the writer stores it flat in one go
+      padded = numpy.zeros((len(num_durations), max(num_durations), 1), dtype=numpy.int32)
+      padded[numpy.arange(max(num_durations))[None, :] < num_durations[:, None]] = durations[:, None]
+      writer.insert_batch(padded, num_durations, tags[seq_idx:chunk_end])
+      seq_idx = chunk_end
     print(f"Succesfully converted durations into {(self.out_durations_hdf.get_path())}")
     writer.close()
-
-  def load_normal_data(self, inputs, seq_tags, lengths, num_seqs):
-    sequences = []
-    tags = []
-    offset = 0
-    for tag, length in zip(seq_tags, lengths):
-      tag = tag if isinstance(tag, str) else tag.decode()
-      in_data = inputs[offset : offset + length[0]]
-      sequences.append(in_data)
-      offset += length[0]
-      tags.append(tag)
-      if len(sequences) == num_seqs:
-        break
-    return numpy.array(sequences), tags
-
-  def load_spect_data(self, input_path):
-    input_data = h5py.File(input_path.get_path(), "r")
-    num_seqs = -1
-    offset = 0
-    inputs = input_data["inputs"]
-    seq_tags = input_data["seqTags"]
-    lengths = input_data["seqLengths"]
-
-    # Load spectrogram data
-    data_seq = []
-    data_tag = []
-    for tag, length in zip(seq_tags, lengths):
-      tag = tag if isinstance(tag, str) else tag.decode()
-      in_data = inputs[offset : offset + length[0]]
-      data_seq.append(in_data)
-      offset += length[0]
-      data_tag.append(tag)
-      if len(data_seq) == num_seqs:
-        break
-    return numpy.array(data_seq), data_tag
@@ -1,9 +1,9 @@
 __all__ = ["ExtractSearchStatisticsJob"]
 
 import collections
-import gzip
 import typing
-import xml.etree.ElementTree as ET
+
+from i6_experiments.common.helpers.rasr_search_log import parse_search_logs
 
 from sisyphus import tk, Job, Task
 
@@ -16,6 +16,7 @@ class ExtractSearchStatisticsJob(Job):
         self,
         search_logs: typing.List[typing.Union[str, tk.Path]],
         corpus_duration_hours: float,
+        num_processes: int = 4,
     ):
         self.corpus_duration = corpus_duration_hours
         self.search_logs = search_logs
@@ -41,7 +42,15 @@ class ExtractSearchStatisticsJob(Job):
         self.eval_statistics = self.output_var("eval_statistics")
         self.overall_rtf = self.output_var("overall_rtf")
 
-        self.rqmt = {"cpu": 1, "mem": 2.0, "time": 0.5}
+        # one process per log at most
+        self.num_processes = max(min(num_processes, len(search_logs)), 1)
+        self.rqmt = {"cpu": self.num_processes, "mem": 2.0, "time": 0.5}
+
+    @classmethod
+    def hash(cls, parsed_args):
+        d = dict(parsed_args)
+        d.pop("num_processes")
+        return super().hash(d)
 
     def tasks(self):
         yield Task("run", resume="run", rqmt=self.rqmt)
@@ -63,68 +72,31 @@ class ExtractSearchStatisticsJob(Job):
         seq_ss_statistics = {}
         eval_statistics = {}
 
-        for path in self.search_logs:
-            with gzip.open(tk.uncached_path(path), "rt") as f:
-                root = ET.fromstring(f.read())
-            host = root.findall("./system-information/name")[0].text
-            elapsed = float(root.findall("./timer/elapsed")[0].text)
-            user = float(root.findall("./timer/user")[0].text)
-            system = float(root.findall("./timer/system")[0].text)
-            total_elapsed += elapsed
-            total_user += user
-            total_system += system
-
-            for layer in root.findall('.//segment/layer[@name="recognizer"]'):
-                frames = int(layer.findall('./statistics/frames[@port="features"]')[0].attrib["number"])
+        search_logs = parse_search_logs(
+            [tk.uncached_path(path) for path in self.search_logs], num_processes=self.num_processes
+        )
+        for log in search_logs:
+            total_elapsed += log["elapsed"]
+            total_user += log["user"]
+            total_system += log["system"]
+
+            for layer in log["recognizer_layers"]:
+                frames = layer["frames"]
                 total_frames += frames
-                total_word_ends += frames * float(
-                    layer.findall('./search-space-statistics/statistic[@name="ending words after pruning"]/avg')[0].text
-                )
-                total_trees += frames * float(
-                    layer.findall('./search-space-statistics/statistic[@name="trees after  pruning"]/avg')[0].text
-                )
-                total_states += frames * float(
-                    layer.findall('./search-space-statistics/statistic[@name="states after pruning"]/avg')[0].text
-                )
-
-                recognizer_time += float(layer.findall("./flf-recognizer-time")[0].text)
-
-            for rescore in root.findall(".//segment/flf-push-forward-rescoring-time"):
-                rescoring_time += float(rescore.text)
-
-            for lm_total in root.findall(".//fwd-summary/total-run-time"):
-                lm_time += float(lm_total.text)
-
-            for seg in root.findall(".//segment"):
-                seg_stats = {}
-                full_name = seg.attrib["full-name"]
-                for sss in seg.findall('./layer[@name="recognizer"]/search-space-statistics/statistic[@type="scalar"]'):
-                    min_val = float(sss.findtext("./min", default="0"))
-                    avg_val = float(sss.findtext("./avg", default="0"))
-                    max_val = float(sss.findtext("./max", default="0"))
-                    seg_stats[sss.attrib["name"]] = (min_val, avg_val, max_val)
-                seq_ss_statistics[full_name] = seg_stats
-
-                features = seg.find('./layer[@name="recognizer"]/statistics/frames[@port="features"]')
-                seq_ss_statistics[full_name]["frames"] = int(features.attrib["number"])
-
-                tf_fwd = seg.find(
-                    './layer[@name="recognizer"]/information[@component="flf-lattice-tool.network.recognizer.feature-extraction.tf-fwd"]'
-                )
-                if tf_fwd is not None:
-                    seq_ss_statistics[full_name]["tf_fwd"] = float(tf_fwd.text.strip().split()[-1])
-                else:
-                    seq_ss_statistics[full_name]["tf_fwd"] = 0.0
-
-                eval_statistics[full_name] = {}
-                for evaluation in seg.findall(".//evaluation"):
-                    stat_name = evaluation.attrib["name"]
-                    alignment = evaluation.find('statistic[@type="alignment"]')
-                    eval_statistics[full_name][stat_name] = {
-                        "errors": int(alignment.findtext("edit-operations")),
-                        "ref-tokens": int(alignment.findtext('count[@event="token"][@source="reference"]')),
-                        "score": float(alignment.findtext('score[@source="best"]')),
-                    }
+                total_word_ends += frames * layer["word_ends"]
+                total_trees += frames * layer["trees"]
+                total_states += frames * layer["states"]
+
+                recognizer_time += layer["recognizer_time"]
+
+            for rescore in log["rescoring_times"]:
+                rescoring_time += rescore
+
+            for lm_total in log["lm_times"]:
+                lm_time += lm_total
+
+            seq_ss_statistics.update(log["seq_ss_statistics"])
+            eval_statistics.update(log["eval_statistics"])
 
         for s in seq_ss_statistics.values():
             frames = s["frames"]
@@ -174,6 +146,7 @@ class ExtractSearchStatisticsJobWeiV2(Job):
         self,
         search_logs: typing.List[typing.Union[str, tk.Path]],
         corpus_duration_hours: float,
+        num_processes: int = 4,
     ):
         self.corpus_duration = corpus_duration_hours
         self.search_logs = search_logs
@@ -198,7 +171,15 @@ class ExtractSearchStatisticsJobWeiV2(Job):
         self.seq_ss_statistics = self.output_var("seq_ss_statistics")
         self.eval_statistics = self.output_var("eval_statistics")
 
-        self.rqmt = {"cpu": 1, "mem": 2.0, "time": 0.5}
+        # one process per log at most
+        self.num_processes = max(min(num_processes, len(search_logs)), 1)
+        self.rqmt = {"cpu": self.num_processes, "mem": 2.0, "time": 0.5}
+
+    @classmethod
+    def hash(cls, parsed_args):
+        d = dict(parsed_args)
+        d.pop("num_processes")
+        return super().hash(d)
 
     def tasks(self):
         yield Task("run", resume="run", rqmt=self.rqmt)
@@ -220,54 +201,22 @@ class ExtractSearchStatisticsJobWeiV2(Job):
         seq_ss_statistics = {}
         eval_statistics = {}
 
-        for path in self.search_logs:
-            with gzip.open(tk.uncached_path(path), "rt") as f:
-                root = ET.fromstring(f.read())
-            host = root.findall("./system-information/name")[0].text
-            elapsed = float(root.findall("./timer/elapsed")[0].text)
-            user = float(root.findall("./timer/user")[0].text)
-            system = float(root.findall("./timer/system")[0].text)
-            total_elapsed += elapsed
-            total_user += user
-            total_system += system
-
-            for layer in root.findall('.//segment/layer[@name="recognizer"]'):
-                frames = int(layer.findall('./statistics/frames[@port="features"]')[0].attrib["number"])
-                total_frames += frames
-
-                recognizer_time += float(layer.findall("./flf-recognizer-time")[0].text)
+        search_logs = parse_search_logs(
+            [tk.uncached_path(path) for path in self.search_logs], num_processes=self.num_processes
+        )
+        for log in search_logs:
+            total_elapsed += log["elapsed"]
+            total_user += log["user"]
+            total_system += log["system"]
 
+            for layer in log["recognizer_layers"]:
+                frames = layer["frames"]
+                total_frames += frames
 
-            for seg in root.findall(".//segment"):
-                seg_stats = {}
-                full_name = seg.attrib["full-name"]
-                for sss in seg.findall('./layer[@name="recognizer"]/search-space-statistics/statistic[@type="scalar"]'):
-                    min_val = float(sss.findtext("./min", default="0"))
-                    avg_val = float(sss.findtext("./avg", default="0"))
-                    max_val = float(sss.findtext("./max", default="0"))
-                    seg_stats[sss.attrib["name"]] = (min_val, avg_val, max_val)
-                seq_ss_statistics[full_name] = seg_stats
-
-                features = seg.find('./layer[@name="recognizer"]/statistics/frames[@port="features"]')
-                seq_ss_statistics[full_name]["frames"] = int(features.attrib["number"])
+                recognizer_time += layer["recognizer_time"]
 
-                tf_fwd = seg.find(
-                    './layer[@name="recognizer"]/information[@component="flf-lattice-tool.network.recognizer.feature-extraction.tf-fwd"]'
-                )
-                if tf_fwd is not None:
-                    seq_ss_statistics[full_name]["tf_fwd"] = float(tf_fwd.text.strip().split()[-1])
-                else:
-                    seq_ss_statistics[full_name]["tf_fwd"] = 0.0
-
-                eval_statistics[full_name] = {}
-                for evaluation in seg.findall(".//evaluation"):
-                    stat_name = evaluation.attrib["name"]
-                    alignment = evaluation.find('statistic[@type="alignment"]')
-                    eval_statistics[full_name][stat_name] = {
-                        "errors": int(alignment.findtext("edit-operations")),
-                        "ref-tokens": int(alignment.findtext('count[@event="token"][@source="reference"]')),
-                        "score": float(alignment.findtext('score[@source="best"]')),
-                    }
+            seq_ss_statistics.update(log["seq_ss_statistics"])
+            eval_statistics.update(log["eval_statistics"])
 
         for s in seq_ss_statistics.values():
             frames = s["frames"]
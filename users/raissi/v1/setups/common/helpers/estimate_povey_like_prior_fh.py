@@ -31,14 +31,61 @@ Path = setup_path(__package__)
 ###################################
 
 
-def get_batch_from_segments(segments, batchSize=10000):
-    index = 0
-    while True:
-        try:
-            yield segments[index * batchSize : (index + 1) * batchSize]
-            index += 1
-        except IndexError:
-            index = 0
+def get_padded_batches_from_hdf(hdfPath, maxFrames=10000):
+    """
+    Lazily reads the feature sequences of a NextGenHDF file and groups them into zero-padded batches.
+
+    A batch holds as many sequences as fit into maxFrames padded frames (but at least one), so
+    memory consumption is bounded independent of the corpus size.
+
+    :return: generator of (features [B, T, F], lengths [B])
+    """
+
+    def pad(sequences):
+        lengths = np.array([len(seq) for seq in sequences], dtype=np.int32)
+        batch = np.zeros((len(sequences), lengths.max(), sequences[0].shape[1]), dtype=sequences[0].dtype)
+        for i, seq in enumerate(sequences):
+            batch[i, : len(seq)] = seq
+        return batch, lengths
+
+    with h5py.File(hdfPath, "r") as hf:
+        data = hf["streams"]["features"]["data"]
+        sequences = []
+        maxLen = 0
+        for name in data:
+            seq = data[name][...]
+            if len(seq) == 0:
+                continue
+            if sequences and max(maxLen, len(seq)) * (len(sequences) + 1) > maxFrames:
+                yield pad(sequences)
+                sequences = []
+                maxLen = 0
+            sequences.append(seq)
+            maxLen = max(maxLen, len(seq))
+        if sequences:
+            yield pad(sequences)
+
+
+class PosteriorSumAccumulator:
+    """
+    Accumulates frame posteriors of padded batches in float64, the mean is computed with a single division.
+    """
+
+    def __init__(self, dim):
+        self.sums = np.zeros(dim, dtype=np.float64)
+        self.count = 0
+
+    def add(self, posteriors, lengths):
+        """
+        :param posteriors: [B, T, dim]
+        :param lengths: [B]
+        """
+        mask = np.arange(posteriors.shape[1])[None, :] < lengths[:, None]
+        self.sums += posteriors[mask].sum(axis=0, dtype=np.float64)
+        self.count += int(lengths.sum())
+
+    def mean(self):
+        return self.sums / max(self.count, 1)
 
 
 class EstimateMonophonePriors_(Job):
@@ -84,41 +131,27 @@ class EstimateMonophonePriors_(Job):
     def tasks(self):
         yield Task("run", resume="run", rqmt=self.rqmt, args=range(1, (len(self.datasetIndices) + 1)))
 
-    def getSegmentFeaturesFromHdf(self, dataIndex):
-        hf = h5py.File(tk.uncached_path(self.dataPaths[dataIndex]))
-        segmentNames = list(hf["streams"]["features"]["data"])
-        segments = []
-        for name in segmentNames:
-            segments.append(hf["streams"]["features"]["data"][name])
-        return np.vstack(segments)
+    def getSegmentBatchesFromHdf(self, dataIndex):
+        return get_padded_batches_from_hdf(tk.uncached_path(self.dataPaths[dataIndex]), self.nBatch)
 
-    def getPosteriors(self, session, featureVector):
+    def getPosteriors(self, session, features, lengths):
         return session.run(
             [("-").join([self.tensorMap["diphone"], "output/output_batch_major:0"])],
             feed_dict={
-                "extern_data/placeholders/data/data:0": featureVector.reshape(
-                    1, featureVector.shape[0], featureVector.shape[1]
-                ),
-                "extern_data/placeholders/data/data_dim0_size:0": [featureVector.shape[0]],
+                "extern_data/placeholders/data/data:0": features,
+                "extern_data/placeholders/data/data_dim0_size:0": lengths,
             },
         )
 
     def calculateMeanPosteriors(self, session, taskId):
-        sampleCount = 0
-        segments = self.getSegmentFeaturesFromHdf(self.datasetIndices[taskId - 1])
+        center = PosteriorSumAccumulator(self.nStates)
 
-        for batch in get_batch_from_segments(segments, self.nBatch):
-            bSize = len(batch)
-            denom = sampleCount + bSize
-            if len(batch) == 0:
-                break
+        for features, lengths in self.getSegmentBatchesFromHdf(self.datasetIndices[taskId - 1]):
+            p = self.getPosteriors(session, features, lengths)
+            center.add(p[0], lengths)
 
-            p = self.getPosteriors(session, batch)
-
-            for i in range(len(batch)):
-                nominator = (sampleCount * self.centerPhonemeMeans) + (bSize * np.mean(p[0][0], axis=0))
-                self.centerPhonemeMeans = np.divide(nominator, denom)
-            sampleCount += bSize
+        self.centerPhonemeMeans = center.mean()
+        sampleCount = center.count
 
         with open(tk.uncached_path(self.numSegments[taskId - 1]), "wb") as fp:
             pickle.dump(sampleCount, fp, protocol=pickle.HIGHEST_PROTOCOL)
@@ -224,37 +257,29 @@ class EstimateRasrDiphoneAndContextPriors(Job):
     def tasks(self):
         yield Task("run", resume="run", rqmt=self.rqmt, args=range(1, (len(self.datasetIndices) + 1)))
 
-    def getSegmentFeaturesFromHdf(self, dataIndex):
-        hf = h5py.File(tk.uncached_path(self.dataPaths[dataIndex]))
+    def getSegmentBatchesFromHdf(self, dataIndex):
         print(self.dataPaths[dataIndex])
-        segmentNames = list(hf["streams"]["features"]["data"])
-        segments = []
-        for name in segmentNames:
-            segments.append(hf["streams"]["features"]["data"][name])
-        return np.vstack(segments)
+        return get_padded_batches_from_hdf(tk.uncached_path(self.dataPaths[dataIndex]), self.nBatch)
 
-    def getEncoderOutput(self, session, featureVector):
+    def getEncoderOutput(self, session, features, lengths):
         return session.run(
             ["encoder-output/output_batch_major:0"],
             feed_dict={
-                "extern_data/placeholders/data/data:0": featureVector.reshape(
-                    1, featureVector.shape[0], featureVector.shape[1]
-                ),
-                "extern_data/placeholders/data/data_dim0_size:0": [featureVector.shape[0]],
+                "extern_data/placeholders/data/data:0": features,
+                "extern_data/placeholders/data/data_dim0_size:0": lengths,
             },
         )
 
-    def getPosteriorsOfBothOutputsWithEncoded(self, session, featureVector, classLabelVector):
+    def getPosteriorsOfBothOutputsWithEncoded(self, session, encoded, classLabelVector):
+        # encoded is batch major [B, T, F], the concat layer is time major
         return session.run(
             [
                 ("-").join([self.tensorMap["diphone"], "output/output_batch_major:0"]),
                 ("-").join([self.tensorMap["context"], "output/output_batch_major:0"]),
             ],
             feed_dict={
-                "concat_fwd_6_bwd_6/concat_sources/concat:0": featureVector.reshape(
-                    featureVector.shape[1], 1, featureVector.shape[2]
-                ),
-                "extern_data/placeholders/classes/classes:0": [[classLabelVector] * featureVector.shape[1]],
+                "concat_fwd_6_bwd_6/concat_sources/concat:0": np.transpose(encoded, (1, 0, 2)),
+                "extern_data/placeholders/classes/classes:0": np.full(encoded.shape[:2], classLabelVector),
             },
         )
 
@@ -264,28 +289,24 @@ class EstimateRasrDiphoneAndContextPriors(Job):
         ) + futureLabel
 
     def calculateMeanPosteriors(self, session, taskId):
-        sampleCount = 0
-        segments = self.getSegmentFeaturesFromHdf(self.datasetIndices[taskId - 1])
-
-        for batch in get_batch_from_segments(segments, self.nBatch):
-            bSize = len(batch)
-            denom = sampleCount + bSize
-            if len(batch) == 0:
-                break
+        diphone = [PosteriorSumAccumulator(len(self.diphoneMeans[i])) for i in range(self.nContexts)]
+        context = PosteriorSumAccumulator(self.nContexts)
 
-            encoderOutput = self.getEncoderOutput(session, batch)
+        for features, lengths in self.getSegmentBatchesFromHdf(self.datasetIndices[taskId - 1]):
+            encoderOutput = self.getEncoderOutput(session, features, lengths)
             for pastContextId in range(self.nContexts):
                 p = self.getPosteriorsOfBothOutputsWithEncoded(
                     session, encoderOutput[0], self.get_dense_label(pastContextId)
                 )
 
-                di = (sampleCount * self.diphoneMeans[pastContextId]) + (bSize * np.mean(p[0][0], axis=0))
-                self.diphoneMeans[pastContextId] = np.divide(di, denom)
+                diphone[pastContextId].add(p[0], lengths)
                 # context is not label dependent
                 if not pastContextId:
-                    ctx = (sampleCount * self.contextMeans) + (bSize * np.mean(p[1][0], axis=0))
-                    self.contextMeans = np.divide(ctx, denom)
-            sampleCount += bSize
+                    context.add(p[1], lengths)
+
+        self.diphoneMeans = {i: acc.mean() for i, acc in enumerate(diphone)}
+        self.contextMeans = context.mean()
+        sampleCount = context.count
 
         with open(tk.uncached_path(self.numSegments[taskId - 1]), "wb") as fp:
             pickle.dump(sampleCount, fp, protocol=pickle.HIGHEST_PROTOCOL)
@@ -1,9 +1,70 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
 import numpy as np
 import torch
-from .core import maximum_path_c
+
+from .torch_mas import maximum_path_torch
+
+
+def _load_core():
+    """
+    Imports the Cython core. If it was not built yet (e.g. via setup.py), build it from core.pyx via pyximport.
+    Returns None if that is not possible, e.g. because Cython or a compiler is missing,
+    or if the core is an outdated build without maximum_path_range.
+    """
+    try:
+        from . import core
+    except ImportError:
+        try:
+            import pyximport
+        except ImportError:
+            return None
+        importers = pyximport.install(setup_args={"include_dirs": np.get_include()}, language_level=3)
+        try:
+            from . import core
+        except Exception as exc:
+            print(f"monotonic_align: could not build Cython core ({exc}), using the torch implementation")
+            return None
+        finally:
+            pyximport.uninstall(*importers)
+    if not hasattr(core, "maximum_path_range"):
+        # e.g. built in place from an older core.pyx, shadows core.pyx
+        print(f"monotonic_align: outdated Cython core {core.__file__}, rebuild it, using the torch implementation")
+        return None
+    return core
+
+
+_core = _load_core()
+_num_threads = int(os.environ.get("MAS_NUM_THREADS", min(os.cpu_count() or 1, 8)))
+_thread_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=_num_threads, thread_name_prefix="monotonic_align")
+    return _thread_pool
 
 
-def maximum_path(value, mask):
+def maximum_path(value, mask, backend: Optional[str] = None):
+    """
+    value: [b, t_x, t_y]
+    mask: [b, t_x, t_y]
+    backend: "cython" (on CPU, batch entries in parallel threads) or "torch" (on the device of value).
+        By default, "torch" for CUDA tensors, so the data stays on the GPU, otherwise "cython" if available.
+    """
+    if backend is None:
+        backend = "torch" if value.is_cuda or _core is None else "cython"
+    if backend == "torch":
+        return maximum_path_torch(value, mask)
+    assert backend == "cython", f"unknown backend {backend!r}"
+    assert _core is not None, "Cython core not available"
+    return maximum_path_cython(value, mask)
+
+
+def maximum_path_cython(value, mask):
     """Cython optimised version.
     value: [b, t_x, t_y]
     mask: [b, t_x, t_y]
@@ -11,13 +72,23 @@ def maximum_path(value, mask):
     value = value * mask
     device = value.device
     dtype = value.dtype
-    value = value.data.cpu().numpy().astype(np.float32)
-    path = np.zeros_like(value).astype(np.int32)
+    value = np.ascontiguousarray(value.data.cpu().numpy(), dtype=np.float32)
+    path = np.zeros(value.shape, dtype=np.int32)
     mask = mask.data.cpu().numpy()
 
     t_x_max = mask.sum(1)[:, 0].astype(np.int32)
     t_y_max = mask.sum(2)[:, 0].astype(np.int32)
-    maximum_path_c(path, value, t_x_max, t_y_max)
+    pool = _get_thread_pool()
+    b = value.shape[0]
+    num_chunks = max(min(b, _num_threads), 1)
+    bounds = [b * i // num_chunks for i in range(num_chunks + 1)]
+    futures = [
+        pool.submit(_core.maximum_path_range, path, value, t_x_max, t_y_max, start, end)
+        for start, end in zip(bounds[:-1], bounds[1:])
+        if end > start
+    ]
+    for future in futures:
+        future.result()
     return torch.from_numpy(path).to(device=device, dtype=dtype)
 
 
@@ -33,7 +104,7 @@ def maximum_path(value, mask):
 #                 v_cur = max_neg_value
 #             else:
 #                 v_cur = value[x, y - 1]
-            
+
 #             if x == 0:
 #                 if y == 0:
 #                     v_prev = max_neg_value
@@ -43,10 +114,10 @@ def maximum_path(value, mask):
 #                 v_prev = value[x-1, y-1]
 
 #             value[x, y] = max(v_cur, v_prev) + value[x, y]
-    
+
 #     index = t_x -1
 #     for y in range(t_y - 1, -1, -1):
 #         path[index, y] = 1
-        
+
 #         if index != 0 and (index == y or value[index, y-1] < value[index-1, y-1]):
 #             index = index - 1
@@ -0,0 +1,82 @@
+"""
+Benchmark of the monotonic alignment search backends for realistic sizes
+(T_x: number of phonemes, T_y: number of spectrogram frames):
+
+- "legacy": Cython core over the whole batch in one thread, as before
+- "cython": Cython core, batch entries in parallel threads
+- "torch": pure PyTorch, on CPU, and on GPU if available (there without any copy to the CPU)
+
+Also checks that all backends give the same path.
+
+Run as:
+
+    python -m i6_experiments.users.rilling.experiments.librispeech.librispeech_glowtts.pytorch_networks.monotonic_align.benchmark
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from . import _core, maximum_path_cython, maximum_path_torch
+
+
+def maximum_path_legacy(value, mask):
+    value = value * mask
+    device = value.device
+    dtype = value.dtype
+    value = value.data.cpu().numpy().astype(np.float32)
+    path = np.zeros_like(value).astype(np.int32)
+    mask = mask.data.cpu().numpy()
+
+    t_x_max = mask.sum(1)[:, 0].astype(np.int32)
+    t_y_max = mask.sum(2)[:, 0].astype(np.int32)
+    _core.maximum_path_c(path, value, t_x_max, t_y_max)
+    return torch.from_numpy(path).to(device=device, dtype=dtype)
+
+
+def make_batch(*, batch_size: int, t_x_max: int, t_y_max: int, device: str = "cpu"):
+    gen = torch.Generator().manual_seed(42)
+    t_xs = torch.randint(t_x_max // 4, t_x_max + 1, (batch_size,), generator=gen)
+    t_ys = (t_xs * t_y_max / t_x_max * torch.empty(batch_size).uniform_(0.8, 1.0, generator=gen)).long()
+    t_ys = torch.maximum(t_ys, t_xs)
+    t_xs[0], t_ys[0] = t_x_max, t_y_max
+    mask = (torch.arange(t_x_max)[None, :, None] < t_xs[:, None, None]) & (
+        torch.arange(t_y_max)[None, None, :] < t_ys[:, None, None]
+    )
+    value = torch.randn(batch_size, t_x_max, t_y_max, generator=gen)  # log-likelihoods
+    return value.to(device), mask.float().to(device)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repetitions", type=int, default=5)
+    args = parser.parse_args()
+
+    backends = {"legacy": maximum_path_legacy, "cython": maximum_path_cython, "torch": maximum_path_torch}
+    devices = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+
+    for t_x_max, t_y_max in [(50, 200), (100, 500), (200, 1000)]:
+        for device in devices:
+            value, mask = make_batch(batch_size=args.batch_size, t_x_max=t_x_max, t_y_max=t_y_max, device=device)
+            ref = None
+            for name, func in backends.items():
+                path = func(value, mask)  # warmup
+                if ref is None:
+                    ref = path
+                assert torch.equal(path, ref), f"{name} differs"
+                if device == "cuda":
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+                for _ in range(args.repetitions):
+                    func(value, mask)
+                if device == "cuda":
+                    torch.cuda.synchronize()
+                elapsed = (time.perf_counter() - start) / args.repetitions
+                print(f"T_x={t_x_max:4d} T_y={t_y_max:5d} {device:>4} {name:>6}: {elapsed * 1000:8.2f} ms/batch")
+
+
+if __name__ == "__main__":
+    main()
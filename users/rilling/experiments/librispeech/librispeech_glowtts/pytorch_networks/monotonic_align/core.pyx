@@ -6,7 +6,7 @@ from cython.parallel import prange
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-cdef void maximum_path_each(int[:,::1] path, float[:,::1] value, int t_x, int t_y, float max_neg_val) nogil:
+cdef void maximum_path_each(int[:,::1] path, float[:,::1] value, int t_x, int t_y, float max_neg_val) noexcept nogil:
   cdef int x
   cdef int y
   cdef float v_prev
@@ -37,9 +37,22 @@ cdef void maximum_path_each(int[:,::1] path, float[:,::1] value, int t_x, int t_
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-cpdef void maximum_path_c(int[:,:,::1] paths, float[:,:,::1] values, int[::1] t_xs, int[::1] t_ys, float max_neg_val=-1e9) nogil:
+cpdef void maximum_path_c(int[:,:,::1] paths, float[:,:,::1] values, int[::1] t_xs, int[::1] t_ys, float max_neg_val=-1e9) noexcept nogil:
   cdef int b = values.shape[0]
 
   cdef int i
   for i in prange(b, nogil=True):
     maximum_path_each(paths[i], values[i], t_xs[i], t_ys[i], max_neg_val)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def maximum_path_range(int[:,:,::1] paths, float[:,:,::1] values, int[::1] t_xs, int[::1] t_ys, int start, int end, float max_neg_val=-1e9):
+  """
+  Same as maximum_path_c, but only for the batch entries [start, end), and serially.
+  The GIL is released, such that multiple Python threads can work on different ranges in parallel.
+  """
+  cdef int i
+  with nogil:
+    for i in range(start, end):
+      maximum_path_each(paths[i], values[i], t_xs[i], t_ys[i], max_neg_val)
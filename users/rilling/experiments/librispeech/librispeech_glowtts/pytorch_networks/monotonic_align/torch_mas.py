@@ -0,0 +1,63 @@
+"""
+Monotonic alignment search (MAS) in pure PyTorch, running on the device of the input.
+
+The recursion Q[x, y] = max(Q[x, y-1], Q[x-1, y-1]) + value[x, y] only depends on the previous frame y-1,
+so all batch entries and all x of one frame y are computed at once, and we only loop over T_y.
+Same semantics (including the tie-breaking in the backtracking) as ``core.pyx``.
+"""
+
+import torch
+
+
+def maximum_path_torch(value: torch.Tensor, mask: torch.Tensor, max_neg_val: float = -1e9) -> torch.Tensor:
+    """
+    value: [b, t_x, t_y]
+    mask: [b, t_x, t_y]
+    :return: path [b, t_x, t_y], same dtype and device as value
+    """
+    dtype = value.dtype
+    value = (value * mask).float()
+    b, t_x_max, t_y_max = value.shape
+    device = value.device
+
+    t_xs = mask.sum(1)[:, 0].long()  # [b]
+    t_ys = mask.sum(2)[:, 0].long()  # [b]
+    x_range = torch.arange(t_x_max, device=device)  # [t_x]
+    max_neg = torch.tensor(max_neg_val, dtype=torch.float32, device=device)
+    y_range = torch.arange(t_y_max, device=device)  # [t_y]
+    # valid x for frame y: max(0, t_x + y - t_y) <= x < min(t_x, y + 1)
+    valid = (
+        (x_range[None, :, None] >= (t_xs - t_ys)[:, None, None] + y_range[None, None, :])
+        & (x_range[None, :, None] < t_xs[:, None, None])
+        & (x_range[:, None] <= y_range[None, :])[None]
+    )  # [b, t_x, t_y]
+
+    # forward, frame by frame
+    acc = []
+    prev = None  # [b, t_x]
+    for y in range(t_y_max):
+        if y == 0:
+            best = torch.where(x_range == 0, 0.0, max_neg)[None, :].expand(b, t_x_max)
+        else:
+            v_cur = torch.where(x_range == y, max_neg, prev)
+            v_prev = torch.cat([max_neg.expand(b, 1), prev[:, :-1]], dim=1)
+            best = torch.maximum(v_cur, v_prev)
+        cur = torch.where(valid[:, :, y], best + value[:, :, y], value[:, :, y])  # [b, t_x]
+        acc.append(cur)
+        prev = cur
+    acc = torch.stack(acc, dim=2)  # [b, t_x, t_y]
+
+    # backtracking
+    batch_range = torch.arange(b, device=device)
+    index = t_xs - 1  # [b]
+    path = torch.zeros_like(value, dtype=dtype)
+    for y in range(t_y_max - 1, -1, -1):
+        active = y < t_ys  # [b]
+        path[batch_range, index.clamp(min=0), y] = active.to(dtype)
+        if y == 0:
+            break
+        v_stay = acc[batch_range, index.clamp(min=0), y - 1]
+        v_down = acc[batch_range, (index - 1).clamp(min=0), y - 1]
+        move = active & (index > 0) & ((index == y) | (v_stay < v_down))
+        index = index - move.long()
+    return path
@@ -1,7 +1,7 @@
 import copy
 import numpy as np
 from sisyphus import tk
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from i6_core.returnn.config import ReturnnConfig, CodeWrapper
 
@@ -128,6 +128,7 @@ def get_search_config(
         config: Dict[str, Any],
         debug: bool = False,
         use_custom_engine=False,
+        post_decoder_args: Optional[Dict[str, Any]] = None,
         **kwargs,
 ):
     """
@@ -135,6 +136,7 @@ def get_search_config(
     :param returnn_common_root: returnn_common version to be used, usually output of CloneGitRepositoryJob
     :param training_datasets: datasets for training
     :param kwargs: arguments to be passed to the network construction
+    :param post_decoder_args: decoder arguments which do not change the hash, e.g. num_search_workers
     :return: RETURNN training config
     """
 
@@ -159,6 +161,7 @@ def get_search_config(
         use_custom_engine=use_custom_engine,
         decoder=decoder,
         decoder_args=decoder_args,
+        post_decoder_args=post_decoder_args,
     )
     returnn_config = ReturnnConfig(
         config=config, post_config=post_config, python_epilog=[serializer]
@@ -55,6 +55,7 @@ def search_single(
         returnn_root,
         mem_rqmt=8,
         use_gpu=False,
+        rtf_report=False,
 ):
     """
     Run search for a specific test dataset
@@ -66,6 +67,7 @@ def search_single(
     :param Path recognition_reference: Path to a py-dict format reference file
     :param Path returnn_exe:
     :param Path returnn_root:
+    :param bool rtf_report: also output the RTF report (rtf.json) of the decoder, see RTFProfiler
     """
     returnn_config = copy.deepcopy(returnn_config)
     returnn_config.config["forward"] = recognition_dataset.as_returnn_opts()
@@ -79,7 +81,7 @@ def search_single(
         cpu_rqmt=2,
         returnn_python_exe=returnn_exe,
         returnn_root=returnn_root,
-        output_files=["search_out.py"],
+        output_files=["search_out.py"] + (["rtf.json"] if rtf_report else []),
     )
     search_job.add_alias(prefix_name + "/search_job")
 
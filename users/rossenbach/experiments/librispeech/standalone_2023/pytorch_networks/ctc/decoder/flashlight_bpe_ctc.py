@@ -2,11 +2,12 @@
 Flashlight/Torchaudio CTC decoder and prior computation functions
 """
 
-import time
 import numpy as np
 import torch
 from torch import nn
 
+from i6_experiments.common.helpers.rtf import RTFProfiler
+
 
 def forward_init_hook(run_ctx, **kwargs):
     # we are storing durations, but call it output.hdf to match
@@ -50,20 +51,14 @@ def forward_init_hook(run_ctx, **kwargs):
     else:
         run_ctx.prior = None
 
-    run_ctx.running_audio_len_s = 0
-    run_ctx.total_am_time = 0
-    run_ctx.total_search_time = 0
+    run_ctx.rtf = RTFProfiler()
+
 
 def forward_finish_hook(run_ctx, **kwargs):
     run_ctx.recognition_file.write("}\n")
     run_ctx.recognition_file.close()
 
-    print("Total-AM-Time: %.2fs, AM-RTF: %.3f" %
-          (run_ctx.total_am_time, run_ctx.total_am_time / run_ctx.running_audio_len_s))
-    print("Total-Search-Time: %.2fs, Search-RTF: %.3f" %
-          (run_ctx.total_search_time, run_ctx.total_search_time / run_ctx.running_audio_len_s))
-    total_proc_time = run_ctx.total_am_time + run_ctx.total_search_time
-    print("Total-time: %.2f, Batch-RTF: %.3f" % (total_proc_time, total_proc_time / run_ctx.running_audio_len_s))
+    run_ctx.rtf.finish()
 
 
 def forward_step(*, model, data, run_ctx, **kwargs):
@@ -71,37 +66,28 @@ def forward_step(*, model, data, run_ctx, **kwargs):
     raw_audio_len = data["raw_audio:size1"]  # [B]
 
     audio_len_batch = torch.sum(raw_audio_len).detach().cpu().numpy() / 16000
-    run_ctx.running_audio_len_s += audio_len_batch
-
-    am_start = time.time()
-    logprobs, audio_features_len = model(
-        raw_audio=raw_audio,
-        raw_audio_len=raw_audio_len,
-    )
-
     tags = data["seq_tag"]
 
-    logprobs_cpu = logprobs.cpu()
-    if run_ctx.blank_log_penalty is not None:
-        # assumes blank is last
-        logprobs_cpu[:, :, -1] -= run_ctx.blank_log_penalty
-    if run_ctx.prior is not None:
-        logprobs_cpu -= run_ctx.prior_scale * run_ctx.prior
-
-    am_time = time.time() - am_start
-    run_ctx.total_am_time += am_time
-
-    search_start = time.time()
-    hypothesis = run_ctx.ctc_decoder(logprobs_cpu, audio_features_len.cpu())
-    search_time = time.time() - search_start
-    run_ctx.total_search_time += search_time
-
-    print("Batch-AM-Time: %.2fs, AM-RTF: %.3f" % (am_time, am_time / audio_len_batch))
-    print("Batch-Search-Time: %.2fs, Search-RTF: %.3f" % (search_time, search_time / audio_len_batch))
-    print("Batch-time: %.2f, Batch-RTF: %.3f" % (am_time + search_time, (am_time + search_time) / audio_len_batch))
-
-    for hyp, tag in zip(hypothesis, tags):
-        words = hyp[0].words
-        sequence = " ".join([word for word in words if not word.startswith("[")])
-        print(sequence)
-        run_ctx.recognition_file.write("%s: %s,\n" % (repr(tag), repr(sequence)))
\ No newline at end of file
+    with run_ctx.rtf.batch(audio_len_s=audio_len_batch, num_seqs=len(tags)):
+        with run_ctx.rtf.section("AM"):
+            logprobs, audio_features_len = model(
+                raw_audio=raw_audio,
+                raw_audio_len=raw_audio_len,
+            )
+
+            logprobs_cpu = logprobs.cpu()
+            if run_ctx.blank_log_penalty is not None:
+                # assumes blank is last
+                logprobs_cpu[:, :, -1] -= run_ctx.blank_log_penalty
+            if run_ctx.prior is not None:
+                logprobs_cpu -= run_ctx.prior_scale * run_ctx.prior
+
+        with run_ctx.rtf.section("Search"):
+            hypothesis = run_ctx.ctc_decoder(logprobs_cpu, audio_features_len.cpu())
+
+        with run_ctx.rtf.section("Output"):
+            for hyp, tag in zip(hypothesis, tags):
+                words = hyp[0].words
+                sequence = " ".join([word for word in words if not word.startswith("[")])
+                print(sequence)
+                run_ctx.recognition_file.write("%s: %s,\n" % (repr(tag), repr(sequence)))
@@ -2,13 +2,51 @@
 Flashlight/Torchaudio CTC decoder and prior computation functions
 """
 
+import collections
+import multiprocessing
 import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import torch
 from torch import nn
 
+from i6_experiments.common.helpers.rtf import RTFProfiler
+
+
+_search_worker_decoder = None
+
+
+def _search_worker_init(decoder_opts):
+    """
+    Each search worker process has its own decoder instance
+    """
+    global _search_worker_decoder
+    from torchaudio.models.decoder import ctc_decoder
+    torch.set_num_threads(1)
+    _search_worker_decoder = ctc_decoder(**decoder_opts)
+
+
+def _search(ctc_decoder, logprobs, audio_features_len):
+    """
+    :return: recognized words per sequence, search time
+    """
+    search_start = time.perf_counter()
+    hypothesis = ctc_decoder(logprobs, audio_features_len)
+    search_time = time.perf_counter() - search_start
+    return [hyp[0].words for hyp in hypothesis], search_time
+
+
+def _search_in_worker(logprobs, audio_features_len):
+    return _search(_search_worker_decoder, logprobs, audio_features_len)
+
 
 def forward_init_hook(run_ctx, **kwargs):
+    """
+    With num_search_workers > 0 (default 0), the search runs asynchronously in that many worker processes,
+    each with its own decoder, while the network forward continues with the next batches.
+    The results are still written in the order of the batches.
+    num_search_workers should be passed unhashed, i.e. via post_decoder_args.
+    """
     # we are storing durations, but call it output.hdf to match
     # the default output of the ReturnnForwardJob
     from torchaudio.models.decoder import ctc_decoder
@@ -23,7 +61,7 @@ def forward_init_hook(run_ctx, **kwargs):
     vocab = Vocabulary.create_vocab(
         vocab_file=kwargs["returnn_vocab"], unknown_label=None)
     labels = vocab.labels
-    run_ctx.ctc_decoder = ctc_decoder(
+    decoder_opts = dict(
         lexicon=kwargs["lexicon"],
         lm=lm,
         lm_weight=kwargs["lm_weight"],
@@ -41,6 +79,22 @@ def forward_init_hook(run_ctx, **kwargs):
         sil_score=kwargs.get("sil_score", 0.0),
         word_score=kwargs.get("word_score", 0.0),
     )
+    num_search_workers = kwargs.get("num_search_workers", 0)
+    if num_search_workers > 0:
+        run_ctx.ctc_decoder = None
+        run_ctx.search_pool = ProcessPoolExecutor(
+            max_workers=num_search_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_search_worker_init,
+            initargs=(decoder_opts,),
+        )
+        # at most that many batches are waiting for the search, such that the forward does not run too far ahead
+        run_ctx.max_pending_searches = 2 * num_search_workers
+    else:
+        run_ctx.ctc_decoder = ctc_decoder(**decoder_opts)
+        run_ctx.search_pool = None
+        run_ctx.max_pending_searches = 0
+    run_ctx.pending_searches = collections.deque()
     run_ctx.labels = labels
     run_ctx.blank_log_penalty = kwargs.get("blank_log_penalty", None)
 
@@ -50,20 +104,45 @@ def forward_init_hook(run_ctx, **kwargs):
     else:
         run_ctx.prior = None
 
-    run_ctx.running_audio_len_s = 0
-    run_ctx.total_am_time = 0
-    run_ctx.total_search_time = 0
+    # the main process waits for the search in "Search-Wait", which is already contained in "Search" of the workers
+    run_ctx.rtf = RTFProfiler(parallel_sections=("AM", "Search"))
+
 
 def forward_finish_hook(run_ctx, **kwargs):
+    _write_finished_searches(run_ctx, wait_for_all=True)
+    if run_ctx.search_pool is not None:
+        run_ctx.search_pool.shutdown()
     run_ctx.recognition_file.write("}\n")
     run_ctx.recognition_file.close()
 
-    print("Total-AM-Time: %.2fs, AM-RTF: %.3f" %
-          (run_ctx.total_am_time, run_ctx.total_am_time / run_ctx.running_audio_len_s))
-    print("Total-Search-Time: %.2fs, Search-RTF: %.3f" %
-          (run_ctx.total_search_time, run_ctx.total_search_time / run_ctx.running_audio_len_s))
-    total_proc_time = run_ctx.total_am_time + run_ctx.total_search_time
-    print("Total-time: %.2f, Batch-RTF: %.3f" % (total_proc_time, total_proc_time / run_ctx.running_audio_len_s))
+    # with search workers, the AM and search time overlap
+    run_ctx.rtf.finish()
+
+
+def _write_finished_searches(run_ctx, wait_for_all=False):
+    """
+    Writes the results of the pending searches in batch order,
+    as long as they are finished (or until all are written if wait_for_all).
+    If too many searches are pending, waits for the oldest ones.
+    """
+    pending = run_ctx.pending_searches
+    while pending:
+        tags, result, audio_len_batch, batch_stats = pending[0]
+        if not isinstance(result, tuple):  # future of the search worker
+            if not (wait_for_all or len(pending) > run_ctx.max_pending_searches or result.done()):
+                break
+            result = result.result()
+        pending.popleft()
+        words_per_seq, search_time = result
+        run_ctx.rtf.add_time("Search", search_time, batch=batch_stats)
+        if run_ctx.search_pool is not None:
+            # the other timings of this batch were already printed
+            print("Batch-Search-Time: %.2fs, Search-RTF: %.3f" % (search_time, search_time / audio_len_batch))
+
+        for words, tag in zip(words_per_seq, tags):
+            sequence = " ".join([word for word in words if not word.startswith("[")])
+            print(sequence)
+            run_ctx.recognition_file.write("%s: %s,\n" % (repr(tag), repr(sequence)))
 
 
 def forward_step(*, model, data, run_ctx, **kwargs):
@@ -71,37 +150,27 @@ def forward_step(*, model, data, run_ctx, **kwargs):
     raw_audio_len = data["raw_audio:size1"]  # [B]
 
     audio_len_batch = torch.sum(raw_audio_len).detach().cpu().numpy() / 16000
-    run_ctx.running_audio_len_s += audio_len_batch
-
-    am_start = time.time()
-    logprobs, audio_features_len = model(
-        raw_audio=raw_audio,
-        raw_audio_len=raw_audio_len,
-    )
-
     tags = data["seq_tag"]
 
-    logprobs_cpu = logprobs.cpu()
-    if run_ctx.blank_log_penalty is not None:
-        # assumes blank is last
-        logprobs_cpu[:, :, -1] -= run_ctx.blank_log_penalty
-    if run_ctx.prior is not None:
-        logprobs_cpu -= run_ctx.prior_scale * run_ctx.prior
-
-    am_time = time.time() - am_start
-    run_ctx.total_am_time += am_time
-
-    search_start = time.time()
-    hypothesis = run_ctx.ctc_decoder(logprobs_cpu, audio_features_len.cpu())
-    search_time = time.time() - search_start
-    run_ctx.total_search_time += search_time
-
-    print("Batch-AM-Time: %.2fs, AM-RTF: %.3f" % (am_time, am_time / audio_len_batch))
-    print("Batch-Search-Time: %.2fs, Search-RTF: %.3f" % (search_time, search_time / audio_len_batch))
-    print("Batch-time: %.2f, Batch-RTF: %.3f" % (am_time + search_time, (am_time + search_time) / audio_len_batch))
-
-    for hyp, tag in zip(hypothesis, tags):
-        words = hyp[0].words
-        sequence = " ".join([word for word in words if not word.startswith("[")])
-        print(sequence)
-        run_ctx.recognition_file.write("%s: %s,\n" % (repr(tag), repr(sequence)))
\ No newline at end of file
+    with run_ctx.rtf.batch(audio_len_s=audio_len_batch, num_seqs=len(tags)) as batch_stats:
+        with run_ctx.rtf.section("AM"):
+            logprobs, audio_features_len = model(
+                raw_audio=raw_audio,
+                raw_audio_len=raw_audio_len,
+            )
+
+            logprobs_cpu = logprobs.cpu()
+            if run_ctx.blank_log_penalty is not None:
+                # assumes blank is last
+                logprobs_cpu[:, :, -1] -= run_ctx.blank_log_penalty
+            if run_ctx.prior is not None:
+                logprobs_cpu -= run_ctx.prior_scale * run_ctx.prior
+
+        if run_ctx.search_pool is not None:
+            result = run_ctx.search_pool.submit(_search_in_worker, logprobs_cpu, audio_features_len.cpu())
+        else:
+            result = _search(run_ctx.ctc_decoder, logprobs_cpu, audio_features_len.cpu())
+        run_ctx.pending_searches.append((tags, result, audio_len_batch, batch_stats))
+        # with search workers, this mostly is the time the forward waits for the search
+        with run_ctx.rtf.section("Output" if run_ctx.search_pool is None else "Search-Wait"):
+            _write_finished_searches(run_ctx)
@@ -2,9 +2,11 @@
 Greedy CTC decoder without any extras
 """
 
-import time
+import numpy as np
 import torch
 
+from i6_experiments.common.helpers.rtf import RTFProfiler
+
 
 def forward_init_hook(run_ctx, **kwargs):
     # we are storing durations, but call it output.hdf to match
@@ -16,15 +18,19 @@ def forward_init_hook(run_ctx, **kwargs):
     vocab = Vocabulary.create_vocab(
         vocab_file=kwargs["returnn_vocab"], unknown_label=None)
     run_ctx.labels = vocab.labels
+    run_ctx.label_array = np.array(vocab.labels)
+    # blank (index len(labels)) and special labels like "<s>" or "[noise]" are removed
+    run_ctx.keep_label = torch.tensor([not (s.startswith("<") or s.startswith("[")) for s in vocab.labels])
+    run_ctx.verbose = kwargs.get("verbose", False)
+
+    run_ctx.rtf = RTFProfiler()
 
-    run_ctx.running_audio_len_s = 0
-    run_ctx.total_time = 0
 
 def forward_finish_hook(run_ctx, **kwargs):
     run_ctx.recognition_file.write("}\n")
     run_ctx.recognition_file.close()
 
-    print("Total-time: %.2f, Batch-RTF: %.3f" % (run_ctx.total_time, run_ctx.total_time / run_ctx.running_audio_len_s))
+    run_ctx.rtf.finish()
 
 
 def forward_step(*, model, data, run_ctx, **kwargs):
@@ -32,28 +38,48 @@ def forward_step(*, model, data, run_ctx, **kwargs):
     raw_audio_len = data["raw_audio:size1"]  # [B]
 
     audio_len_batch = torch.sum(raw_audio_len).detach().cpu().numpy() / 16000
-    run_ctx.running_audio_len_s += audio_len_batch
+    tags = data["seq_tag"]
 
-    am_start = time.time()
-    logprobs, audio_features_len = model(
-        raw_audio=raw_audio,
-        raw_audio_len=raw_audio_len,
-    )
-    batch_indices = []
-    for lp, l in zip(logprobs, audio_features_len):
-        batch_indices.append(torch.unique_consecutive(torch.argmax(lp[:l], dim=-1), dim=0).detach().cpu().numpy())
+    with run_ctx.rtf.batch(audio_len_s=audio_len_batch, num_seqs=len(tags)):
+        with run_ctx.rtf.section("AM"):
+            logprobs, audio_features_len = model(
+                raw_audio=raw_audio,
+                raw_audio_len=raw_audio_len,
+            )
 
-    am_time = time.time() - am_start
-    run_ctx.total_time += am_time
-    print("Batch-time: %.2f, Batch-RTF: %.3f" % (am_time, am_time / audio_len_batch))
+        with run_ctx.rtf.section("Search"):
+            tokens, num_tokens = greedy_decode(logprobs, audio_features_len, keep_label=run_ctx.keep_label)
+
+        with run_ctx.rtf.section("Output"):
+            words = run_ctx.label_array[tokens]
+            texts = [" ".join(seq_words) for seq_words in np.split(words, np.cumsum(num_tokens)[:-1])]
+            # one string for the whole batch, such that the BPE merging is only done once
+            texts = "\n".join(texts).replace("@@ ", "").split("\n")
+            for text, tag in zip(texts, tags):
+                if run_ctx.verbose:
+                    print(text)
+                run_ctx.recognition_file.write("%s: %s,\n" % (repr(tag), repr(text)))
 
-    tags = data["seq_tag"]
 
+def greedy_decode(logprobs: torch.Tensor, seq_lens: torch.Tensor, *, keep_label: torch.Tensor):
+    """
+    Batched greedy CTC decoding: argmax, collapse repeated labels, remove blank (and other labels not to be kept).
+    Only the final result is transferred to the CPU.
 
-    for indices, tag in zip(batch_indices, tags):
-        print(indices)
-        sequence = [run_ctx.labels[idx] for idx in indices if idx < len(run_ctx.labels)]
-        sequence = [s for s in sequence if (not s.startswith("<") and not s.startswith("["))]
-        text = " ".join(sequence).replace("@@ ","")
-        print(text)
-        run_ctx.recognition_file.write("%s: %s,\n" % (repr(tag), repr(text)))
\ No newline at end of file
+    :param logprobs: [B, T, V]
+    :param seq_lens: [B]
+    :param keep_label: [V'] bool, whether to keep label index v in the output. Indices >= V' (e.g. blank) are removed
+    :return: label indices of all sequences concatenated, number of labels per sequence [B]
+    """
+    batch_size, time_size, num_classes = logprobs.shape
+    device = logprobs.device
+    best = torch.argmax(logprobs, dim=-1)  # [B, T]
+    keep_label = torch.cat(
+        [keep_label.to(device), torch.zeros(max(num_classes - keep_label.shape[0], 0), dtype=torch.bool, device=device)]
+    )  # [V]
+    mask = torch.arange(time_size, device=device)[None, :] < seq_lens.to(device)[:, None]  # [B, T]
+    mask[:, 1:] &= best[:, 1:] != best[:, :-1]  # collapse repetitions
+    mask &= keep_label[best]
+    num_tokens = mask.sum(dim=1)  # [B]
+    result = torch.cat([num_tokens, best[mask]]).cpu().numpy()
+    return result[batch_size:], result[:batch_size]
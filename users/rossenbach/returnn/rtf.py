@@ -0,0 +1,48 @@
+import csv
+import json
+from typing import Dict
+
+from sisyphus import Job, Task, tk
+
+
+class AggregateRTFReportsJob(Job):
+    """
+    Collects the summaries of multiple RTF reports, as written by
+    :class:`i6_experiments.common.helpers.rtf.RTFProfiler` in the forward jobs, into one table.
+    """
+
+    def __init__(self, reports: Dict[str, tk.Path]):
+        """
+
+        :param reports: name (e.g. experiment/corpus) -> rtf.json of the forward job
+        """
+        self.reports = reports
+        self.out_report_json = self.output_path("rtf_summary.json")
+        self.out_report_csv = self.output_path("rtf_summary.csv")
+
+    def tasks(self):
+        yield Task("run", mini_task=True)
+
+    def run(self):
+        summaries = {}
+        for name, report in sorted(self.reports.items()):
+            with open(report.get_path(), "rt") as f:
+                summaries[name] = json.load(f)["summary"]
+
+        with open(self.out_report_json.get_path(), "wt") as f:
+            json.dump(summaries, f, indent=2)
+            f.write("\n")
+
+        section_names = sorted({section for summary in summaries.values() for section in summary["sections"]})
+        with open(self.out_report_csv.get_path(), "wt", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                ["name", "audio_s", "total_s", "rtf", "wall_rtf", "peak_memory_bytes"]
+                + ["%s_rtf" % section for section in section_names]
+            )
+            for name, summary in summaries.items():
+                writer.writerow(
+                    [name]
+                    + [summary[key] for key in ["audio_s", "total_s", "rtf", "wall_rtf", "peak_memory_bytes"]]
+                    + [summary["section_rtf"].get(section) for section in section_names]
+                )
@@ -1,9 +1,10 @@
 from sisyphus import *
 
 import numpy as np
-import h5py
 from typing import Optional
 
+from i6_experiments.common.helpers.hdf import SimpleHDFReader
+
 
 class ComputeSearchErrorsJob(Job):
     def __init__(
@@ -38,22 +39,16 @@ class ComputeSearchErrorsJob(Job):
             ("ground_truth_targets", self.ground_truth_targets_hdf.get_path()),
             ("search_targets", self.search_targets_hdf.get_path()),
         ):
-            with h5py.File(data_hdf, "r") as f:
-                seq_tags = f["seqTags"][()]
-                seq_tags = [str(tag) for tag in seq_tags]  # convert from byte to string
+            with SimpleHDFReader(data_hdf) as reader:
                 # initialize the keys of the data_dict once
                 if len(data_dict) == 0:
-                    for seq_tag in seq_tags:
+                    for seq_tag in reader.tags:
                         data_dict[seq_tag] = {}
 
-                # the data and seq lens
-                hdf_data = f["inputs"][()]
-                seq_lens = f["seqLengths"][()][:, 0]
-                # cut out each seq from the flattened 1d tensor according to its seq len and store it in the dict
+                # each seq is cut out of the flattened 1d tensor according to its seq len and stored in the dict
                 # indexed by its seq tag
-                for i, seq_len in enumerate(seq_lens):
-                    data_dict[seq_tags[i]][data_name] = hdf_data[:seq_len]
-                    hdf_data = hdf_data[seq_len:]
+                for seq_tag, seq_data in reader.iter_seqs():
+                    data_dict[seq_tag][data_name] = seq_data
 
         num_seqs = 0
         num_search_errors = 0
@@ -0,0 +1,172 @@
+"""
+Beam search with fixed tensor shapes
+"""
+
+from __future__ import annotations
+from typing import Optional, Any, Tuple, Dict
+
+import functools
+from dataclasses import dataclass
+import torch
+import tree
+
+from .interface import LabelScorerIntf
+from .utils import top_k_nd, batch_gather, batch_gather_, combine_individual_seq_scores
+
+
+@dataclass
+class BeamSearchFixedShapeOpts:
+    beam_size: int  # e.g. 12
+    length_normalization_exponent: float  # e.g. 1 to enable, 0 to disable
+    bos_label: int
+    eos_label: int
+    num_labels: int
+
+    check_ended_every: int = 8  # check for termination (needs host sync) only every k steps
+    compile_step: bool = False  # wrap the per-step function with torch.compile
+
+
+def beam_search_fixed_shape(
+    label_scorer: LabelScorerIntf,
+    *,
+    batch_size: int,
+    max_seq_len: torch.Tensor,
+    device: torch.device,
+    opts: BeamSearchFixedShapeOpts,
+    out_individual_seq_scores: Optional[Dict[str, torch.Tensor]] = None,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Beam search, same as :func:`beam_search_v5` (without cheating targets),
+    but all per-step tensors have a fixed shape, and there is no host sync in every step.
+
+    * The beam is [Batch,Beam] right from the start (the initial state is expanded, all but the first
+      hyp start with a very low score), thus the per-step function has static shapes.
+    * Targets and backrefs are written into preallocated [Batch,Beam,MaxLen] buffers.
+    * The step counter is a device tensor.
+    * We check whether all hyps ended only every ``opts.check_ended_every`` steps.
+      The additional steps do not change the result:
+      ended hyps only get extended by EOS with score 0,
+      and the length normalization factors for ended hyps telescope.
+
+    This makes the step function usable with ``torch.compile`` (see ``opts.compile_step``)
+    and CUDA graphs.
+
+    :param label_scorer:
+    :param batch_size:
+    :param max_seq_len: e.g. use encoder length. shape [Batch]
+    :param device:
+    :param opts:
+    :param out_individual_seq_scores: if set, fills in: key -> [Batch,FinalBeam]
+    :return: seq_targets, seq_log_prob, out_seq_len:
+        seq_targets: [Batch,FinalBeam,OutSeqLen]
+        seq_log_prob: [Batch,FinalBeam]
+        out_seq_len: [Batch,FinalBeam]
+    """
+    beam_size = opts.beam_size
+    max_seq_len = max_seq_len.to(device)
+    max_len = int(max_seq_len.max())  # single host sync, needed for the buffer sizes
+
+    # Initial state, expanded to the full beam.
+    state = label_scorer.get_initial_state(batch_size=batch_size, device=device)
+    state = tree.map_structure(
+        functools.partial(
+            batch_gather_, indices=torch.zeros([batch_size, beam_size], dtype=torch.int64, device=device)
+        ),
+        state,
+    )  # [Batch,Beam,...]
+    target = torch.full([batch_size, beam_size], opts.bos_label, device=device)
+    ended = torch.full([batch_size, beam_size], False, device=device)
+    out_seq_len = torch.full([batch_size, beam_size], 0, device=device)
+    seq_log_prob = torch.where(torch.arange(beam_size, device=device) == 0, 0.0, -1.0e30)[None, :].expand(
+        batch_size, beam_size
+    )  # [Batch,Beam]
+
+    masked_finished_log_prob = torch.where(
+        torch.arange(0, opts.num_labels, device=device) == opts.eos_label, 0.0, -1.0e30
+    )  # [Vocab]
+
+    seq_targets = torch.full([batch_size, beam_size, max_len], opts.eos_label, device=device)
+    seq_backrefs = torch.zeros([batch_size, beam_size, max_len], dtype=torch.int64, device=device)
+    num_steps_all_ended = torch.full((), max_len, device=device)  # first step where all hyps ended
+
+    def _step(
+        state_: Any,
+        target_: torch.Tensor,
+        seq_log_prob_: torch.Tensor,
+        ended_: torch.Tensor,
+        out_seq_len_: torch.Tensor,
+        individual_seq_scores: Dict[str, torch.Tensor],
+        i: torch.Tensor,
+    ):
+        seq_log_prob_ext, individual_scores, new_state = label_scorer.seq_score_ext_and_update_state(
+            prev_seq_scores=seq_log_prob_, prev_state=state_, prev_label=target_
+        )
+        # seq_log_prob_ext: [Batch,Beam,Vocab]
+
+        # Filter out finished beams
+        seq_log_prob_ext = torch.where(
+            ended_[:, :, None], seq_log_prob_[:, :, None] + masked_finished_log_prob[None, None, :], seq_log_prob_ext
+        )
+        seq_log_prob_, (backrefs, target_) = top_k_nd(seq_log_prob_ext, k=beam_size, dim=[1, 2])  # all [Batch,Beam]
+        del seq_log_prob_ext
+        if out_individual_seq_scores is not None:
+            individual_seq_scores = {
+                k: torch.where(ended_, individual_seq_scores[k], v) if individual_seq_scores else v
+                for k, v in combine_individual_seq_scores(
+                    individual_seq_scores, individual_scores, beam_backrefs=backrefs, labels=target_
+                ).items()
+            }
+        state_ = tree.map_structure(functools.partial(batch_gather_, indices=backrefs), new_state)  # [Batch,Beam,...]
+        ended_ = batch_gather(ended_, indices=backrefs)  # [Batch,Beam]
+        out_seq_len_ = batch_gather(out_seq_len_, indices=backrefs)  # [Batch,Beam]
+        i = i + 1
+
+        ended_ = ended_ | (target_ == opts.eos_label)
+        ended_ = ended_ | (i >= max_seq_len)[:, None]  # [Batch,Beam]
+        return state_, target_, backrefs, seq_log_prob_, ended_, out_seq_len_, individual_seq_scores, i
+
+    step_func = torch.compile(_step) if opts.compile_step else _step
+
+    individual_seq_scores_ = {}
+    i = torch.zeros((), dtype=torch.int64, device=device)
+    num_steps = 0
+    while True:
+        state, target, backrefs, seq_log_prob, ended, out_seq_len, individual_seq_scores_, i = step_func(
+            state, target, seq_log_prob, ended, out_seq_len, individual_seq_scores_, i
+        )
+        seq_targets[:, :, num_steps] = target
+        seq_backrefs[:, :, num_steps] = backrefs
+        num_steps += 1
+
+        all_ended = ended.all()
+        num_steps_all_ended = torch.where(all_ended, torch.minimum(num_steps_all_ended, i), num_steps_all_ended)
+        if num_steps >= max_len or (num_steps % opts.check_ended_every == 0 and all_ended):
+            break
+
+        if opts.length_normalization_exponent != 0:
+            # See beam_search_v5. Once a hyp ended, these factors telescope,
+            # thus additional steps after all hyps ended do not change the final score.
+            seq_log_prob = seq_log_prob * torch.where(
+                ended,
+                ((i + 1) / i) ** opts.length_normalization_exponent,
+                1.0,
+            )
+
+        out_seq_len = out_seq_len + torch.where(ended, 0, 1)
+
+    if opts.length_normalization_exponent != 0:
+        seq_log_prob = seq_log_prob * (1 / i) ** opts.length_normalization_exponent
+
+    if out_individual_seq_scores is not None:
+        out_individual_seq_scores.update(individual_seq_scores_)
+
+    # Backtrack via backrefs, resolve beams. Steps after all hyps ended only append EOS, thus we can cut them off.
+    out_len = int(num_steps_all_ended)  # host sync, once
+    seq_targets_ = torch.empty([batch_size, beam_size, out_len], dtype=seq_targets.dtype, device=device)
+    indices = torch.arange(beam_size, device=device)[None, :].expand(batch_size, -1)  # [Batch,FinalBeam] -> FinalBeam
+    for t in reversed(range(num_steps)):
+        if t < out_len:
+            seq_targets_[:, :, t] = batch_gather(seq_targets[:, :, t], indices=indices)  # [Batch,FinalBeam]
+        indices = batch_gather(seq_backrefs[:, :, t], indices=indices)  # [Batch,FinalBeam] -> PrevBeam
+
+    return seq_targets_, seq_log_prob, out_seq_len
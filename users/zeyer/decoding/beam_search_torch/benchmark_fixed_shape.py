@@ -0,0 +1,129 @@
+"""
+CPU benchmark: :func:`beam_search_fixed_shape` vs :func:`beam_search_v5` with a dummy label scorer.
+
+Reports steps/sec and peak memory (max RSS of a fresh subprocess per variant),
+and checks that both variants give the same result.
+
+Usage::
+
+    python -m i6_experiments.users.zeyer.decoding.beam_search_torch.benchmark_fixed_shape
+"""
+
+from __future__ import annotations
+from typing import Any, Tuple, Dict
+
+import argparse
+import multiprocessing
+import resource
+import time
+import torch
+
+from .interface import LabelScorerIntf
+
+
+class DummyLabelScorer(LabelScorerIntf):
+    """
+    Small recurrent scorer with random weights. State: {"h": [Batch,Beam,Dim]}.
+    """
+
+    def __init__(self, *, num_labels: int, dim: int = 256, eos_label: int = 0, seed: int = 42):
+        gen = torch.Generator().manual_seed(seed)
+        self.embed = torch.randn(num_labels, dim, generator=gen) * 0.1
+        self.out = torch.randn(dim, num_labels, generator=gen) * 0.1
+        self.out[:, eos_label] -= 0.05  # end a bit later
+        self.dim = dim
+
+    def get_initial_state(self, *, batch_size: int, device: torch.device) -> Any:
+        """initial state"""
+        return {"h": torch.zeros(batch_size, 1, self.dim, device=device)}
+
+    def score_and_update_state(self, *, prev_state: Any, prev_label: torch.Tensor) -> Tuple[torch.Tensor, Any]:
+        """score, state"""
+        h = torch.tanh(prev_state["h"] + self.embed[prev_label])  # [Batch,Beam,Dim]
+        return torch.log_softmax(h @ self.out, dim=-1), {"h": h}
+
+
+def _run(variant: str, args: Dict[str, Any], queue: multiprocessing.Queue):
+    from .beam_search_v5 import BeamSearchOptsV5, beam_search_v5
+    from .beam_search_fixed_shape import BeamSearchFixedShapeOpts, beam_search_fixed_shape
+
+    torch.set_num_threads(args["threads"])
+    scorer = DummyLabelScorer(num_labels=args["num_labels"])
+    batch_size = args["batch_size"]
+    max_seq_len = torch.full([batch_size], args["max_seq_len"])
+    common = dict(
+        beam_size=args["beam_size"],
+        length_normalization_exponent=1.0,
+        bos_label=0,
+        eos_label=0,
+        num_labels=args["num_labels"],
+    )
+
+    def _search():
+        if variant == "v5":
+            return beam_search_v5(
+                scorer,
+                batch_size=batch_size,
+                max_seq_len=max_seq_len,
+                device=torch.device("cpu"),
+                opts=BeamSearchOptsV5(**common),
+            )
+        return beam_search_fixed_shape(
+            scorer,
+            batch_size=batch_size,
+            max_seq_len=max_seq_len,
+            device=torch.device("cpu"),
+            opts=BeamSearchFixedShapeOpts(**common, check_ended_every=args["check_ended_every"]),
+        )
+
+    _search()  # warmup
+    start = time.perf_counter()
+    for _ in range(args["repetitions"]):
+        seq_targets, seq_log_prob, out_seq_len = _search()
+    elapsed = time.perf_counter() - start
+    num_steps = seq_targets.shape[2] * args["repetitions"]
+    queue.put(
+        {
+            "steps_per_sec": num_steps / elapsed,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "result": (seq_targets.tolist(), seq_log_prob.tolist(), out_seq_len.tolist()),
+        }
+    )
+
+
+def main():
+    """main"""
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--batch-size", type=int, default=32)
+    arg_parser.add_argument("--beam-size", type=int, default=12)
+    arg_parser.add_argument("--num-labels", type=int, default=1000)
+    arg_parser.add_argument("--max-seq-len", type=int, default=100)
+    arg_parser.add_argument("--check-ended-every", type=int, default=8)
+    arg_parser.add_argument("--repetitions", type=int, default=5)
+    arg_parser.add_argument("--threads", type=int, default=1)
+    args = vars(arg_parser.parse_args())
+
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for variant in ["v5", "fixed_shape"]:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run, args=(variant, args, queue))
+        proc.start()
+        results[variant] = queue.get()
+        proc.join()
+        print(
+            f"{variant:>12}: {results[variant]['steps_per_sec']:8.1f} steps/sec,"
+            f" peak RSS {results[variant]['peak_rss_mb']:8.1f} MB"
+        )
+
+    (targets_a, log_prob_a, len_a), (targets_b, log_prob_b, len_b) = (
+        [torch.tensor(v) for v in results[variant]["result"]] for variant in ["v5", "fixed_shape"]
+    )
+    assert targets_a.shape == targets_b.shape, f"{targets_a.shape} vs {targets_b.shape}"
+    assert (targets_a == targets_b).all() and (len_a == len_b).all()
+    torch.testing.assert_close(log_prob_a, log_prob_b)
+    print("results are equal")
+
+
+if __name__ == "__main__":
+    main()
@@ -188,9 +188,14 @@ def search_dataset(
         )
         res = search_job.out_search_file
     else:
-        out_files = [_v2_forward_out_filename]
-        if config and config.get("__recog_def_ext", False):
-            out_files.append(_v2_forward_ext_out_filename)
+        recog_output_format = config.get("__recog_output_format", "py") if config else "py"
+        if recog_output_format == "records":
+            out_files = [_v2_forward_records_out_filename]
+        else:
+            assert recog_output_format == "py", f"invalid __recog_output_format {recog_output_format!r}"
+            out_files = [_v2_forward_out_filename]
+            if config and config.get("__recog_def_ext", False):
+                out_files.append(_v2_forward_ext_out_filename)
         forward_job = ReturnnForwardJobV2(
             model_checkpoint=model.checkpoint,
             returnn_config=search_config_v2(
@@ -201,7 +206,11 @@ def search_dataset(
             returnn_root=tools_paths.get_returnn_root(),
             mem_rqmt=search_mem_rqmt,
         )
-        res = forward_job.out_files[_v2_forward_out_filename]
+        if recog_output_format == "records":
+            # The following scoring jobs expect the legacy format.
+            res = ConvertRecogRecordsToPyJob(forward_job.out_files[_v2_forward_records_out_filename]).out_search_results
+        else:
+            res = forward_job.out_files[_v2_forward_out_filename]
     if recog_def.output_blank_label:
         res = SearchRemoveLabelJob(res, remove_label=recog_def.output_blank_label, output_gzip=True).out_search_results
     for f in recog_post_proc_funcs:  # for example BPE to words
@@ -497,6 +506,7 @@ def _returnn_v2_forward_step(*, model, extern_data: TensorDict, **_kwargs_unused
 
 _v2_forward_out_filename = "output.py.gz"
 _v2_forward_ext_out_filename = "output_ext.py.gz"
+_v2_forward_records_out_filename = "output.recog_records"  # see users.zeyer.utils.recog_records
 
 
 def _returnn_v2_get_forward_callback():
@@ -507,15 +517,23 @@ def _returnn_v2_get_forward_callback():
 
     config = get_global_config()
     recog_def_ext = config.bool("__recog_def_ext", False)
+    recog_output_format = config.value("__recog_output_format", "py")
 
     class _ReturnnRecogV2ForwardCallbackIface(ForwardCallbackIface):
         def __init__(self):
             self.out_file: Optional[TextIO] = None
             self.out_ext_file: Optional[TextIO] = None
+            self.out_records = None
 
         def init(self, *, model):
             import gzip
 
+            if recog_output_format == "records":
+                from i6_experiments.users.zeyer.utils.recog_records import RecogRecordsWriter
+
+                self.out_records = RecogRecordsWriter(_v2_forward_records_out_filename)
+                return
+
             self.out_file = gzip.open(_v2_forward_out_filename, "wt")
             self.out_file.write("{\n")
 
@@ -534,6 +552,22 @@ def _returnn_v2_get_forward_callback():
             if hyps_len.raw_tensor.shape:
                 assert scores.raw_tensor.shape == hyps_len.raw_tensor.shape  # (beam,)
             num_beam = hyps.raw_tensor.shape[0]
+            if self.out_records:
+                hyp_ids = [
+                    hyps.raw_tensor[i, : hyps_len.raw_tensor[i] if hyps_len.raw_tensor.shape else hyps_len.raw_tensor]
+                    for i in range(num_beam)
+                ]
+                ext = None
+                if recog_def_ext:
+                    ext = {k: v.raw_tensor for k, v in outputs.data.items() if k not in {"hyps", "scores"}}
+                self.out_records.write(
+                    seq_tag=seq_tag,
+                    scores=scores.raw_tensor,
+                    hyp_ids=hyp_ids,
+                    hyps=[hyps.sparse_dim.vocab.get_seq_labels(ids) for ids in hyp_ids],
+                    ext=ext,
+                )
+                return
             # Consistent to old search task, list[(float,str)].
             self.out_file.write(f"{seq_tag!r}: [\n")
             for i in range(num_beam):
@@ -555,6 +589,9 @@ def _returnn_v2_get_forward_callback():
                 self.out_ext_file.write("],\n")
 
         def finish(self):
+            if self.out_records:
+                self.out_records.close()
+                return
             self.out_file.write("}\n")
             self.out_file.close()
             if self.out_ext_file:
@@ -564,6 +601,38 @@ def _returnn_v2_get_forward_callback():
     return _ReturnnRecogV2ForwardCallbackIface()
 
 
+class ConvertRecogRecordsToPyJob(sisyphus.Job):
+    """
+    Converts the compact recog output (see :mod:`i6_experiments.users.zeyer.utils.recog_records`)
+    back to the legacy Python-literal format, as expected e.g. by the i6_core search jobs.
+    """
+
+    def __init__(self, recog_records: tk.Path, *, with_ext: bool = False):
+        """
+        :param recog_records: written by the forward callback with ``__recog_output_format="records"``
+        :param with_ext: also write ``output_ext.py.gz``
+        """
+        super().__init__()
+        self.recog_records = recog_records
+        self.with_ext = with_ext
+        self.out_search_results = self.output_path(_v2_forward_out_filename)
+        self.out_search_results_ext = self.output_path(_v2_forward_ext_out_filename) if with_ext else None
+
+    def tasks(self) -> Iterator[sisyphus.Task]:
+        """tasks"""
+        yield sisyphus.Task("run", mini_task=True)
+
+    def run(self):
+        """run"""
+        from i6_experiments.users.zeyer.utils.recog_records import recog_records_to_py
+
+        recog_records_to_py(
+            self.recog_records.get_path(),
+            out_filename=self.out_search_results.get_path(),
+            out_ext_filename=self.out_search_results_ext.get_path() if self.with_ext else None,
+        )
+
+
 class GetBestRecogTrainExp(sisyphus.Job):
     """
     Collect all info from recogs.
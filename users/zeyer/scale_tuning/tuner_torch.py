@@ -2,11 +2,14 @@
 Auto scaling, based on recog output.
 """
 
+from typing import Optional, Any, Dict, List, Sequence, Tuple
+import os
 import sys
 import argparse
 import gzip
+import hashlib
+import multiprocessing
 import torch
-import torchaudio
 
 
 def main():
@@ -15,7 +18,8 @@ def main():
     arg_parser.add_argument(
         "recog_output_dir",
         nargs="+",
-        help="from our recog, expect output.py.gz and output_ext.py.gz. assume first entry is ground truth",
+        help="from our recog, expect output.recog_records, or output.py.gz and output_ext.py.gz."
+        " assume first entry is ground truth",
     )
     arg_parser.add_argument("--device", default="cpu")
     arg_parser.add_argument("--num-steps", type=int, default=10_000)
@@ -29,70 +33,38 @@ def main():
     arg_parser.add_argument("--train-len-norm", type=int, default=True)
     arg_parser.add_argument("--fix-scale0", type=int, default=True)
     arg_parser.add_argument("--softmax-temperature", type=float, default=10)
+    arg_parser.add_argument(
+        "--cache-dir",
+        default=os.path.expanduser("~/.cache/i6_experiments/scale_tuning"),
+        help="cache for the preprocessed data (scores, token counts, errors), keyed by the input files."
+        " empty string to disable",
+    )
+    arg_parser.add_argument("--num-workers", type=int, default=os.cpu_count(), help="for the error computation")
     args = arg_parser.parse_args()
     device = torch.device(args.device)
     torch.manual_seed(args.random_seed)
 
-    keys = []  # len: scores
-    entries_scores = []  # list of sequences over tensor shape [beam,scores]
-    entries_hyp_num_tokens = []  # list of sequences over tensor shape [beam]
-    entries_num_err = []  # list of sequences over tensor shape [beam]
-    total_num_ref_words = 0
+    data = _get_preprocessed_data(args.recog_output_dir, cache_dir=args.cache_dir or None, num_workers=args.num_workers)
+    keys = data["keys"]  # len: scores
+    print("Score keys:", keys)
+    key_signs = [1.0 if "_neg_" not in key else -1.0 for key in keys]
+    print("Key signs:", key_signs)
+    print("Beam size:", data["scores"].shape[1])
 
-    hyps = {}
-    exts = {}
-    for fn in args.recog_output_dir:
-        print(f"* Reading entries from {fn}...")
-        with gzip.open(fn + "/output.py.gz", "rt") as f:
-            hyps_f = eval(f.read())
-        with gzip.open(fn + "/output_ext.py.gz", "rt") as f:
-            exts_f = eval(f.read())
-        assert isinstance(hyps_f, dict) and isinstance(exts_f, dict) and set(hyps_f) == set(exts_f)
-        assert not set(hyps_f.keys()).intersection(hyps.keys())
-        hyps.update(hyps_f)
-        exts.update(exts_f)
-
-    print(f"* Processing data...")
-    seq_tags = list(hyps)
+    seq_tags = data["seq_tags"]
     print("Num seqs:", len(seq_tags))
-    seq_tags = [seq_tags[i] for i in torch.randperm(len(seq_tags))]
+    seq_indices = torch.randperm(len(seq_tags))
     if args.seqs_start != 0 or args.seqs_end != 1:
         assert 0 <= args.seqs_start <= 1 and 0 <= args.seqs_end <= 1 and args.seqs_start <= args.seqs_end
         start = int(args.seqs_start * len(seq_tags))
         end = int(args.seqs_end * len(seq_tags))
-        seq_tags = seq_tags[start:end]
-        print(f"Selected subset (after shuffling): [{start}:{end}], num seqs: {len(seq_tags)}")
+        seq_indices = seq_indices[start:end]
+        print(f"Selected subset (after shuffling): [{start}:{end}], num seqs: {len(seq_indices)}")
 
-    key_signs = None
-    for seq_tag in seq_tags:
-        hyps_ = hyps[seq_tag]
-        exts_ = exts[seq_tag]
-        assert isinstance(hyps_, list) and isinstance(exts_, list) and len(hyps_) == len(exts_)
-        if not keys:
-            keys = list(exts_[0].keys())
-            print("Score keys:", keys)
-            key_signs = [1.0 if "_neg_" not in key else -1.0 for key in keys]
-            print("Key signs:", key_signs)
-            print("Beam size:", len(hyps_))
-        ref_words = hyps_[0][1].replace("@@ ", "").split()
-        total_num_ref_words += len(ref_words)
-        scores_ls = []
-        hyp_num_tokens_ls = []
-        num_err_ls = []
-        for (_, hyp), ext in zip(hyps_, exts_):
-            hyp_num_tokens = len(hyp.split())
-            hyp_words = hyp.replace("@@ ", "").split()
-            num_errors = torchaudio.functional.edit_distance(ref_words, hyp_words)
-            scores_ls.append(torch.tensor([ext[key] for key in keys]))
-            hyp_num_tokens_ls.append(float(hyp_num_tokens))
-            num_err_ls.append(float(num_errors))
-        entries_scores.append(torch.stack(scores_ls))
-        entries_hyp_num_tokens.append(torch.tensor(hyp_num_tokens_ls))
-        entries_num_err.append(torch.tensor(num_err_ls))
-
-    entries_scores = torch.stack(entries_scores)  # [seqs,beam,scores]
-    entries_hyp_num_tokens = torch.stack(entries_hyp_num_tokens)  # [seqs,beam]
-    entries_num_err = torch.stack(entries_num_err)  # [seqs,beam]
+    entries_scores = data["scores"][seq_indices]  # [seqs,beam,scores]
+    entries_hyp_num_tokens = data["hyp_num_tokens"][seq_indices]  # [seqs,beam]
+    entries_num_err = data["num_err"][seq_indices]  # [seqs,beam]
+    total_num_ref_words = int(data["num_ref_words"][seq_indices].sum())
     entries_num_err /= total_num_ref_words
 
     key_signs = torch.tensor(key_signs, device=device)  # [scores]
@@ -173,6 +145,132 @@ def main():
             print(f"(Or scale0 fixed anyway: Final loss: {_loss():.4f}, err: {_err():.4f}, {_scales_str()})")
 
 
+_PreprocessedDataVersion = 1
+
+
+def _get_preprocessed_data(
+    recog_output_dirs: Sequence[str], *, cache_dir: Optional[str], num_workers: int
+) -> Dict[str, Any]:
+    """
+    Reads the recog outputs and computes everything which does not depend on the tuning
+    (scores, num tokens, num errors) once for all seqs.
+    The result is cached in cache_dir, keyed by the input files (path, size, mtime).
+
+    :return: dict with
+        seq_tags: list of all seq tags, in order of the inputs,
+        keys: score keys,
+        scores: [seqs,beam,scores],
+        hyp_num_tokens: [seqs,beam],
+        num_err: [seqs,beam], unnormalized,
+        num_ref_words: [seqs]
+    """
+    cache_fn = None
+    if cache_dir:
+        h = hashlib.sha256(f"version {_PreprocessedDataVersion}\n".encode("utf8"))
+        for fn in recog_output_dirs:
+            for name in sorted(os.listdir(fn)):
+                if name.startswith("output"):
+                    st = os.stat(f"{fn}/{name}")
+                    h.update(f"{os.path.realpath(fn)}/{name} {st.st_size} {st.st_mtime_ns}\n".encode("utf8"))
+        cache_fn = f"{cache_dir}/{h.hexdigest()}.pt"
+        if os.path.exists(cache_fn):
+            print(f"* Loading preprocessed data from cache {cache_fn}")
+            return torch.load(cache_fn)
+
+    hyps = {}
+    exts = {}
+    for fn in recog_output_dirs:
+        print(f"* Reading entries from {fn}...")
+        hyps_f, exts_f = _read_recog_output(fn)
+        assert isinstance(hyps_f, dict) and isinstance(exts_f, dict) and set(hyps_f) == set(exts_f)
+        assert not set(hyps_f.keys()).intersection(hyps.keys())
+        hyps.update(hyps_f)
+        exts.update(exts_f)
+
+    print(f"* Processing data...")
+    seq_tags = list(hyps)
+    keys = list(exts[seq_tags[0]][0].keys())
+    scores = []
+    for seq_tag in seq_tags:
+        hyps_ = hyps[seq_tag]
+        exts_ = exts[seq_tag]
+        assert isinstance(hyps_, list) and isinstance(exts_, list) and len(hyps_) == len(exts_)
+        scores.append([[ext[key] for key in keys] for ext in exts_])
+
+    with multiprocessing.Pool(max(num_workers, 1)) as pool:
+        counts = pool.map(
+            _count_tokens_and_errors,
+            ([hyp for _, hyp in hyps[seq_tag]] for seq_tag in seq_tags),
+            chunksize=max(len(seq_tags) // (max(num_workers, 1) * 4), 1),
+        )
+    hyp_num_tokens, num_err, num_ref_words = zip(*counts)
+
+    data = {
+        "seq_tags": seq_tags,
+        "keys": keys,
+        "scores": torch.tensor(scores),  # [seqs,beam,scores]
+        "hyp_num_tokens": torch.tensor(hyp_num_tokens, dtype=torch.float32),  # [seqs,beam]
+        "num_err": torch.tensor(num_err, dtype=torch.float32),  # [seqs,beam]
+        "num_ref_words": torch.tensor(num_ref_words),  # [seqs]
+    }
+    if cache_fn:
+        os.makedirs(cache_dir, exist_ok=True)
+        torch.save(data, cache_fn + ".tmp")
+        os.replace(cache_fn + ".tmp", cache_fn)
+        print(f"* Stored preprocessed data in cache {cache_fn}")
+    return data
+
+
+def _count_tokens_and_errors(hyps: List[str]) -> Tuple[List[int], List[int], int]:
+    """
+    :param hyps: beam -> BPE hyp. the first one is taken as reference
+    :return: num tokens per hyp, num word errors per hyp, num ref words
+    """
+    ref_words = hyps[0].replace("@@ ", "").split()
+    num_tokens = [len(hyp.split()) for hyp in hyps]
+    num_err = [_edit_distance(ref_words, hyp.replace("@@ ", "").split()) for hyp in hyps]
+    return num_tokens, num_err, len(ref_words)
+
+
+def _edit_distance(ref: Sequence[str], hyp: Sequence[str]) -> int:
+    """Levenshtein distance, same as torchaudio.functional.edit_distance"""
+    if not ref or not hyp:
+        return len(ref) + len(hyp)
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i]
+        for j, h in enumerate(hyp, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h)))
+        prev = cur
+    return prev[-1]
+
+
+def _read_recog_output(recog_output_dir: str):
+    """
+    :return: hyps, exts, in the legacy format: seq_tag -> list of (score, hyp), seq_tag -> list of ext dict
+    """
+    records_fn = recog_output_dir + "/output.recog_records"
+    if os.path.exists(records_fn):
+        try:
+            from i6_experiments.users.zeyer.utils.recog_records import iter_recog_records
+        except ImportError:  # standalone script
+            sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/utils")
+            from recog_records import iter_recog_records
+
+        hyps, exts = {}, {}
+        for record in iter_recog_records(records_fn):
+            hyps[record.seq_tag] = list(zip(record.scores.tolist(), record.hyps))
+            ext_values = {k: v.tolist() for k, v in record.ext.items()}
+            exts[record.seq_tag] = [{k: v[i] for k, v in ext_values.items()} for i in range(len(record.hyps))]
+        return hyps, exts
+
+    with gzip.open(recog_output_dir + "/output.py.gz", "rt") as f:
+        hyps = eval(f.read())
+    with gzip.open(recog_output_dir + "/output_ext.py.gz", "rt") as f:
+        exts = eval(f.read())
+    return hyps, exts
+
+
 def batch_gather(values: torch.Tensor, *, indices: torch.Tensor) -> torch.Tensor:
     """
     :param values: shape [Batch,Indices,ValuesDims...], e.g. [Batch,InBeam,...]
@@ -0,0 +1,195 @@
+"""
+Compact binary format for recognition outputs (N-best lists), as an alternative to the Python-literal ``output.py.gz``.
+
+The file is a stream of length-prefixed records, one per sequence,
+thus it can be written incrementally and read as an iterator, without having to load it fully into memory.
+
+Layout::
+
+    magic: b"I6RECOG1"
+    per seq:
+        payload_len: uint64
+        payload:
+            seq_tag_len: uint32, seq_tag: utf8
+            num_beam: uint32, num_ext: uint32
+            scores: float64[num_beam]
+            hyp_lens: int32[num_beam]
+            hyp_ids: int32[sum(hyp_lens)]
+            hyps_text_len: uint32, hyps_text: utf8, serialized hyps (via vocab) joined by "\\n"
+            per ext key:
+                key_len: uint32, key: utf8
+                values: float64[num_beam]
+
+All numbers are little endian.
+This module only depends on numpy, so it can be used in the RETURNN forward callback
+and in standalone scripts.
+"""
+
+from __future__ import annotations
+from typing import Optional, Union, Any, BinaryIO, Dict, Iterator, List, Sequence
+from dataclasses import dataclass
+import struct
+import numpy
+
+MAGIC = b"I6RECOG1"
+
+
+@dataclass
+class RecogRecord:
+    """
+    N-best list of a single sequence
+    """
+
+    seq_tag: str
+    scores: numpy.ndarray  # [beam], float64
+    hyp_ids: List[numpy.ndarray]  # beam -> [hyp_len], int32
+    hyps: List[str]  # beam -> serialized hyp
+    ext: Dict[str, numpy.ndarray]  # key -> [beam], float64
+
+
+class RecogRecordsWriter:
+    """
+    Writes :class:`RecogRecord`, one at a time
+    """
+
+    def __init__(self, filename: str):
+        self._file: Optional[BinaryIO] = open(filename, "wb")
+        self._file.write(MAGIC)
+
+    def write(
+        self,
+        *,
+        seq_tag: str,
+        scores: Union[Sequence[float], numpy.ndarray],
+        hyp_ids: Sequence[Union[Sequence[int], numpy.ndarray]],
+        hyps: Sequence[str],
+        ext: Optional[Dict[str, Union[Sequence[float], numpy.ndarray]]] = None,
+    ):
+        """write one seq"""
+        num_beam = len(hyps)
+        assert len(scores) == len(hyp_ids) == num_beam
+        assert not any("\n" in hyp for hyp in hyps)
+        ext = ext or {}
+        parts = [_encode_str(seq_tag), struct.pack("<II", num_beam, len(ext))]
+        parts.append(numpy.asarray(scores, dtype="<f8").tobytes())
+        parts.append(numpy.array([len(ids) for ids in hyp_ids], dtype="<i4").tobytes())
+        for ids in hyp_ids:
+            parts.append(numpy.asarray(ids, dtype="<i4").tobytes())
+        parts.append(_encode_str("\n".join(hyps)))
+        for key, values in ext.items():
+            values = numpy.asarray(values, dtype="<f8")
+            assert values.shape == (num_beam,), f"ext {key!r}: expected shape ({num_beam},), got {values.shape}"
+            parts.append(_encode_str(key))
+            parts.append(values.tobytes())
+        payload = b"".join(parts)
+        self._file.write(struct.pack("<Q", len(payload)))
+        self._file.write(payload)
+
+    def close(self):
+        """close"""
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> RecogRecordsWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def iter_recog_records(filename: str) -> Iterator[RecogRecord]:
+    """
+    :param filename: written by :class:`RecogRecordsWriter`
+    :return: iterator over all records, in the order they were written
+    """
+    with open(filename, "rb") as f:
+        magic = f.read(len(MAGIC))
+        assert magic == MAGIC, f"{filename}: not a recog records file, got magic {magic!r}"
+        while True:
+            header = f.read(8)
+            if not header:
+                break
+            (payload_len,) = struct.unpack("<Q", header)
+            payload = f.read(payload_len)
+            assert len(payload) == payload_len, f"{filename}: truncated record"
+            yield _decode_record(memoryview(payload))
+
+
+def is_recog_records_file(filename: str) -> bool:
+    """check magic"""
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def recog_records_to_py(filename: str, *, out_filename: str, out_ext_filename: Optional[str] = None):
+    """
+    Converts back to the legacy format (``output.py.gz`` and ``output_ext.py.gz``),
+    as written by the RETURNN forward callback in :mod:`i6_experiments.users.zeyer.recog`.
+    """
+    from .io import generic_open
+
+    out = generic_open(out_filename, "w")
+    out_ext = generic_open(out_ext_filename, "w") if out_ext_filename else None
+    out.write("{\n")
+    if out_ext:
+        out_ext.write("{\n")
+    for record in iter_recog_records(filename):
+        out.write(f"{record.seq_tag!r}: [\n")
+        for score, hyp in zip(record.scores, record.hyps):
+            out.write(f"  ({float(score)!r}, {hyp!r}),\n")
+        out.write("],\n")
+        if out_ext:
+            out_ext.write(f"{record.seq_tag!r}: [\n")
+            for i in range(len(record.hyps)):
+                d = {k: float(v[i]) for k, v in record.ext.items()}
+                out_ext.write(f"  {d!r},\n")
+            out_ext.write("],\n")
+    out.write("}\n")
+    out.close()
+    if out_ext:
+        out_ext.write("}\n")
+        out_ext.close()
+
+
+def _encode_str(s: str) -> bytes:
+    b = s.encode("utf8")
+    return struct.pack("<I", len(b)) + b
+
+
+class _Reader:
+    def __init__(self, buf: memoryview):
+        self.buf = buf
+        self.pos = 0
+
+    def unpack(self, fmt: str) -> Any:
+        res = struct.unpack_from(fmt, self.buf, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return res
+
+    def str(self) -> str:
+        (n,) = self.unpack("<I")
+        s = bytes(self.buf[self.pos : self.pos + n]).decode("utf8")
+        self.pos += n
+        return s
+
+    def array(self, dtype: str, n: int) -> numpy.ndarray:
+        a = numpy.frombuffer(self.buf, dtype=dtype, count=n, offset=self.pos)
+        self.pos += a.nbytes
+        return a
+
+
+def _decode_record(buf: memoryview) -> RecogRecord:
+    r = _Reader(buf)
+    seq_tag = r.str()
+    num_beam, num_ext = r.unpack("<II")
+    scores = r.array("<f8", num_beam)
+    hyp_lens = r.array("<i4", num_beam)
+    hyp_ids_flat = r.array("<i4", int(hyp_lens.sum()))
+    hyp_ids = numpy.split(hyp_ids_flat, numpy.cumsum(hyp_lens)[:-1]) if num_beam else []
+    hyps = r.str().split("\n") if num_beam else []
+    ext = {}
+    for _ in range(num_ext):
+        key = r.str()
+        ext[key] = r.array("<f8", num_beam)
+    return RecogRecord(seq_tag=seq_tag, scores=scores, hyp_ids=hyp_ids, hyps=hyps, ext=ext)